@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端到端下单基准测试: 在本地模拟网关上依次运行 IBOption1Leg ~ IBOption4Leg 脚本 (自动输入 y 确认),
+统计 进程启动->下单、下单->成交 的耗时, 各类请求往返次数, 以及子进程峰值内存, 结果写成 JSON,
+便于在不同版本之间对比 resolve_contract / get_market_snapshot / place_option_order 的回归.
+
+用法:
+    python IBBenchmark.py --runs 3 --latency 0.01 --output bench_results.json
+"""
+
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from IBFakeGateway import FakeTWSGateway, MarketScript
+
+DEFAULT_SCRIPTS = ["IBOption1Leg", "IBOption2Leg", "IBOption3Leg", "IBOption4Leg"]
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_market_script(script_names, today: str = "20250301") -> MarketScript:
+    """读取各脚本顶部的腿参数, 生成覆盖这些标的/到期日/行权价的行情脚本."""
+    underlyings = {}
+    for name in script_names:
+        module = importlib.import_module(name)
+        symbol = module.spread_symbol
+        u = underlyings.setdefault(symbol, {"expirations": set(), "strikes": set()})
+        for i in range(1, 5):
+            expiry = getattr(module, f"leg{i}_expiry", None)
+            strike = getattr(module, f"leg{i}_strike", None)
+            if expiry is None or strike is None:
+                continue
+            u["expirations"].add(expiry)
+            u["strikes"].add(float(strike))
+    spec = {"today": today, "underlyings": {}}
+    for symbol, u in underlyings.items():
+        strikes = sorted(u["strikes"])
+        spec["underlyings"][symbol] = {
+            "spot": (strikes[0] + strikes[-1]) / 2.0,
+            "expirations": sorted(u["expirations"]),
+            "strikes": strikes,
+        }
+    return MarketScript(spec)
+
+
+def _first_event(events, name, after: float = 0.0):
+    for ts, ev, details in events:
+        if ev == name and ts >= after:
+            return ts, details
+    return None, None
+
+
+def run_script(gateway: FakeTWSGateway, name: str, timeout: float, verbose: bool = False) -> dict:
+    """运行一次脚本, 从网关事件流中计算各阶段耗时."""
+    env = dict(os.environ, IB_TWS_HOST="127.0.0.1", IB_TWS_PORT=str(gateway.port),
+               PYTHONUNBUFFERED="1")
+    stats_before = gateway.stats.copy()
+    event_idx = len(gateway.events)
+
+    t_start = time.monotonic()
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, f"{name}.py")],
+                            cwd=REPO_DIR, env=env, stdin=subprocess.PIPE,
+                            stdout=None if verbose else subprocess.DEVNULL,
+                            stderr=None if verbose else subprocess.DEVNULL)
+    proc.stdin.write(b"y\n")
+    proc.stdin.flush()
+
+    # 成交后追价线程还会 sleep 一个 interval 才退出, 这里等到成交即结束进程
+    deadline = t_start + timeout
+    t_filled = None
+    while time.monotonic() < deadline and proc.poll() is None:
+        t_filled, _ = _first_event(gateway.events[event_idx:], "order_filled")
+        if t_filled is not None:
+            break
+        time.sleep(0.01)
+    if proc.poll() is None:
+        time.sleep(0.2)
+        proc.terminate()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    events = gateway.events[event_idx:]
+    t_connected, _ = _first_event(events, "connected")
+    t_placed, placed = _first_event(events, "order_placed")
+    t_filled, filled = _first_event(events, "order_filled")
+    requests = gateway.stats - stats_before
+
+    def _ms(a, b):
+        return None if a is None or b is None else round((b - a) * 1000.0, 3)
+
+    return {
+        "start_to_connected_ms": _ms(t_start, t_connected),
+        "start_to_placed_ms": _ms(t_start, t_placed),
+        "connected_to_placed_ms": _ms(t_connected, t_placed),
+        "placed_to_filled_ms": _ms(t_placed, t_filled),
+        "filled": t_filled is not None,
+        "avg_fill_price": filled["avgFillPrice"] if filled else None,
+        "limit_price": placed["lmtPrice"] if placed else None,
+        "round_trips": dict(requests),
+        "round_trips_total": sum(requests.values()),
+        # Linux 上 ru_maxrss 单位为 KB
+        "peak_rss_kb": rusage.ru_maxrss,
+    }
+
+
+def _median(values):
+    values = [v for v in values if v is not None]
+    return round(statistics.median(values), 3) if values else None
+
+
+def summarize(runs) -> dict:
+    keys = ["start_to_connected_ms", "start_to_placed_ms", "connected_to_placed_ms",
+            "placed_to_filled_ms", "round_trips_total", "peak_rss_kb"]
+    return {k: _median([r[k] for r in runs]) for k in keys}
+
+
+def _git_version() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟网关上的端到端下单基准测试")
+    parser.add_argument("--scripts", nargs="+", default=DEFAULT_SCRIPTS)
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.005, help="模拟网关每个响应的延迟(秒)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--fill-mode", default="immediate", choices=["cross", "immediate"])
+    parser.add_argument("--timeout", type=float, default=60.0, help="单次运行的超时(秒)")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--verbose", action="store_true", help="显示子进程输出")
+    args = parser.parse_args()
+
+    gateway = FakeTWSGateway(port=0, script=build_market_script(args.scripts),
+                             latency=args.latency, jitter=args.jitter, fill_mode=args.fill_mode)
+    gateway.start()
+    results = {}
+    try:
+        for name in args.scripts:
+            runs = []
+            for i in range(args.runs):
+                r = run_script(gateway, name, args.timeout, args.verbose)
+                runs.append(r)
+                print(f"{name} run {i + 1}: start->placed={r['start_to_placed_ms']} ms, "
+                      f"placed->filled={r['placed_to_filled_ms']} ms, "
+                      f"round trips={r['round_trips_total']}, peak RSS={r['peak_rss_kb']} KB")
+            results[name] = {"median": summarize(runs), "runs": runs}
+    finally:
+        gateway.stop()
+
+    report = {
+        "version": _git_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "config": {"runs": args.runs, "latency": args.latency, "jitter": args.jitter,
+                   "fill_mode": args.fill_mode},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
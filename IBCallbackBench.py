@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+EWrapper 回调吞吐量微基准: 不连接 TWS, 直接把合成的或 IBRecorder 录制的 (已解码) 消息喂给
+IBApp / IBOptionDataApp 的 tickPrice / tickSize / orderStatus / openOrder,
+报告每次回调的纳秒耗时和内存分配, 用于衡量回调代码改动的影响.
+
+分配按每次回调期间 tracemalloc 的峰值增量统计 (回调内分配又释放的临时对象也计入);
+CPython 从空闲链表复用的小对象 (float、小 dict / tuple) 不经过分配器, tracemalloc 看不到.
+
+用法:
+    python IBCallbackBench.py --count 200000 --json callback_bench.json
+    python IBCallbackBench.py --log session.iblog          # 用录制的真实消息
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import types
+
+from ibapi.common import TickAttrib
+from ibapi.contract import Contract
+from ibapi.order import Order
+from ibapi.order_state import OrderState
+
+from IBOptionToolOffical import IBApp
+from IBPriceOffical import IBOptionDataApp
+from IBRecorder import read_log
+
+CALLBACKS = ["tickPrice", "tickSize", "tickOptionComputation", "orderStatus", "openOrder"]
+# 行情类回调: 第一个参数为 reqId, 需要先登记为进行中的请求
+_TICK_CALLBACKS = ("tickPrice", "tickSize", "tickOptionComputation")
+# 逐次测分配的最多调用数 (每次调用前后都要读 tracemalloc, 很慢)
+ALLOC_SAMPLE = 20000
+
+
+def synthetic_messages(callback: str, count: int, n_req_ids: int = 50, seed: int = 1):
+    """生成 count 条合成消息 (参数元组), 模拟 n_req_ids 路行情 / 订单交替推送."""
+    rng = random.Random(seed)
+    if callback == "tickPrice":
+        attrib = TickAttrib()
+        return [(1000 + i % n_req_ids, (1, 2, 4)[i % 3], round(rng.uniform(0.5, 20.0), 2), attrib)
+                for i in range(count)]
+    if callback == "tickSize":
+        return [(1000 + i % n_req_ids, (0, 3, 5)[i % 3], rng.randint(1, 500)) for i in range(count)]
+    if callback == "tickOptionComputation":
+        # (reqId, tickType=13 模型值, tickAttrib, iv, delta, optPrice, pvDividend, gamma, vega, theta, undPrice)
+        return [(1000 + i % n_req_ids, 13, None, round(rng.uniform(0.3, 1.2), 4), round(rng.uniform(-1, 1), 4),
+                 round(rng.uniform(0.5, 20.0), 2), 0.0, 0.1, 0.02, -0.05, 23.4) for i in range(count)]
+    if callback == "orderStatus":
+        msgs = []
+        for i in range(count):
+            order_id = 1 + i % n_req_ids
+            filled = (i // n_req_ids) % 10
+            msgs.append((order_id, "Submitted", float(filled), float(10 - filled), 1.23,
+                         900000 + order_id, 0, 1.23, 1, "", 0.0))
+        return msgs
+    if callback == "openOrder":
+        msgs = []
+        for i in range(n_req_ids):
+            contract = Contract()
+            contract.symbol, contract.secType = "UVXY", "OPT"
+            order = Order()
+            order.action, order.orderType = "SELL", "LMT"
+            order.totalQuantity, order.lmtPrice = 10, 1.19
+            state = OrderState()
+            state.status = "Submitted"
+            msgs.append((1 + i, contract, order, state))
+        return [msgs[i % n_req_ids] for i in range(count)]
+    raise ValueError(f"unknown callback {callback}")
+
+
+def recorded_messages(path: str, callback: str, count: int):
+    """IBRecorder 日志中该回调的参数元组, 不足 count 条时循环重复; 日志中没有该回调时返回空列表."""
+    recorded = [args for _, method, args in read_log(path) if method == callback]
+    if not recorded:
+        return []
+    return [recorded[i % len(recorded)] for i in range(count)]
+
+
+def _transient_bytes(handler, messages) -> list:
+    """每次调用期间 tracemalloc 的峰值相对调用前的增量 (字节)."""
+    get, reset = tracemalloc.get_traced_memory, tracemalloc.reset_peak
+    result = []
+    for args in messages:
+        before = get()[0]
+        reset()
+        handler(*args)
+        result.append(get()[1] - before)
+    return result
+
+
+def bench_callback(app, callback: str, messages) -> dict:
+    """对单个回调计时并统计分配; 回调中的 print 输出被重定向到 /dev/null."""
+    handler = getattr(app, callback)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # 预热: 让字典条目等状态先建立起来
+        for args in messages[:1000]:
+            handler(*args)
+
+        gc.collect()
+        gc.disable()
+        try:
+            t0 = time.perf_counter_ns()
+            for args in messages:
+                handler(*args)
+            elapsed = time.perf_counter_ns() - t0
+        finally:
+            gc.enable()
+
+        # 分配统计单独跑, 避免 tracemalloc 的开销混入计时
+        sample = messages[:ALLOC_SAMPLE]
+        gc.collect()
+        gc.disable()
+        try:
+            tracemalloc.start()
+            # 空的绑定方法走同样的测量循环, 作为测量本身的基线; 噪声上限取 99 分位, 排除偶发的尖峰.
+            # 必须是绑定方法: handler(*args) 调绑定方法时参数超过 4 个, CPython 会为前插 self 临时分配参数数组
+            baseline = _transient_bytes(types.MethodType(lambda self, *args: None, app), sample[:1000])
+            noise, base_mean = sorted(baseline)[int(0.99 * len(baseline))], sum(baseline) / len(baseline)
+            blocks0 = sys.getallocatedblocks()
+            snap0 = tracemalloc.take_snapshot()
+            transient = _transient_bytes(handler, sample)
+            snap1 = tracemalloc.take_snapshot()
+            blocks1 = sys.getallocatedblocks()
+            tracemalloc.stop()
+        finally:
+            gc.enable()
+
+    n = len(messages)
+    stats = snap1.compare_to(snap0, "filename")
+    net_bytes = sum(s.size_diff for s in stats)
+    net_allocs = sum(s.count_diff for s in stats)
+    return {
+        "calls": n,
+        "ns_per_call": elapsed / n,
+        "calls_per_sec": n / (elapsed / 1e9) if elapsed else float("inf"),
+        # 每次回调中经过分配器的临时内存 (分配后又释放的也计入), 以及有分配的调用占比
+        "alloc_bytes_per_call": max(0.0, sum(transient) / len(sample) - base_mean),
+        "allocating_calls_pct": 100.0 * sum(1 for b in transient if b > noise) / len(sample),
+        # 回调结束后仍存活的对象/字节 (净增), 持续增长说明有泄漏
+        "net_allocs_per_call": net_allocs / len(sample),
+        "net_bytes_per_call": net_bytes / len(sample),
+        "net_blocks_per_call": (blocks1 - blocks0) / len(sample),
+    }
+
+
+def run(count: int, callbacks, n_req_ids: int = 50, log: str = None) -> dict:
+    """log: IBRecorder 日志路径, 给出时用其中录制的消息代替合成消息 (日志中没有的回调跳过)."""
+    messages = {}
+    for callback in callbacks:
+        if log:
+            messages[callback] = recorded_messages(log, callback, count)
+            if not messages[callback]:
+                print(f"{callback}: not in {log}, skipped.")
+                del messages[callback]
+        else:
+            messages[callback] = synthetic_messages(callback, count, n_req_ids)
+    req_ids = {args[0] for cb in _TICK_CALLBACKS for args in messages.get(cb, ())}
+
+    results = {}
+    for app_name, factory in (("IBApp", IBApp), ("IBOptionDataApp", IBOptionDataApp)):
+        app = factory()
+        for req_id in req_ids:
+            # 列式行情表只保存进行中请求的行情 (正常由 reqMktData 登记)
+            app.quotes.open(req_id)
+            if app_name == "IBOptionDataApp":
+                # IBOptionDataApp 只接收进行中请求的行情, 先登记好模拟的快照请求
+                app._market_data_map[req_id] = {}
+        results[app_name] = {}
+        for callback, msgs in messages.items():
+            results[app_name][callback] = bench_callback(app, callback, msgs)
+    return results
+
+
+def print_results(results: dict):
+    print(f"{'app':<18}{'callback':<22}{'ns/call':>10}{'calls/s':>12}"
+          f"{'alloc B/call':>14}{'alloc %':>9}{'net allocs':>12}{'net B':>8}")
+    for app_name, per_cb in results.items():
+        for callback, r in per_cb.items():
+            print(f"{app_name:<18}{callback:<22}{r['ns_per_call']:>10.0f}{r['calls_per_sec']:>12.0f}"
+                  f"{r['alloc_bytes_per_call']:>14.1f}{r['allocating_calls_pct']:>9.1f}"
+                  f"{r['net_allocs_per_call']:>12.3f}{r['net_bytes_per_call']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EWrapper 回调吞吐量微基准")
+    parser.add_argument("--count", type=int, default=200000, help="每个回调喂入的消息数")
+    parser.add_argument("--req-ids", type=int, default=50, help="模拟的行情/订单路数")
+    parser.add_argument("--callbacks", nargs="+", default=CALLBACKS, choices=CALLBACKS)
+    parser.add_argument("--log", help="IBRecorder 录制的日志, 用其中的真实消息代替合成消息")
+    parser.add_argument("--json", help="结果另存为 JSON")
+    args = parser.parse_args()
+
+    results = run(args.count, args.callbacks, args.req_ids, args.log)
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+期权链快照的列式归档: 按天一个目录, 每列一个定长类型的二进制文件, 只追加;
+读取时用 np.memmap 直接映射, 不复制.
+
+列:
+  ts        int32   距上一行的毫秒数 (每天第一行相对当天 0 点), 同一次快照的各行为 0
+  contract  uint32  当天合约表 (meta.json 中的 [symbol, expiry, strike, right]) 的下标
+  bid / ask / last / spot
+            int32   价格 x PRICE_SCALE, 与同一合约上一次的值之差; MISSING 表示无报价
+  iv        float32 隐含波动率 (由调用方给出, 如扫描器已算好的), NaN 表示无; atm_iv 查询时按中间价补算
+
+时间和价格按差值存储, 相邻快照之间变化很小, 数值短、压缩率高;
+合约、IV 等原值列可以零拷贝读取, 差值列读取时做一次向量化的分组累加还原.
+行数由各列文件长度决定 (取最短的一列), meta.json 只在出现新合约时重写, 追加只是几次顺序写.
+
+用法:
+    archive = ChainArchive("chain_archive")
+    archive.append_snapshot("UVXY", "20250314", spot, {(strike, right): (bid, ask), ...})
+    ts, price = archive.straddle("UVXY", "20250314", 20.0)
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from IBPayoff import implied_vol
+
+PRICE_SCALE = 10000
+MISSING = np.iinfo(np.int32).min
+COLUMNS = {
+    "ts": np.int32,
+    "contract": np.uint32,
+    "bid": np.int32,
+    "ask": np.int32,
+    "last": np.int32,
+    "spot": np.int32,
+    "iv": np.float32,
+}
+PRICE_COLUMNS = ("bid", "ask", "last", "spot")
+
+
+def _day_base_ms(day: str) -> int:
+    return int(datetime.datetime.strptime(day, "%Y%m%d").timestamp() * 1000)
+
+
+def _years_to_expiry(expiry: str, now_ms: int) -> float:
+    close = datetime.datetime.strptime(expiry[:8], "%Y%m%d").replace(hour=16).timestamp() * 1000
+    return max(close - now_ms, 43200000.0) / (365.0 * 86400000.0)
+
+
+def _decode(deltas: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """按合约分组累加差值, 还原为价格 (float, 无报价为 NaN)."""
+    missing = deltas == MISSING
+    d = np.where(missing, 0, deltas).astype(np.int64)
+    order = np.argsort(ids, kind="stable")
+    ds = d[order]
+    cs = np.cumsum(ds)
+    sid = ids[order]
+    starts = np.empty(len(sid), dtype=bool)
+    starts[:1] = True
+    starts[1:] = sid[1:] != sid[:-1]
+    group = np.cumsum(starts) - 1
+    values = np.empty(len(d), dtype=float)
+    values[order] = (cs - (cs - ds)[starts][group]) / PRICE_SCALE
+    values[missing] = np.nan
+    return values
+
+
+class _Day:
+    """一天的列文件和追加状态."""
+    def __init__(self, path: str, day: str):
+        self.path = path
+        self.day = day
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        else:
+            meta = {"base_ms": _day_base_ms(day), "contracts": []}
+        self.base_ms = meta["base_ms"]
+        self.contracts = [tuple(c) for c in meta["contracts"]]
+        self.index = {c: i for i, c in enumerate(self.contracts)}
+        self._saved_contracts = len(self.contracts)
+        # 每个合约各价格列的最新整数值 (差值的基准)
+        self.last = {col: np.zeros(max(16, len(self.contracts)), dtype=np.int64) for col in PRICE_COLUMNS}
+        sizes = {col: os.path.getsize(os.path.join(path, f"{col}.bin"))
+                 if os.path.exists(os.path.join(path, f"{col}.bin")) else 0 for col in COLUMNS}
+        self.rows = min(sizes[col] // np.dtype(dtype).itemsize for col, dtype in COLUMNS.items())
+        self.files = {}
+        for col, dtype in COLUMNS.items():
+            f = open(os.path.join(path, f"{col}.bin"), "ab")
+            # 上次写到一半退出时, 丢弃各列中多出的不完整行
+            f.truncate(self.rows * np.dtype(dtype).itemsize)
+            self.files[col] = f
+        self.last_ms = self.base_ms
+        if self.rows:
+            self.last_ms += int(self.column("ts").sum(dtype=np.int64))
+            ids = self.column("contract").astype(np.int64)
+            for col in PRICE_COLUMNS:
+                deltas = self.column(col)
+                weights = np.where(deltas == MISSING, 0, deltas).astype(float)
+                self.last[col][:len(self.contracts)] = np.round(
+                    np.bincount(ids, weights=weights, minlength=len(self.contracts))).astype(np.int64)
+
+    def column(self, col: str) -> np.ndarray:
+        if not self.rows:
+            return np.empty(0, dtype=COLUMNS[col])
+        self.files[col].flush()
+        return np.memmap(os.path.join(self.path, f"{col}.bin"), dtype=COLUMNS[col], mode="r",
+                         shape=(self.rows,))
+
+    def contract_ids(self, keys) -> np.ndarray:
+        ids = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            cid = self.index.get(key)
+            if cid is None:
+                cid = self.index[key] = len(self.contracts)
+                self.contracts.append(key)
+            ids[i] = cid
+        if len(self.contracts) > len(self.last["bid"]):
+            size = 2 * len(self.contracts)
+            for col in PRICE_COLUMNS:
+                self.last[col] = np.concatenate([self.last[col], np.zeros(size - len(self.last[col]), np.int64)])
+        return ids
+
+    def encode(self, col: str, ids: np.ndarray, values: np.ndarray) -> np.ndarray:
+        present = np.isfinite(values)
+        ints = np.round(np.where(present, values, 0.0) * PRICE_SCALE).astype(np.int64)
+        out = np.full(len(ids), MISSING, dtype=np.int64)
+        last = self.last[col]
+        if len(np.unique(ids)) == len(ids):
+            out[present] = ints[present] - last[ids[present]]
+            last[ids[present]] = ints[present]
+        else:
+            # 同一批中同一合约出现多次, 按顺序逐行编码
+            for i in np.flatnonzero(present):
+                out[i] = ints[i] - last[ids[i]]
+                last[ids[i]] = ints[i]
+        if np.any(out[present] <= MISSING) or np.any(out[present] > np.iinfo(np.int32).max):
+            raise ValueError(f"{col} delta out of int32 range")
+        return out.astype(np.int32)
+
+    def write(self, columns: dict):
+        # 有新合约时先写合约表, 再写引用它们的行
+        if len(self.contracts) != self._saved_contracts:
+            meta = {"base_ms": self.base_ms, "contracts": [list(c) for c in self.contracts]}
+            tmp = os.path.join(self.path, "meta.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp, os.path.join(self.path, "meta.json"))
+            self._saved_contracts = len(self.contracts)
+        for col, values in columns.items():
+            self.files[col].write(np.ascontiguousarray(values, dtype=COLUMNS[col]).tobytes())
+            self.files[col].flush()
+        self.rows += len(columns["ts"])
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+class ChainArchive:
+    """
+    root: 归档目录, 每天一个子目录 YYYYMMDD.
+    同一进程内多个线程可共享一个实例追加; 不支持多个进程同时写同一天.
+    """
+    def __init__(self, root: str = "chain_archive"):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._days = {}
+        self._lock = threading.Lock()
+
+    def _day(self, day: str) -> _Day:
+        d = self._days.get(day)
+        if d is None:
+            d = self._days[day] = _Day(os.path.join(self.root, day), day)
+        return d
+
+    # ---- 写入 ----
+    def append(self, symbol: str, expiry: str, strikes, rights, bid, ask, spot, last=None, iv=None,
+               ts: float = None) -> int:
+        """
+        追加一次快照 (同一标的、同一到期日的若干期权), 各参数为等长数组 (spot 可为标量).
+        价格为 None / NaN 表示无报价; iv 为 None 时存 NaN. ts: time.time(), 默认当前时间.
+        返回追加的行数.
+        """
+        n = len(strikes)
+        if not n:
+            return 0
+        ts_ms = int((time.time() if ts is None else ts) * 1000)
+        day = datetime.datetime.fromtimestamp(ts_ms / 1000).strftime("%Y%m%d")
+        strikes = np.asarray(strikes, dtype=float)
+        rights = [r.upper()[:1] for r in rights]
+        values = {
+            "bid": np.array(bid, dtype=float),
+            "ask": np.array(ask, dtype=float),
+            "last": np.array([np.nan] * n if last is None else last, dtype=float),
+            "spot": np.broadcast_to(np.asarray(spot if spot is not None else np.nan, dtype=float), (n,)),
+        }
+        with self._lock:
+            d = self._day(day)
+            ids = d.contract_ids([(symbol, expiry, float(k), r) for k, r in zip(strikes, rights)])
+            ts_col = np.zeros(n, dtype=np.int64)
+            ts_col[0] = max(0, ts_ms - d.last_ms)
+            d.last_ms = max(d.last_ms, ts_ms)
+            columns = {"ts": ts_col, "contract": ids}
+            for col in PRICE_COLUMNS:
+                columns[col] = d.encode(col, ids, values[col])
+            columns["iv"] = np.full(n, np.nan) if iv is None else np.asarray(iv, dtype=float)
+            d.write(columns)
+        return n
+
+    def append_snapshot(self, symbol: str, expiry: str, spot: float, quotes: dict, ts: float = None) -> int:
+        """quotes: {(strike, right): (bid, ask)}, 即 get_option_data 收集的报价."""
+        keys = sorted(quotes)
+        return self.append(symbol, expiry, [k[0] for k in keys], [k[1] for k in keys],
+                           [quotes[k][0] if quotes[k][0] is not None else np.nan for k in keys],
+                           [quotes[k][1] if quotes[k][1] is not None else np.nan for k in keys],
+                           spot, ts=ts)
+
+    def close(self):
+        with self._lock:
+            for d in self._days.values():
+                d.close()
+            self._days.clear()
+
+    # ---- 读取 ----
+    def days(self) -> list:
+        return sorted(name for name in os.listdir(self.root)
+                      if len(name) == 8 and name.isdigit()
+                      and os.path.exists(os.path.join(self.root, name, "meta.json")))
+
+    def columns(self, day: str) -> dict:
+        """某天的原始列 (np.memmap, 零拷贝) 以及合约表."""
+        with self._lock:
+            d = self._day(day)
+            cols = {col: d.column(col) for col in COLUMNS}
+            cols["contracts"] = list(d.contracts)
+        return cols
+
+    def read(self, day: str, symbol: str = None, expiry: str = None, strike: float = None,
+             right: str = None) -> dict:
+        """
+        还原某天的数据, 可按合约字段过滤.
+        返回 dict: ts (datetime64[ms]), symbol / expiry / right (object), strike,
+        bid / ask / last / spot / iv (float, 无报价为 NaN).
+        """
+        cols = self.columns(day)
+        contracts = cols["contracts"]
+        ids = cols["contract"].astype(np.int64)
+        with self._lock:
+            base_ms = self._days[day].base_ms
+        ts = base_ms + np.cumsum(cols["ts"], dtype=np.int64)
+        decoded = {col: _decode(cols[col], ids) for col in PRICE_COLUMNS}
+        table_symbol = np.array([c[0] for c in contracts], dtype=object)
+        table_expiry = np.array([c[1] for c in contracts], dtype=object)
+        table_strike = np.array([c[2] for c in contracts], dtype=float)
+        table_right = np.array([c[3] for c in contracts], dtype=object)
+        keep = np.ones(len(contracts), dtype=bool)
+        if symbol is not None:
+            keep &= table_symbol == symbol
+        if expiry is not None:
+            keep &= table_expiry == expiry
+        if strike is not None:
+            keep &= np.isclose(table_strike, strike)
+        if right is not None:
+            keep &= table_right == right.upper()[:1]
+        rows = keep[ids] if len(contracts) else np.zeros(0, dtype=bool)
+        ids = ids[rows]
+        result = {
+            "ts": ts[rows].astype("datetime64[ms]"),
+            "symbol": table_symbol[ids],
+            "expiry": table_expiry[ids],
+            "strike": table_strike[ids],
+            "right": table_right[ids],
+            "iv": np.asarray(cols["iv"][rows], dtype=float),
+        }
+        for col in PRICE_COLUMNS:
+            result[col] = decoded[col][rows]
+        return result
+
+    def history(self, symbol: str, expiry: str = None, strike: float = None, right: str = None,
+                days=None) -> dict:
+        """多天的 read 结果按时间拼接; 没有数据时返回空 dict."""
+        parts = [self.read(day, symbol, expiry, strike, right) for day in (days or self.days())]
+        parts = [p for p in parts if len(p["ts"])]
+        if not parts:
+            return {}
+        return {key: np.concatenate([p[key] for p in parts]) for key in parts[0]}
+
+    def straddle(self, symbol: str, expiry: str, strike: float, days=None):
+        """同一快照中 CALL 与 PUT 中间价之和, 返回 (ts, price), 例如观察财报前跨式价格的衰减."""
+        call = self.history(symbol, expiry, strike, "C", days)
+        put = self.history(symbol, expiry, strike, "P", days)
+        if not call or not put:
+            return np.empty(0, dtype="datetime64[ms]"), np.empty(0)
+        ts, ic, ip = np.intersect1d(call["ts"], put["ts"], return_indices=True)
+        price = (call["bid"][ic] + call["ask"][ic] + put["bid"][ip] + put["ask"][ip]) / 2
+        return ts, price
+
+    def atm_iv(self, symbol: str, expiry: str = None, days=None):
+        """
+        每次快照中最接近标的价的期权的隐含波动率, 返回 (ts, iv).
+        未存 IV 的行只对选中的平值行按中间价补算, 不必为整条链求解.
+        """
+        h = self.history(symbol, expiry, days=days)
+        if not h:
+            return np.empty(0, dtype="datetime64[ms]"), np.empty(0)
+        quoted = np.isfinite(h["iv"]) | ((h["bid"] > 0) & (h["ask"] > 0))
+        ok = quoted & np.isfinite(h["spot"])
+        rows = np.flatnonzero(ok)
+        order = np.lexsort((np.abs(h["strike"][rows] - h["spot"][rows]), h["ts"][rows]))
+        ts, first = np.unique(h["ts"][rows][order], return_index=True)
+        atm = rows[order][first]
+        iv = h["iv"][atm].copy()
+        fill = np.isnan(iv)
+        if fill.any():
+            i = atm[fill]
+            ts_ms = h["ts"][i].astype(np.int64)
+            years = np.array([_years_to_expiry(e, t) for e, t in zip(h["expiry"][i], ts_ms)])
+            iv[fill] = implied_vol((h["bid"][i] + h["ask"][i]) / 2, h["spot"][i], h["strike"][i],
+                                   years, h["right"][i] == "C")
+        return ts, iv
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+期权链索引: 到期日按剩余天数 (DTE) 排序, 每个到期日一份有序的行权价数组,
+按 delta、按标准差倍数、按 DTE 选行权价/到期日的查询都是一次二分, O(log n), 不扫描整条链.
+
+    index = ChainIndex.from_app(app, "UVXY", con_id)
+    expiry = index.nearest_expiry(min_dte=30)
+    put = index.strike_for_delta(expiry, "P", 0.25, spot, vol)       # 25 delta put
+    call = index.strike_for_sigma(expiry, spot, 1.0, vol)            # 最接近 spot + 1σ√t 的行权价
+    legs = [index.leg(expiry, put, "P", "SELL"), index.leg(expiry, call, "C", "SELL")]
+
+各个构建期权腿的工具共用同一个索引 (由 IBSecDefCache 缓存的期权链构建), 不必各自请求和遍历期权链.
+"""
+
+import bisect
+import datetime
+import math
+from statistics import NormalDist
+
+import numpy as np
+from ibapi.contract import Contract
+
+from IBPayoff import bs_delta
+from IBSecDefCache import SecDefChain
+
+_N = NormalDist()
+
+
+class ChainIndex:
+    """
+    symbol: 标的代码; strikes_by_expiry: {expiry (YYYYMMDD): 行权价序列}.
+    today: 计算 DTE 的日期 (date 或 YYYYMMDD), 默认今天.
+    """
+    def __init__(self, symbol: str, strikes_by_expiry: dict, today=None):
+        self.symbol = symbol
+        if today is None:
+            today = datetime.date.today()
+        elif isinstance(today, str):
+            today = datetime.datetime.strptime(today[:8], "%Y%m%d").date()
+        self.today = today
+        self._strikes = {e: np.unique(np.asarray(list(k), dtype=float)) for e, k in strikes_by_expiry.items()}
+        self.expirations = sorted(self._strikes)
+        self._dte = [(datetime.datetime.strptime(e[:8], "%Y%m%d").date() - today).days
+                     for e in self.expirations]
+        # (expiry, strike, right) -> conId, 由合约详情填充 (from_contracts / load_contracts)
+        self._con_ids = {}
+        self._loaded = set()
+
+    @classmethod
+    def from_chain(cls, chain: SecDefChain, symbol: str, trading_class: str = None, today=None):
+        """
+        由 reqSecDefOptParams 的结果 (IBSecDefCache.SecDefChain) 构建.
+        trading_class 默认取与标的同名的, 没有时合并所有 tradingClass.
+        注意 reqSecDefOptParams 给出的行权价是整个 tradingClass 的并集, 某些到期日未必全部挂牌.
+        """
+        if trading_class is None:
+            trading_class = symbol if symbol in chain.trading_classes else None
+        classes = [trading_class] if trading_class is not None else chain.trading_classes
+        strikes = {}
+        for tc in classes:
+            for expiry in chain.expirations(tc):
+                strikes.setdefault(expiry, set()).update(chain.strikes(tc, expiry).tolist())
+        return cls(symbol, strikes, today)
+
+    @classmethod
+    def from_contracts(cls, symbol: str, contracts, today=None):
+        """由合约详情中的期权合约 (如按 symbol + 到期日一次取回的整条链) 构建, 行权价为实际挂牌的."""
+        strikes = {}
+        for c in contracts:
+            strikes.setdefault(c.lastTradeDateOrContractMonth[:8], set()).add(c.strike)
+        index = cls(symbol, strikes, today)
+        index._add_contracts(contracts)
+        index._loaded.update(strikes)
+        return index
+
+    @classmethod
+    def from_app(cls, app, symbol: str, con_id: int, trading_class: str = None, timeout: float = 5.0):
+        """通过 app.sec_def_chain (IBApp / IBOptionDataApp, 当天缓存) 构建; 取不到期权链时返回 None."""
+        chain = app.sec_def_chain(symbol, "STK", con_id, timeout)
+        return cls.from_chain(chain, symbol, trading_class) if chain is not None else None
+
+    def _add_contracts(self, contracts):
+        for c in contracts:
+            key = (c.lastTradeDateOrContractMonth[:8], float(c.strike), c.right.upper()[:1])
+            # 同一行权价有多个 tradingClass 时 (如 SPX / SPXW) 优先与标的同名的
+            if key not in self._con_ids or c.tradingClass == self.symbol:
+                self._con_ids[key] = c.conId
+
+    def load_contracts(self, app, expiry: str, exchange: str = "SMART", currency: str = "USD",
+                       timeout: float = 5.0) -> bool:
+        """
+        用一次 reqContractDetails (只给 symbol + 到期日) 取回该到期日的整条链:
+        行权价换成实际挂牌的, 并记录每个合约的 conId. 每个到期日只请求一次.
+        app: IBApp 或 IBOptionDataApp (均有 request_contract_details).
+        """
+        expiry = expiry[:8]
+        if expiry in self._loaded:
+            return True
+        query = Contract()
+        query.symbol = self.symbol
+        query.secType = "OPT"
+        query.exchange = exchange
+        query.currency = currency
+        query.lastTradeDateOrContractMonth = expiry
+        contracts = [getattr(d, "contract", d) for d in app.request_contract_details(query, timeout=timeout)]
+        if not contracts:
+            return False
+        self._add_contracts(contracts)
+        self._strikes[expiry] = np.unique(np.array([c.strike for c in contracts], dtype=float))
+        if expiry not in self.expirations:
+            bisect.insort(self.expirations, expiry)
+            self._dte.insert(self.expirations.index(expiry), self.dte(expiry))
+        self._loaded.add(expiry)
+        return True
+
+    def con_id(self, expiry: str, strike: float, right: str):
+        return self._con_ids.get((expiry[:8], float(strike), right.upper()[:1]))
+
+    # ---- 到期日 ----
+    def dte(self, expiry: str) -> int:
+        return (datetime.datetime.strptime(expiry[:8], "%Y%m%d").date() - self.today).days
+
+    def years(self, expiry: str, now: datetime.datetime = None) -> float:
+        """到期时间 (年), 到期日按 16:00 收盘计, 不足半天按半天."""
+        now = now or datetime.datetime.now()
+        close = datetime.datetime.strptime(expiry[:8], "%Y%m%d").replace(hour=16)
+        return max((close - now).total_seconds(), 43200.0) / (365.0 * 86400.0)
+
+    def nearest_expiry(self, min_dte: int = 0):
+        """DTE >= min_dte 的最近到期日, 没有时返回 None."""
+        i = bisect.bisect_left(self._dte, min_dte)
+        return self.expirations[i] if i < len(self.expirations) else None
+
+    # ---- 行权价 ----
+    def strikes(self, expiry: str) -> np.ndarray:
+        return self._strikes.get(expiry[:8], np.empty(0))
+
+    def nearest_strike(self, expiry: str, price: float):
+        """最接近 price 的行权价; 该到期日不存在时返回 None."""
+        strikes = self.strikes(expiry)
+        if not len(strikes):
+            return None
+        i = int(np.searchsorted(strikes, price))
+        if i == len(strikes) or (i > 0 and price - strikes[i - 1] <= strikes[i] - price):
+            i -= 1
+        return float(strikes[i])
+
+    def window(self, expiry: str, spot: float, below: int = 5, above: int = 5, lo: float = None,
+               hi: float = None):
+        """
+        (spot 以下 below 档, spot 及以上 above 档) 两个升序数组,
+        只在开区间 (lo, hi) 内的行权价中选 (None 表示不限).
+        与 get_option_data 原来的 PUT / CALL 行权价选法相同 (原来为 5 < strike < 当前价 * 3).
+        """
+        strikes = self.strikes(expiry)
+        if lo is not None or hi is not None:
+            start = 0 if lo is None else int(np.searchsorted(strikes, lo, side="right"))
+            end = len(strikes) if hi is None else int(np.searchsorted(strikes, hi, side="left"))
+            strikes = strikes[start:end]
+        i = int(np.searchsorted(strikes, spot))
+        return strikes[max(0, i - below):i], strikes[i:i + above]
+
+    def strike_for_sigma(self, expiry: str, spot: float, k: float, vol: float):
+        """最接近 spot + k·σ√t (σ√t 按标的价换算成价格) 的行权价, k 可为负."""
+        t = self.years(expiry)
+        return self.nearest_strike(expiry, spot * (1.0 + k * vol * math.sqrt(t)))
+
+    def strike_for_delta(self, expiry: str, right: str, delta: float, spot: float, vol: float,
+                         rate: float = 0.0):
+        """
+        delta 最接近目标值的行权价, 例如 ("P", 0.25) 为 25 delta put (put 的 delta 正负号均可).
+        由 Black-Scholes 反解出理论行权价后二分定位, 再比较相邻两档的实际 delta.
+        """
+        strikes = self.strikes(expiry)
+        if not len(strikes):
+            return None
+        is_call = right.upper().startswith("C")
+        delta = abs(delta) if is_call else -abs(delta)
+        t = self.years(expiry)
+        sig_t = vol * math.sqrt(t)
+        d1 = _N.inv_cdf(min(max(delta if is_call else delta + 1.0, 1e-9), 1.0 - 1e-9))
+        target = spot * math.exp((rate + 0.5 * vol * vol) * t - d1 * sig_t)
+        i = int(np.searchsorted(strikes, target))
+        candidates = strikes[max(0, i - 1):i + 1]
+        deltas = bs_delta(spot, candidates, t, vol, is_call, rate)
+        return float(candidates[int(np.argmin(np.abs(deltas - delta)))])
+
+    # ---- 期权腿 ----
+    def leg(self, expiry: str, strike: float, right: str, action: str, quantity: int = 1) -> dict:
+        """OrderManager.place_option_order 使用的腿格式; 已知 conId 时一并带上, 下单时不必再解析合约."""
+        leg = {
+            "underlying": self.symbol,
+            "lastTradeDate": expiry[:8],
+            "strike": float(strike),
+            "right": right.upper()[:1],
+            "action": action.upper(),
+            "quantity": quantity,
+        }
+        con_id = self.con_id(expiry, strike, right)
+        if con_id:
+            leg["conId"] = con_id
+        return leg
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多标的期权链扫描: 对一个观察列表 (几十个标的) 的若干到期日,
+  1) 通过限速的抓取器 (IBOptionDataApp + TokenBucket + 线程池) 拉取期权链与报价;
+  2) 把各期权的 标的价/行权价/剩余时间/bid/ask 排成数组, 放进 multiprocessing.shared_memory,
+     由进程池分段计算隐含波动率、Greeks 与排序指标 (只传共享内存名和行区间, 不 pickle 数组);
+  3) 按标的汇总 ATM IV、25 delta 偏度、期限结构, 排序输出.
+
+抓取阶段按 IB 的消息频率限速 (默认每秒 45 条), 并发等待多个请求的回报;
+每个到期日只用一次 reqContractDetails 拿到整条链, 不再逐个行权价解析.
+
+用法:
+    python IBChainScanner.py --symbols NKE PDD UVXY --expiries 2 --strikes 5
+    python IBChainScanner.py --watchlist watchlist.txt --workers 4 --rank-by skew25 --csv scan.csv
+"""
+
+import argparse
+import csv
+import datetime
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from ibapi.contract import Contract
+
+from IBChainArchive import ChainArchive
+from IBChainIndex import ChainIndex
+from IBPayoff import bs_greeks, implied_vol
+from IBPriceOffical import IBOptionDataApp
+from IBThrottle import TokenBucket
+
+# 输入数组的列 (每行一个期权)
+IN_COLUMNS = ("spot", "strike", "years", "is_call", "bid", "ask")
+# 进程池计算结果的列
+OUT_COLUMNS = ("mid", "iv", "delta", "gamma", "vega", "theta", "spread_pct", "theta_yield")
+# 可用于排序的标的指标
+RANK_METRICS = ("atm_iv", "skew25", "term_slope", "spread_pct")
+
+
+# ---- 抓取 ----
+class ChainFetcher:
+    """
+    app: 已连接的 IBOptionDataApp.
+    rate: 每秒最多发出的请求数; max_inflight: 同时等待回报的请求数 (线程数).
+    """
+    def __init__(self, app: IBOptionDataApp, rate: float = 45.0, max_inflight: int = 40,
+                 timeout: float = 3.0):
+        self.app = app
+        self.app.request_throttle = TokenBucket(rate)
+        self.app.verbose = False
+        self.max_inflight = max_inflight
+        self.timeout = timeout
+
+    def _spot(self, contract: Contract):
+        bid, ask = self.app.request_option_market_snapshot(contract, timeout=self.timeout)
+        if bid and ask and bid > 0 and ask > 0:
+            return (bid + ask) / 2
+        return None
+
+    def _underlying(self, symbol: str, expiries: int, strikes: int, max_dte: int = None):
+        """解析标的、取价格和期权链参数, 返回该标的待报价的期权合约列表 (max_dte: 只取剩余天数不超过的到期日)."""
+        stock = Contract()
+        stock.symbol = symbol
+        stock.secType = "STK"
+        stock.exchange = "SMART"
+        stock.currency = "USD"
+        details = self.app.request_contract_details(stock, timeout=self.timeout)
+        if not details:
+            print(f"{symbol}: contract not found, skipped.")
+            return symbol, None, []
+        stock = details[0].contract
+        spot = self._spot(stock)
+        if spot is None:
+            print(f"{symbol}: no underlying quote, skipped.")
+            return symbol, None, []
+
+        params = self.app.fetch_sec_def_opt_params(symbol, "STK", stock.conId, timeout=self.timeout * 2)
+        today = datetime.date.today().strftime("%Y%m%d")
+        chain_expiries = sorted({e for row in params if row[2] == symbol for e in row[4] if e >= today}
+                                or {e for row in params for e in row[4] if e >= today})
+        if max_dte is not None:
+            last = (datetime.date.today() + datetime.timedelta(days=max_dte)).strftime("%Y%m%d")
+            chain_expiries = [e for e in chain_expiries if e <= last]
+        contracts = []
+        for expiry in chain_expiries[:expiries]:
+            query = Contract()
+            query.symbol = symbol
+            query.secType = "OPT"
+            query.exchange = "SMART"
+            query.currency = "USD"
+            query.lastTradeDateOrContractMonth = expiry
+            chain = [d.contract for d in self.app.request_contract_details(query, timeout=self.timeout * 2)
+                     if d.contract.tradingClass in ("", symbol)]
+            below, above = ChainIndex.from_contracts(symbol, chain).window(expiry, spot, strikes, strikes)
+            window = set(below.tolist() + above.tolist())
+            contracts.extend(c for c in chain if c.strike in window)
+        return symbol, spot, contracts
+
+    def fetch_quotes(self, symbols, expiries: int = 2, strikes: int = 5, max_dte: int = None) -> list:
+        """返回 [(symbol, spot, contract, quote)], quote 为 request_option_quote 的字段 (含买卖量)."""
+        t0 = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_inflight) as pool:
+            underlyings = list(pool.map(lambda s: self._underlying(s, expiries, strikes, max_dte), symbols))
+            jobs = [(symbol, spot, c) for symbol, spot, contracts in underlyings for c in contracts]
+            print(f"Chains for {len(symbols)} symbols: {len(jobs)} options in window "
+                  f"({time.monotonic() - t0:.1f}s)")
+            quotes = list(pool.map(
+                lambda job: self.app.request_option_quote(job[2], timeout=self.timeout), jobs))
+        print(f"Quotes fetched in {time.monotonic() - t0:.1f}s")
+        return [(symbol, spot, c, quote) for (symbol, spot, c), quote in zip(jobs, quotes)]
+
+    def fetch(self, symbols, expiries: int = 2, strikes: int = 5):
+        """
+        返回 (rows, meta): rows 为每个期权的输入数组行, meta 为对应的 (symbol, expiry, strike, right).
+        """
+        quoted = self.fetch_quotes(symbols, expiries, strikes)
+
+        now = datetime.datetime.now()
+        rows, meta = [], []
+        for symbol, spot, c, quote in quoted:
+            bid, ask = quote.get("bid"), quote.get("ask")
+            expiry = c.lastTradeDateOrContractMonth[:8]
+            close = datetime.datetime.strptime(expiry, "%Y%m%d").replace(hour=16)
+            years = max((close - now).total_seconds(), 43200.0) / (365.0 * 86400.0)
+            rows.append((spot, c.strike, years, 1.0 if c.right.upper().startswith("C") else 0.0,
+                         bid if bid and bid > 0 else np.nan, ask if ask and ask > 0 else np.nan))
+            meta.append((symbol, expiry, c.strike, c.right))
+        return np.array(rows, dtype=float).reshape(-1, len(IN_COLUMNS)), meta
+
+
+# ---- 进程池计算 (共享内存) ----
+_shared = {}
+
+
+def _attach(in_name: str, out_name: str, rows: int, rate: float):
+    """
+    进程池初始化: 按名字挂上输入/输出共享内存, 各进程只持有视图.
+    子进程与主进程共用同一个 resource_tracker, 共享内存由主进程在计算结束后统一 unlink.
+    """
+    shm_in = shared_memory.SharedMemory(name=in_name)
+    shm_out = shared_memory.SharedMemory(name=out_name)
+    _shared.update(
+        shm=(shm_in, shm_out), rate=rate,
+        inputs=np.ndarray((rows, len(IN_COLUMNS)), dtype=float, buffer=shm_in.buf),
+        outputs=np.ndarray((rows, len(OUT_COLUMNS)), dtype=float, buffer=shm_out.buf),
+    )
+
+
+def _compute_slice(start: int, stop: int) -> int:
+    """计算 [start, stop) 行的 IV / Greeks / 指标, 直接写入输出共享内存."""
+    x = _shared["inputs"][start:stop]
+    out = _shared["outputs"][start:stop]
+    spot, strike, years, is_call, bid, ask = (x[:, i] for i in range(len(IN_COLUMNS)))
+    is_call = is_call > 0.5
+    mid = (bid + ask) / 2.0
+    quoted = np.isfinite(mid) & (mid > 0)
+    iv = np.full(len(x), np.nan)
+    if quoted.any():
+        iv[quoted] = implied_vol(mid[quoted], spot[quoted], strike[quoted], years[quoted],
+                                 is_call[quoted], _shared["rate"])
+    greeks = bs_greeks(spot, strike, years, np.where(quoted, iv, 0.0), is_call, _shared["rate"])
+    out[:, OUT_COLUMNS.index("mid")] = mid
+    out[:, OUT_COLUMNS.index("iv")] = iv
+    for name in ("delta", "gamma", "vega", "theta"):
+        out[:, OUT_COLUMNS.index(name)] = np.where(quoted, greeks[name], np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[:, OUT_COLUMNS.index("spread_pct")] = (ask - bid) / mid
+        # 每日时间价值衰减占权利金的比例, 卖方收益率的粗略指标
+        out[:, OUT_COLUMNS.index("theta_yield")] = -greeks["theta"] / mid
+    return stop - start
+
+
+def compute(inputs: np.ndarray, workers: int = None, chunk: int = 2048, rate: float = 0.0) -> np.ndarray:
+    """
+    把输入数组放进共享内存, 由进程池按 chunk 行分段计算, 返回结果数组 (rows x OUT_COLUMNS).
+    workers <= 1 时在本进程内计算.
+    """
+    rows = len(inputs)
+    if rows == 0:
+        return np.empty((0, len(OUT_COLUMNS)))
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    shm_in = shared_memory.SharedMemory(create=True, size=inputs.nbytes)
+    shm_out = shared_memory.SharedMemory(create=True, size=rows * len(OUT_COLUMNS) * 8)
+    try:
+        np.ndarray(inputs.shape, dtype=float, buffer=shm_in.buf)[:] = inputs
+        ranges = [(i, min(rows, i + chunk)) for i in range(0, rows, chunk)]
+        if workers <= 1 or len(ranges) == 1:
+            _shared.update(
+                rate=rate,
+                inputs=np.ndarray(inputs.shape, dtype=float, buffer=shm_in.buf),
+                outputs=np.ndarray((rows, len(OUT_COLUMNS)), dtype=float, buffer=shm_out.buf),
+            )
+            try:
+                for start, stop in ranges:
+                    _compute_slice(start, stop)
+            finally:
+                # 先释放视图, 共享内存才能关闭
+                _shared.clear()
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                     initargs=(shm_in.name, shm_out.name, rows, rate)) as pool:
+                list(pool.map(_compute_slice, *zip(*ranges)))
+        return np.ndarray((rows, len(OUT_COLUMNS)), dtype=float, buffer=shm_out.buf).copy()
+    finally:
+        shm_in.close()
+        shm_in.unlink()
+        shm_out.close()
+        shm_out.unlink()
+
+
+# ---- 汇总与排序 ----
+def _atm_iv(rows, outputs, idx):
+    """到期日内 |delta| 最接近 0.5 的看涨/看跌 IV 的平均."""
+    iv = outputs[idx, OUT_COLUMNS.index("iv")]
+    delta = outputs[idx, OUT_COLUMNS.index("delta")]
+    ok = np.isfinite(iv)
+    if not ok.any():
+        return np.nan
+    dist = np.where(ok, np.abs(np.abs(delta) - 0.5), np.inf)
+    calls = rows[idx, IN_COLUMNS.index("is_call")] > 0.5
+    picks = [np.argmin(np.where(side, dist, np.inf)) for side in (calls, ~calls) if (side & ok).any()]
+    return float(np.mean(iv[picks]))
+
+
+def summarize(inputs: np.ndarray, outputs: np.ndarray, meta) -> list:
+    """按标的汇总: 近月 ATM IV、25 delta 偏度 (看跌 IV - 看涨 IV)、期限结构 (近月 - 次月 ATM IV)、平均价差."""
+    by_symbol = {}
+    for i, (symbol, expiry, _, _) in enumerate(meta):
+        by_symbol.setdefault(symbol, {}).setdefault(expiry, []).append(i)
+    result = []
+    for symbol, expiries in by_symbol.items():
+        ordered = [np.array(expiries[e]) for e in sorted(expiries)]
+        front = ordered[0]
+        atm = [_atm_iv(inputs, outputs, idx) for idx in ordered]
+        iv = outputs[front, OUT_COLUMNS.index("iv")]
+        delta = outputs[front, OUT_COLUMNS.index("delta")]
+        ok = np.isfinite(iv)
+        calls = inputs[front, IN_COLUMNS.index("is_call")] > 0.5
+        skew = np.nan
+        if (ok & calls).any() and (ok & ~calls).any():
+            put = np.argmin(np.where(ok & ~calls, np.abs(delta + 0.25), np.inf))
+            call = np.argmin(np.where(ok & calls, np.abs(delta - 0.25), np.inf))
+            skew = float(iv[put] - iv[call])
+        spreads = outputs[front, OUT_COLUMNS.index("spread_pct")]
+        result.append({
+            "symbol": symbol,
+            "spot": float(inputs[front[0], IN_COLUMNS.index("spot")]),
+            "expiry": sorted(expiries)[0],
+            "options": sum(len(v) for v in expiries.values()),
+            "atm_iv": atm[0],
+            "skew25": skew,
+            "term_slope": atm[0] - atm[1] if len(atm) > 1 else np.nan,
+            "spread_pct": float(np.nanmean(spreads)) if np.isfinite(spreads).any() else np.nan,
+        })
+    return result
+
+
+def rank(summary: list, by: str = "atm_iv", descending: bool = True) -> list:
+    """按指标排序, 缺失值排在最后."""
+    def key(item):
+        value = item[by]
+        return (np.isnan(value), -value if descending else value)
+    return sorted(summary, key=key)
+
+
+def print_ranking(ranked: list, by: str):
+    print(f"\n======== Chain scan ranked by {by} ========")
+    print(f"{'symbol':<8}{'spot':>10}{'expiry':>10}{'opts':>6}{'atm_iv':>9}{'skew25':>9}"
+          f"{'term':>9}{'spread%':>9}")
+    for r in ranked:
+        print(f"{r['symbol']:<8}{r['spot']:>10.2f}{r['expiry']:>10}{r['options']:>6}"
+              f"{r['atm_iv']:>9.3f}{r['skew25']:>9.3f}{r['term_slope']:>9.3f}{r['spread_pct'] * 100:>9.1f}")
+    print("=============================================")
+
+
+def write_csv(path: str, inputs: np.ndarray, outputs: np.ndarray, meta):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["symbol", "expiry", "strike", "right", *IN_COLUMNS, *OUT_COLUMNS])
+        for m, x, y in zip(meta, inputs, outputs):
+            writer.writerow([*m, *(round(float(v), 6) for v in x), *(round(float(v), 6) for v in y)])
+
+
+def archive_scan(archive, inputs: np.ndarray, outputs: np.ndarray, meta, ts: float = None) -> int:
+    """把一次扫描按 (标的, 到期日) 追加到 IBChainArchive.ChainArchive, 连同算好的 IV."""
+    groups = {}
+    for i, (symbol, expiry, _, _) in enumerate(meta):
+        groups.setdefault((symbol, expiry), []).append(i)
+    ts = time.time() if ts is None else ts
+    rows = 0
+    for (symbol, expiry), index in groups.items():
+        x, y = inputs[index], outputs[index]
+        rows += archive.append(symbol, expiry, x[:, 1], [meta[i][3] for i in index], x[:, 4], x[:, 5],
+                               x[:, 0], iv=y[:, OUT_COLUMNS.index("iv")], ts=ts)
+    return rows
+
+
+def scan(app: IBOptionDataApp, symbols, expiries: int = 2, strikes: int = 5, workers: int = None,
+         rate: float = 45.0, max_inflight: int = 40, rank_by: str = "atm_iv"):
+    """抓取 + 计算 + 汇总, 返回 (排序后的汇总, 输入数组, 结果数组, meta)."""
+    fetcher = ChainFetcher(app, rate=rate, max_inflight=max_inflight)
+    inputs, meta = fetcher.fetch(symbols, expiries, strikes)
+    t0 = time.perf_counter()
+    outputs = compute(inputs, workers)
+    print(f"Computed IV/Greeks for {len(inputs)} options in {(time.perf_counter() - t0) * 1e3:.1f} ms")
+    return rank(summarize(inputs, outputs, meta), rank_by), inputs, outputs, meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多标的期权链扫描")
+    parser.add_argument("--symbols", nargs="*", default=[])
+    parser.add_argument("--watchlist", help="观察列表文件, 每行一个标的代码")
+    parser.add_argument("--expiries", type=int, default=2, help="每个标的扫描最近的几个到期日")
+    parser.add_argument("--strikes", type=int, default=5, help="标的价上下各取几档行权价")
+    parser.add_argument("--workers", type=int, default=None, help="计算进程数, 默认 CPU 数")
+    parser.add_argument("--rate", type=float, default=45.0, help="每秒最多请求数")
+    parser.add_argument("--inflight", type=int, default=40, help="同时等待回报的请求数")
+    parser.add_argument("--rank-by", default="atm_iv", choices=RANK_METRICS)
+    parser.add_argument("--csv", help="把每个期权的结果写入 CSV")
+    parser.add_argument("--archive", help="把本次快照追加到该目录下的列式归档 (IBChainArchive)")
+    parser.add_argument("--host", default=os.environ.get("IB_TWS_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("IB_TWS_PORT", "7496")))
+    parser.add_argument("--client-id", type=int, default=2)
+    args = parser.parse_args()
+
+    symbols = list(args.symbols)
+    if args.watchlist:
+        with open(args.watchlist, "r", encoding="utf-8") as f:
+            symbols += [line.strip().upper() for line in f if line.strip() and not line.startswith("#")]
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols:
+        parser.error("no symbols given (use --symbols or --watchlist)")
+
+    app = IBOptionDataApp()
+    app.connect(args.host, args.port, clientId=args.client_id)
+    api_thread = threading.Thread(target=app.run, daemon=True)
+    api_thread.start()
+    t0 = time.time()
+    while app.next_order_id is None and time.time() - t0 < 5:
+        time.sleep(0.1)
+    if app.next_order_id is None:
+        print("Could not connect to IB API.")
+        sys.exit(1)
+    try:
+        started = time.monotonic()
+        ranked, inputs, outputs, meta = scan(app, symbols, args.expiries, args.strikes, args.workers,
+                                             args.rate, args.inflight, args.rank_by)
+        print_ranking(ranked, args.rank_by)
+        print(f"Scanned {len(symbols)} symbols in {time.monotonic() - started:.1f}s")
+        if args.csv:
+            write_csv(args.csv, inputs, outputs, meta)
+            print(f"Per-option results written to {args.csv}")
+        if args.archive:
+            archive = ChainArchive(args.archive)
+            rows = archive_scan(archive, inputs, outputs, meta)
+            archive.close()
+            print(f"{rows} rows appended to {args.archive}")
+    finally:
+        app.disconnect()
+        api_thread.join(timeout=3)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+追价策略离线回测: 在录制的组合 (或各腿) bid/ask 报价流上, 用与 chase_order_to_final
+相同的递价规则 (next_chase_price) 和价位对齐 (snap_chase_price, 按合约的最小变动价位 --increment)
+模拟下单 -> 每隔 interval 递价 -> 成交,
+并用进程池并行扫描 step / interval / 起始偏移, 输出成交耗时与成交价的分布,
+用来替代凭感觉设定的 combo_price_step / interval / combo_init_price.
+
+报价流来源:
+  - CSV: 列 t,bid,ask (组合报价), 或 t,leg1_bid,leg1_ask,leg2_bid,... (各腿报价, 按腿参数合成组合报价)
+  - IBRecorder 录制的回调日志: 取指定 reqId 的 tickPrice (bid/ask)
+  - 模拟网关的行情脚本 (IBFakeGateway.MarketScript), 用于没有录制数据时试跑
+
+成交模型 (FillModel):
+  - 限价触及对手价 (BUY 限价 >= ask, SELL 限价 <= bid) 时立即按对手价成交;
+  - 限价位于买卖价之间时, 按其在价差中的位置线性给出成交强度 (泊松到达), 按限价成交;
+  - 每次下单 / 改单在 latency 秒后才生效.
+
+用法:
+    python IBChaseBacktest.py --csv combo_quotes.csv --action BUY \\
+        --steps 0.01 0.02 0.05 --intervals 2 5 10 --offsets 0 0.05 0.10
+    python IBChaseBacktest.py --log session.iblog --req-ids 1001 1002 --legs-from IBOption2Leg
+    python IBChaseBacktest.py --script quotes.json --legs-from IBOption4Leg --duration 3600
+"""
+
+import argparse
+import bisect
+import csv
+import importlib
+import itertools
+import json
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from IBOptionToolOffical import DEFAULT_PRICE_INCREMENT, next_chase_price, snap_chase_price, snap_to_increment
+
+# tickPrice 中的 bid / ask 类型 (含延迟行情)
+BID_TICK_TYPES = (1, 66)
+ASK_TICK_TYPES = (2, 67)
+
+
+# ================ 报价流 ================
+def combine_legs(leg_quotes, legs):
+    """
+    把各腿 (bid, ask) 合成组合报价, 规则与 MarketScript.combo_quote 一致:
+    BUY 腿 ask 计入组合 ask, SELL 腿 bid 从组合 ask 中扣除; bid 侧反之.
+    legs 为 [(ratio, action)], 与 leg_quotes 一一对应.
+    """
+    bid = ask = 0.0
+    for (leg_bid, leg_ask), (ratio, action) in zip(leg_quotes, legs):
+        if action.upper() == "BUY":
+            bid += ratio * leg_bid
+            ask += ratio * leg_ask
+        else:
+            bid -= ratio * leg_ask
+            ask -= ratio * leg_bid
+    return round(bid, 4), round(ask, 4)
+
+
+def _compact(rows):
+    """按时间排序, 丢弃无效报价和与上一条相同的报价, 返回 (times, bids, asks) 三个列表."""
+    times, bids, asks = [], [], []
+    for t, bid, ask in sorted(rows):
+        if bid is None or ask is None or ask < bid:
+            continue
+        if bids and bids[-1] == bid and asks[-1] == ask:
+            continue
+        times.append(t)
+        bids.append(bid)
+        asks.append(ask)
+    if not times:
+        raise ValueError("quote stream is empty")
+    t0 = times[0]
+    return [t - t0 for t in times], bids, asks
+
+
+def load_csv(path: str, legs=None):
+    """读取 CSV 报价流; 若没有 bid/ask 列, 则按 legs 合成 leg{i}_bid / leg{i}_ask."""
+    rows = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        time_col = "t" if "t" in fields else "time"
+        combo = "bid" in fields and "ask" in fields
+        if not combo and not legs:
+            raise ValueError(f"{path}: no bid/ask columns, leg parameters are required")
+        for rec in reader:
+            t = float(rec[time_col])
+            if combo:
+                rows.append((t, float(rec["bid"]), float(rec["ask"])))
+                continue
+            leg_quotes = [(float(rec[f"leg{i}_bid"]), float(rec[f"leg{i}_ask"]))
+                          for i in range(1, len(legs) + 1)]
+            rows.append((t,) + combine_legs(leg_quotes, legs))
+    return _compact(rows)
+
+
+def load_recorder_log(path: str, req_ids, legs=None):
+    """
+    从 IBRecorder 日志中取 tickPrice 报价流.
+    单个 reqId 且未给 legs 时视为组合报价; 否则每个 reqId 对应一条腿, 各腿都有报价后才开始输出.
+    """
+    from IBRecorder import read_log
+
+    req_ids = list(req_ids)
+    if len(req_ids) > 1 and (not legs or len(legs) != len(req_ids)):
+        raise ValueError("one leg (ratio, action) per reqId is required")
+    index = {req_id: i for i, req_id in enumerate(req_ids)}
+    latest = [[None, None] for _ in req_ids]
+    rows = []
+    for ts, method, args in read_log(path):
+        if method != "tickPrice":
+            continue
+        req_id, tick_type, price = args[0], args[1], args[2]
+        i = index.get(req_id)
+        if i is None or price is None or price <= 0:
+            continue
+        if tick_type in BID_TICK_TYPES:
+            latest[i][0] = price
+        elif tick_type in ASK_TICK_TYPES:
+            latest[i][1] = price
+        else:
+            continue
+        if any(b is None or a is None for b, a in latest):
+            continue
+        if legs:
+            bid, ask = combine_legs(latest, legs)
+        else:
+            bid, ask = latest[0]
+        rows.append((ts / 1e9, bid, ask))
+    return _compact(rows)
+
+
+def stream_from_market_script(script, leg_keys, duration: float, dt: float = 1.0):
+    """
+    用模拟网关的行情脚本生成组合报价流, 便于在没有录制数据时试跑.
+    leg_keys 为 [(contract_key, ratio, action)], contract_key 同 MarketScript.lookup 的返回值.
+    """
+    legs = [(script.con_id(key), ratio, action) for key, ratio, action in leg_keys]
+    rows = []
+    steps = int(duration / dt)
+    for k in range(steps + 1):
+        t = k * dt
+        quote = script.combo_quote(legs, t)
+        if quote is not None:
+            rows.append((t, quote[0], quote[1]))
+    return _compact(rows)
+
+
+def legs_from_script(module_name: str):
+    """读取下单脚本顶部的腿参数, 返回 (symbol, combo_action, legs[dict])."""
+    module = importlib.import_module(module_name)
+    legs = []
+    for i in range(1, 5):
+        expiry = getattr(module, f"leg{i}_expiry", None)
+        if expiry is None:
+            continue
+        legs.append({
+            "expiry": expiry,
+            "strike": float(getattr(module, f"leg{i}_strike")),
+            "right": getattr(module, f"leg{i}_right"),
+            "action": getattr(module, f"leg{i}_action").upper(),
+            "ratio": int(getattr(module, f"leg{i}_ratio", 1)),
+        })
+    if not legs:
+        raise ValueError(f"{module_name} defines no legs")
+    action = getattr(module, "combo_action", legs[0]["action"]).upper()
+    return module.spread_symbol, action, legs
+
+
+# ================ 成交模型与单次模拟 ================
+class FillModel:
+    """
+    latency: 下单 / 改单从发出到生效的秒数
+    passive_rate: 限价贴近对手价 (但未触及) 时每秒的成交强度; 位于己方最优价时为 0
+    """
+    def __init__(self, latency: float = 0.25, passive_rate: float = 0.02):
+        self.latency = latency
+        self.passive_rate = passive_rate
+
+    def crosses(self, action: str, price: float, bid: float, ask: float) -> bool:
+        if action == "BUY":
+            return price >= ask - 1e-9
+        return price <= bid + 1e-9
+
+    def intensity(self, action: str, price: float, bid: float, ask: float) -> float:
+        spread = ask - bid
+        if spread <= 1e-9 or self.passive_rate <= 0:
+            return 0.0
+        if action == "BUY":
+            x = (price - bid) / spread
+        else:
+            x = (ask - price) / spread
+        return self.passive_rate * min(max(x, 0.0), 1.0)
+
+
+def simulate_chase(stream, start_idx: int, action: str, init_price: float, final_price: float,
+                   step: float, interval: float, fill_model: FillModel, max_wait: float,
+                   rng: random.Random, increment: Decimal = DEFAULT_PRICE_INCREMENT):
+    """
+    从 stream 的第 start_idx 条报价开始模拟一次追价下单.
+    increment: 合约的最小变动价位, 起始限价和每次递价都按实盘规则对齐到该价位.
+    返回 dict(filled, time_to_fill, fill_price, modifications).
+    """
+    def snap(p, direction):
+        return snap_to_increment(p, increment, direction)
+
+    # 与 _snap_limit_price 相同: 买单向下、卖单向上取整
+    init_price = snap(init_price, "down" if action == "BUY" else "up")
+    times, bids, asks = stream
+    n = len(times)
+    t0 = times[start_idx]
+    horizon = min(t0 + max_wait, times[-1]) if n > 1 else t0 + max_wait
+
+    price = init_price
+    live_price = None
+    pending = (init_price, t0 + fill_model.latency)
+    next_chase = t0 + interval
+    chasing = True
+    modifications = 0
+
+    i = start_idx
+    t = t0
+    while t < horizon:
+        seg_end = times[i + 1] if i + 1 < n else horizon
+        t_next = min(seg_end, horizon)
+        if chasing:
+            t_next = min(t_next, next_chase)
+        if pending is not None:
+            t_next = min(t_next, pending[1])
+
+        if live_price is not None:
+            bid, ask = bids[i], asks[i]
+            if fill_model.crosses(action, live_price, bid, ask):
+                fill_price = ask if action == "BUY" else bid
+                return {"filled": True, "time_to_fill": t - t0, "fill_price": fill_price,
+                        "modifications": modifications}
+            rate = fill_model.intensity(action, live_price, bid, ask)
+            if rate > 0:
+                tau = rng.expovariate(rate)
+                if t + tau < t_next:
+                    return {"filled": True, "time_to_fill": t + tau - t0, "fill_price": live_price,
+                            "modifications": modifications}
+
+        t = t_next
+        if pending is not None and t >= pending[1]:
+            live_price = pending[0]
+            pending = None
+        if chasing and t >= next_chase:
+            # 与 chase_order_to_final 相同: 每个 interval 递价一次并对齐价位, 到达 final 后停止追价
+            new_price = next_chase_price(action, price, step, final_price)
+            new_price = snap_chase_price(snap, price, new_price, final_price)
+            if abs(new_price - price) < 1e-10:
+                chasing = False
+            else:
+                price = new_price
+                pending = (new_price, t + fill_model.latency)
+                modifications += 1
+                next_chase += interval
+        if t >= seg_end and i + 1 < n:
+            i += 1
+
+    return {"filled": False, "time_to_fill": None, "fill_price": None, "modifications": modifications}
+
+
+def start_indices(stream, start_every: float, max_wait: float):
+    """每隔 start_every 秒取一个起点; 尽量保证每个起点之后还有 max_wait 秒的数据."""
+    times = stream[0]
+    last_start = times[-1] - max_wait
+    if last_start < times[0]:
+        last_start = times[0]
+    result = []
+    t = times[0]
+    while t <= last_start:
+        idx = bisect.bisect_right(times, t) - 1
+        if not result or result[-1] != idx:
+            result.append(idx)
+        t += start_every
+    return result
+
+
+# ================ 参数扫描 ================
+def _percentile(values, pct: float):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100.0
+    lo = math.floor(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def run_params(stream, params: dict) -> dict:
+    """对一组参数, 在所有起点上模拟并汇总分布."""
+    action = params["action"]
+    fill_model = FillModel(params["latency"], params["passive_rate"])
+    times, bids, asks = stream
+    ttf, paid, cost, mods = [], [], [], []
+    starts = start_indices(stream, params["start_every"], params["max_wait"])
+    for idx in starts:
+        mid = (bids[idx] + asks[idx]) / 2.0
+        sign = 1 if action == "BUY" else -1
+        init_price = round(mid - sign * params["offset"], 2)
+        natural = asks[idx] if action == "BUY" else bids[idx]
+        final_price = round(natural + sign * params["final_offset"], 2)
+        # 同一起点在不同参数组合下使用相同的随机数序列, 便于横向比较
+        rng = random.Random(params["seed"] * 1000003 + idx)
+        r = simulate_chase(stream, idx, action, init_price, final_price, params["step"],
+                           params["interval"], fill_model, params["max_wait"], rng,
+                           Decimal(params["increment"]))
+        mods.append(r["modifications"])
+        if r["filled"]:
+            ttf.append(r["time_to_fill"])
+            paid.append(r["fill_price"])
+            # 相对起始中间价多付出的金额 (SELL 为少收的金额), 越小越好
+            cost.append(sign * (r["fill_price"] - mid))
+
+    n = len(starts)
+
+    def _r(v):
+        return None if v is None else round(v, 4)
+
+    return {
+        "step": params["step"],
+        "interval": params["interval"],
+        "offset": params["offset"],
+        "orders": n,
+        "fill_rate": round(len(ttf) / n, 4) if n else 0.0,
+        "time_to_fill": {f"p{p}": _r(_percentile(ttf, p)) for p in (10, 50, 90)},
+        "fill_price": {f"p{p}": _r(_percentile(paid, p)) for p in (10, 50, 90)},
+        "cost_vs_mid": {f"p{p}": _r(_percentile(cost, p)) for p in (10, 50, 90)},
+        "avg_modifications": round(sum(mods) / n, 2) if n else 0.0,
+    }
+
+
+_worker_stream = None
+
+
+def _init_worker(stream):
+    # 报价流在每个子进程中只传一次, 任务本身只携带参数
+    global _worker_stream
+    _worker_stream = stream
+
+
+def _run_in_worker(params):
+    return run_params(_worker_stream, params)
+
+
+def sweep(stream, action: str, steps, intervals, offsets, final_offset: float = 0.0,
+          fill_model: FillModel = None, max_wait: float = 300.0, start_every: float = 30.0,
+          workers: int = None, seed: int = 1, increment: str = str(DEFAULT_PRICE_INCREMENT)):
+    """
+    扫描 steps x intervals x offsets 的所有组合, 返回按 (成交率降序, 成交耗时中位数升序) 排序的结果.
+    increment: 合约的最小变动价位 (字符串, 按十进制对齐).
+    workers=1 时在当前进程中顺序执行.
+    """
+    fill_model = fill_model or FillModel()
+    grid = [{
+        "action": action.upper(), "step": step, "interval": interval, "offset": offset,
+        "final_offset": final_offset, "latency": fill_model.latency,
+        "passive_rate": fill_model.passive_rate, "max_wait": max_wait,
+        "start_every": start_every, "seed": seed, "increment": increment,
+    } for step, interval, offset in itertools.product(steps, intervals, offsets)]
+
+    if workers == 1:
+        results = [run_params(stream, p) for p in grid]
+    else:
+        workers = workers or os.cpu_count() or 1
+        chunksize = max(1, len(grid) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(stream,)) as pool:
+            results = list(pool.map(_run_in_worker, grid, chunksize=chunksize))
+
+    def _key(r):
+        p50 = r["time_to_fill"]["p50"]
+        return (-r["fill_rate"], p50 if p50 is not None else float("inf"))
+
+    return sorted(results, key=_key)
+
+
+def print_results(results, limit: int = 20):
+    print(f"{'step':>7}{'interval':>10}{'offset':>8}{'fill%':>8}"
+          f"{'ttf p50':>9}{'ttf p90':>9}{'cost p50':>10}{'cost p90':>10}{'mods':>7}")
+
+    def _f(v, fmt):
+        return "-" if v is None else format(v, fmt)
+
+    for r in results[:limit]:
+        print(f"{r['step']:>7g}{r['interval']:>10g}{r['offset']:>8g}{r['fill_rate'] * 100:>8.1f}"
+              f"{_f(r['time_to_fill']['p50'], '>9.1f')}{_f(r['time_to_fill']['p90'], '>9.1f')}"
+              f"{_f(r['cost_vs_mid']['p50'], '>10.3f')}{_f(r['cost_vs_mid']['p90'], '>10.3f')}"
+              f"{r['avg_modifications']:>7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="追价策略离线回测与参数扫描")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--csv", help="报价 CSV (t,bid,ask 或 t,leg1_bid,leg1_ask,...)")
+    src.add_argument("--log", help="IBRecorder 录制的回调日志")
+    src.add_argument("--script", help="模拟网关行情脚本 JSON, 按腿参数生成报价流")
+    parser.add_argument("--req-ids", type=int, nargs="+", help="--log 时使用的行情 reqId (每腿一个)")
+    parser.add_argument("--legs-from", help="从该下单脚本读取腿参数, 例如 IBOption4Leg")
+    parser.add_argument("--action", choices=["BUY", "SELL"], help="组合方向 (默认取自 --legs-from)")
+    parser.add_argument("--duration", type=float, default=3600.0, help="--script 时生成的报价时长(秒)")
+    parser.add_argument("--steps", type=float, nargs="+", default=[0.01, 0.02, 0.05])
+    parser.add_argument("--intervals", type=float, nargs="+", default=[2.0, 5.0, 10.0])
+    parser.add_argument("--offsets", type=float, nargs="+", default=[0.0, 0.05, 0.10],
+                        help="起始限价相对中间价的让利幅度")
+    parser.add_argument("--final-offset", type=float, default=0.0,
+                        help="最终限价越过起始对手价的幅度")
+    parser.add_argument("--latency", type=float, default=0.25, help="下单/改单生效延迟(秒)")
+    parser.add_argument("--passive-rate", type=float, default=0.02, help="挂单被动成交强度(每秒)")
+    parser.add_argument("--max-wait", type=float, default=300.0, help="单笔订单最长等待(秒)")
+    parser.add_argument("--start-every", type=float, default=30.0, help="起点间隔(秒)")
+    parser.add_argument("--workers", type=int, default=None, help="进程数, 默认 CPU 核数")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--increment", default=str(DEFAULT_PRICE_INCREMENT),
+                        help="合约的最小变动价位, 例如 0.05 (价格 >= 3 的期权常见)")
+    parser.add_argument("--json", help="结果另存为 JSON")
+    args = parser.parse_args()
+
+    symbol, action, legs = None, args.action, None
+    if args.legs_from:
+        symbol, script_action, legs = legs_from_script(args.legs_from)
+        action = action or script_action
+    if action is None:
+        parser.error("--action or --legs-from is required")
+    leg_pairs = [(leg["ratio"], leg["action"]) for leg in legs] if legs else None
+
+    if args.csv:
+        stream = load_csv(args.csv, leg_pairs)
+    elif args.log:
+        if not args.req_ids:
+            parser.error("--log requires --req-ids")
+        stream = load_recorder_log(args.log, args.req_ids,
+                                   leg_pairs if len(args.req_ids) > 1 else None)
+    else:
+        if not legs:
+            parser.error("--script requires --legs-from")
+        from IBFakeGateway import MarketScript
+        script = MarketScript.from_file(args.script)
+        leg_keys = [((symbol, "OPT", leg["expiry"], leg["strike"], leg["right"]),
+                     leg["ratio"], leg["action"]) for leg in legs]
+        stream = stream_from_market_script(script, leg_keys, args.duration)
+
+    times = stream[0]
+    print(f"Quote stream: {len(times)} updates over {times[-1] - times[0]:.1f} s")
+    results = sweep(stream, action, args.steps, args.intervals, args.offsets,
+                    final_offset=args.final_offset,
+                    fill_model=FillModel(args.latency, args.passive_rate),
+                    max_wait=args.max_wait, start_every=args.start_every,
+                    workers=args.workers, seed=args.seed, increment=args.increment)
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"action": action, "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟 TWS/IB Gateway: 实现 TWS socket 协议中本项目用到的那部分消息,
+用于在没有真实 TWS 的情况下做可重复的基准测试和回归测试.
+
+支持:
+  - 握手 / startApi / nextValidId / managedAccounts / reqIds
+  - reqContractDetails (STK / OPT, OPT 可只给 symbol+expiry 一次返回整条链)
+  - reqSecDefOptParams
+  - reqMktData 快照 (tick + tickSnapshotEnd) 与流式行情, 期权附带模型 Greeks (tickOptionComputation), cancelMktData
+  - placeOrder / 改单 / cancelOrder, 按成交模型推送 orderStatus
+  - reqMarketRule, 合约详情中带 marketRuleIds; 限价不符合最小变动价位的订单/改单返回错误 110
+  - reqPositions / reqAccountUpdates / reqPnLSingle: 初始持仓来自脚本, 成交后更新持仓并推送变化
+  - reqHistoricalData (STK / OPT 的 TRADES / MIDPOINT / BID / ASK, 标的的 OPTION_IMPLIED_VOLATILITY /
+    HISTORICAL_VOLATILITY), 按日期确定性生成的 K 线; 15 秒内的相同请求和 2 秒内同一合约第 6 个请求返回 162
+  - 错误码 (未知合约 200, 未知订单 10147, 以及按脚本注入的任意错误)
+不发送 openOrder / execDetails (解码过于复杂, 现有代码只依赖 orderStatus).
+
+行情脚本 (JSON) 示例:
+{
+  "today": "20250301",
+  "underlyings": {
+    "PDD": {"spot": 120.0, "vol": 0.45, "path": [[0, 120.0], [60, 121.5]],
+            "expirations": ["20250321", "20250328"], "strike_step": 1.0}
+  },
+  "quotes": {"PDD 20250328 122 C": [[0, 4.10, 4.30], [30, 4.20, 4.40]]},
+  "market_rules": {"32": [[0, 0.01], [3, 0.05]]},
+  "positions": {"PDD": [100, 118.5], "PDD 20250321 130 C": [-2, 210.0]},
+  "cash": 100000
+}
+path 为 [秒, 标的价] 的折线, 期权报价默认由 Black-Scholes 按当前标的价计算;
+quotes 可对单个合约直接给出 [秒, bid, ask] 的阶梯报价;
+market_rules 为 {规则ID: [[lowEdge, increment], ...]}, 标的可用 "option_rule" 指定其期权使用的规则;
+positions 为初始持仓 {合约: [数量, avgCost]}, avgCost 与 TWS 一致 (期权为每张的成本, 即价格 x 乘数).
+
+用法:
+    python IBFakeGateway.py --port 7497 --latency 0.02 --script quotes.json
+"""
+
+import argparse
+import datetime
+import heapq
+import itertools
+import json
+import math
+import random
+import socket
+import struct
+import threading
+import time
+from collections import Counter, deque
+
+# 与客户端协商的服务器版本; 本文件中所有消息的字段布局都按该版本编排
+SERVER_VERSION = 151
+
+# ---- 客户端 -> 服务器 消息 ID ----
+OUT_REQ_MKT_DATA = 1
+OUT_CANCEL_MKT_DATA = 2
+OUT_PLACE_ORDER = 3
+OUT_CANCEL_ORDER = 4
+OUT_REQ_ACCT_DATA = 6
+OUT_REQ_IDS = 8
+OUT_REQ_CONTRACT_DATA = 9
+OUT_REQ_HISTORICAL_DATA = 20
+OUT_REQ_POSITIONS = 61
+OUT_CANCEL_POSITIONS = 64
+OUT_START_API = 71
+OUT_REQ_SEC_DEF_OPT_PARAMS = 78
+OUT_REQ_MARKET_RULE = 91
+OUT_REQ_PNL_SINGLE = 94
+OUT_CANCEL_PNL_SINGLE = 95
+
+# ---- 服务器 -> 客户端 消息 ID ----
+IN_TICK_PRICE = 1
+IN_TICK_SIZE = 2
+IN_TICK_OPTION_COMPUTATION = 21
+IN_ORDER_STATUS = 3
+IN_ERR_MSG = 4
+IN_ACCT_VALUE = 6
+IN_PORTFOLIO_VALUE = 7
+IN_ACCT_UPDATE_TIME = 8
+IN_NEXT_VALID_ID = 9
+IN_CONTRACT_DATA = 10
+IN_MANAGED_ACCTS = 15
+IN_HISTORICAL_DATA = 17
+IN_CONTRACT_DATA_END = 52
+IN_ACCT_DOWNLOAD_END = 54
+IN_TICK_SNAPSHOT_END = 57
+IN_POSITION_DATA = 61
+IN_POSITION_END = 62
+IN_SEC_DEF_OPT_PARAMS = 75
+IN_SEC_DEF_OPT_PARAMS_END = 76
+IN_MARKET_RULE = 93
+IN_PNL_SINGLE = 95
+
+# 客户端消息 ID -> 统计用名称
+REQUEST_NAMES = {
+    OUT_REQ_MKT_DATA: "reqMktData",
+    OUT_CANCEL_MKT_DATA: "cancelMktData",
+    OUT_PLACE_ORDER: "placeOrder",
+    OUT_CANCEL_ORDER: "cancelOrder",
+    OUT_REQ_IDS: "reqIds",
+    OUT_REQ_CONTRACT_DATA: "reqContractDetails",
+    OUT_REQ_HISTORICAL_DATA: "reqHistoricalData",
+    OUT_START_API: "startApi",
+    OUT_REQ_SEC_DEF_OPT_PARAMS: "reqSecDefOptParams",
+    OUT_REQ_MARKET_RULE: "reqMarketRule",
+    OUT_REQ_ACCT_DATA: "reqAccountUpdates",
+    OUT_REQ_POSITIONS: "reqPositions",
+    OUT_CANCEL_POSITIONS: "cancelPositions",
+    OUT_REQ_PNL_SINGLE: "reqPnLSingle",
+    OUT_CANCEL_PNL_SINGLE: "cancelPnLSingle",
+}
+# 请求中 reqId 所在的字段位置 (不含消息 ID), 其余请求为 version 之后的第一个字段; None 表示没有 reqId
+REQ_ID_FIELD = {
+    OUT_PLACE_ORDER: 1, OUT_REQ_SEC_DEF_OPT_PARAMS: 1, OUT_REQ_MARKET_RULE: 1,
+    OUT_REQ_PNL_SINGLE: 1, OUT_CANCEL_PNL_SINGLE: 1, OUT_REQ_HISTORICAL_DATA: 1,
+    OUT_REQ_ACCT_DATA: None, OUT_REQ_POSITIONS: None, OUT_CANCEL_POSITIONS: None,
+}
+
+# 模拟网关唯一的账户
+ACCOUNT = "DU0000000"
+
+TERMINAL_STATUSES = ("Filled", "Cancelled", "ApiCanceled")
+
+# 默认的价格规则: 26 股票一分钱; 32 期权 3 元以下 0.01, 3 元及以上 0.05
+STOCK_RULE_ID = 26
+OPTION_RULE_ID = 32
+DEFAULT_MARKET_RULES = {
+    STOCK_RULE_ID: [(0.0, 0.01)],
+    OPTION_RULE_ID: [(0.0, 0.01), (3.0, 0.05)],
+}
+
+
+def _norm_cdf(x: float) -> float:
+    return 0.5 * (1.0 + math.erf(x / math.sqrt(2.0)))
+
+
+def bs_price(spot: float, strike: float, t: float, vol: float, right: str, rate: float = 0.0) -> float:
+    """Black-Scholes 理论价, 用来生成默认的期权报价."""
+    intrinsic = max(0.0, spot - strike) if right == "C" else max(0.0, strike - spot)
+    if t <= 0 or vol <= 0:
+        return intrinsic
+    sqrt_t = math.sqrt(t)
+    d1 = (math.log(spot / strike) + (rate + 0.5 * vol * vol) * t) / (vol * sqrt_t)
+    d2 = d1 - vol * sqrt_t
+    disc = math.exp(-rate * t)
+    if right == "C":
+        return spot * _norm_cdf(d1) - strike * disc * _norm_cdf(d2)
+    return strike * disc * _norm_cdf(-d2) - spot * _norm_cdf(-d1)
+
+
+def bs_model(spot: float, strike: float, t: float, vol: float, right: str, rate: float = 0.0):
+    """(delta, gamma, vega, theta) 与 TWS 的 tickOptionComputation 同口径: vega 每 1 个波动率点, theta 每日."""
+    if t <= 0 or vol <= 0:
+        itm = spot > strike if right == "C" else spot < strike
+        return (1.0 if right == "C" else -1.0) * itm, 0.0, 0.0, 0.0
+    sqrt_t = math.sqrt(t)
+    d1 = (math.log(spot / strike) + (rate + 0.5 * vol * vol) * t) / (vol * sqrt_t)
+    pdf = math.exp(-0.5 * d1 * d1) / math.sqrt(2.0 * math.pi)
+    delta = _norm_cdf(d1) if right == "C" else _norm_cdf(d1) - 1.0
+    theta = -spot * pdf * vol / (2.0 * sqrt_t) / 365.0
+    return delta, pdf / (spot * vol * sqrt_t), spot * pdf * sqrt_t / 100.0, theta
+
+
+def _fmt_strike(strike: float) -> str:
+    return f"{strike:g}"
+
+
+def _next_fridays(today: datetime.date, count: int):
+    days = (4 - today.weekday()) % 7 or 7
+    first = today + datetime.timedelta(days=days)
+    return [(first + datetime.timedelta(weeks=i)).strftime("%Y%m%d") for i in range(count)]
+
+
+# 历史 K 线: 常规交易时段固定按 UTC 14:30-21:00 (不处理夏令时), 日线时间为当天 0 点 (UTC)
+SESSION_OPEN = 14 * 3600 + 1800
+SESSION_CLOSE = 21 * 3600
+_BAR_UNITS = {"sec": 1, "min": 60, "hour": 3600, "day": 86400, "week": 7 * 86400, "month": 30 * 86400}
+_DURATION_UNITS = {"S": 1, "D": 86400, "W": 7 * 86400, "M": 30 * 86400, "Y": 365 * 86400}
+# 只有成交类数据有成交量; 其余 (中间价 / 隐含波动率) 的 volume / wap / barCount 为 -1
+_TRADE_SERIES = ("TRADES", "ADJUSTED_LAST")
+
+
+def bar_seconds(bar_size: str) -> int:
+    """"5 mins" / "1 hour" / "1 day" -> 秒数."""
+    count, unit = bar_size.split()
+    return int(count) * _BAR_UNITS[unit.rstrip("s")]
+
+
+def duration_seconds(duration: str) -> int:
+    """"30 D" / "1 Y" -> 秒数."""
+    count, unit = duration.split()
+    return int(count) * _DURATION_UNITS[unit.upper()]
+
+
+class MarketScript:
+    """
+    行情脚本: 定义可交易的标的/期权, 以及随时间变化的报价.
+    时间 t 为相对网关启动的秒数.
+    """
+    def __init__(self, spec: dict = None):
+        spec = spec or {}
+        self.today = datetime.datetime.strptime(spec.get("today", "20250301"), "%Y%m%d").date()
+        self.spread_pct = float(spec.get("spread_pct", 0.04))
+        self.quote_size = int(spec.get("quote_size", 20))
+        self.underlyings = {}
+        for symbol, u in (spec.get("underlyings") or {"UVXY": {"spot": 20.0}}).items():
+            spot = float(u.get("spot", 100.0))
+            step = float(u.get("strike_step", 1.0 if spot >= 25 else 0.5))
+            strikes = u.get("strikes")
+            if strikes is None:
+                lo = max(step, math.floor(spot * 0.5 / step) * step)
+                hi = math.ceil(spot * 1.5 / step) * step
+                n = int(round((hi - lo) / step))
+                strikes = [round(lo + i * step, 4) for i in range(n + 1)]
+            self.underlyings[symbol] = {
+                "spot": spot,
+                "vol": float(u.get("vol", 0.5)),
+                "path": sorted(u.get("path") or [[0, spot]]),
+                "expirations": sorted(u.get("expirations") or _next_fridays(self.today, 8)),
+                "strikes": sorted(float(s) for s in strikes),
+                "min_tick": float(u.get("min_tick", 0.01)),
+                "option_rule": int(u.get("option_rule", OPTION_RULE_ID)),
+            }
+        # "SYM YYYYMMDD STRIKE R" 或 "SYM" -> [[t, bid, ask], ...]
+        self.quotes = {k: sorted(v) for k, v in (spec.get("quotes") or {}).items()}
+        self.market_rules = dict(DEFAULT_MARKET_RULES)
+        for rule_id, rows in (spec.get("market_rules") or {}).items():
+            self.market_rules[int(rule_id)] = sorted((float(lo), float(inc)) for lo, inc in rows)
+        self.cash = float(spec.get("cash", 100000.0))
+
+        # 合约注册表
+        self._con_ids = {}
+        self._contracts = {}
+        self._con_id_seq = itertools.count(100001)
+        for symbol in self.underlyings:
+            self._register((symbol, "STK", "", 0.0, ""))
+
+        # 初始持仓: key -> [数量, avgCost]
+        self.positions = {}
+        for name, (qty, avg_cost) in (spec.get("positions") or {}).items():
+            parts = name.split()
+            if len(parts) == 1:
+                keys = self.lookup(parts[0], "STK")
+            else:
+                keys = self.lookup(parts[0], "OPT", parts[1], float(parts[2]), parts[3])
+            if len(keys) != 1:
+                raise ValueError(f"unknown position contract {name}")
+            self.positions[keys[0]] = [float(qty), float(avg_cost)]
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def _register(self, key) -> int:
+        con_id = self._con_ids.get(key)
+        if con_id is None:
+            con_id = next(self._con_id_seq)
+            self._con_ids[key] = con_id
+            self._contracts[con_id] = key
+        return con_id
+
+    def contract_by_con_id(self, con_id: int):
+        return self._contracts.get(con_id)
+
+    def lookup(self, symbol: str, sec_type: str, expiry: str = "", strike: float = 0.0, right: str = ""):
+        """
+        返回匹配的合约 key 列表 (symbol, secType, expiry, strike, right).
+        OPT 的 expiry/strike/right 为空时视为通配, 可一次拿到整条链.
+        """
+        u = self.underlyings.get(symbol)
+        if u is None:
+            return []
+        if sec_type == "STK":
+            return [(symbol, "STK", "", 0.0, "")]
+        if sec_type != "OPT":
+            return []
+        right = {"CALL": "C", "PUT": "P"}.get(right, right)
+        expiries = [expiry] if expiry else u["expirations"]
+        strikes = [strike] if strike else u["strikes"]
+        rights = [right] if right else ["C", "P"]
+        result = []
+        for e in expiries:
+            if e not in u["expirations"]:
+                continue
+            for s in strikes:
+                if not any(abs(s - k) < 1e-6 for k in u["strikes"]):
+                    continue
+                for r in rights:
+                    key = (symbol, "OPT", e, float(s), r)
+                    self._register(key)
+                    result.append(key)
+        return result
+
+    def con_id(self, key) -> int:
+        return self._register(key)
+
+    def market_rule_id(self, key) -> int:
+        symbol, sec_type = key[0], key[1]
+        if sec_type == "STK":
+            return STOCK_RULE_ID
+        return self.underlyings[symbol]["option_rule"]
+
+    def increment(self, rule_id: int, price: float) -> float:
+        """价格规则在该价位上的最小变动价位."""
+        inc = 0.01
+        for low_edge, rule_inc in self.market_rules.get(rule_id, [(0.0, 0.01)]):
+            if abs(price) >= low_edge - 1e-9:
+                inc = rule_inc
+        return inc
+
+    def spot(self, symbol: str, t: float) -> float:
+        path = self.underlyings[symbol]["path"]
+        if t <= path[0][0]:
+            return float(path[0][1])
+        for (t0, p0), (t1, p1) in zip(path, path[1:]):
+            if t0 <= t <= t1:
+                if t1 == t0:
+                    return float(p1)
+                return float(p0) + (float(p1) - float(p0)) * (t - t0) / (t1 - t0)
+        return float(path[-1][1])
+
+    def _round(self, price: float, tick: float) -> float:
+        return round(round(price / tick) * tick, 4)
+
+    def quote(self, key, t: float):
+        """返回 (bid, ask, last, bidSize, askSize)."""
+        symbol, sec_type, expiry, strike, right = key
+        u = self.underlyings[symbol]
+        script_key = symbol if sec_type == "STK" else f"{symbol} {expiry} {_fmt_strike(strike)} {right}"
+        steps = self.quotes.get(script_key)
+        if steps:
+            cur = steps[0]
+            for step in steps:
+                if step[0] <= t:
+                    cur = step
+            bid, ask = float(cur[1]), float(cur[2])
+            return bid, ask, round((bid + ask) / 2, 4), self.quote_size, self.quote_size
+
+        spot = self.spot(symbol, t)
+        if sec_type == "STK":
+            half = max(0.01, spot * 0.0005)
+            return (self._round(spot - half, 0.01), self._round(spot + half, 0.01), round(spot, 2),
+                    self.quote_size * 10, self.quote_size * 10)
+
+        exp_date = datetime.datetime.strptime(expiry, "%Y%m%d").date()
+        years = max((exp_date - self.today).days, 0.5) / 365.0
+        fair = bs_price(spot, strike, years, u["vol"], right)
+        tick = max(u["min_tick"], self.increment(u["option_rule"], fair))
+        half = max(tick, fair * self.spread_pct / 2)
+        bid = max(0.0, self._round(fair - half, tick))
+        ask = max(tick, self._round(fair + half, tick))
+        return bid, ask, self._round(fair, tick), self.quote_size, self.quote_size
+
+    def model(self, key, t: float):
+        """期权的模型值 (iv, delta, 理论价, gamma, vega, theta, 标的价), 按脚本里的波动率计算; 非期权返回 None."""
+        symbol, sec_type, expiry, strike, right = key
+        if sec_type != "OPT":
+            return None
+        vol = self.underlyings[symbol]["vol"]
+        spot = self.spot(symbol, t)
+        exp_date = datetime.datetime.strptime(expiry, "%Y%m%d").date()
+        years = max((exp_date - self.today).days, 0.5) / 365.0
+        delta, gamma, vega, theta = bs_model(spot, strike, years, vol, right)
+        return (vol, round(delta, 6), round(bs_price(spot, strike, years, vol, right), 6), round(gamma, 6),
+                round(vega, 6), round(theta, 6), round(spot, 4))
+
+    def _shock(self, symbol: str, day: int) -> float:
+        """第 day 天 (距 1970-01-01 的天数) 的标的日对数收益, 按 (标的, 日期) 固定, 周末为 0."""
+        if (day + 3) % 7 >= 5:
+            return 0.0
+        vol = self.underlyings[symbol]["vol"]
+        return random.Random(f"{symbol}:{day}").gauss(0.0, vol / math.sqrt(252.0))
+
+    def history(self, key, what: str, bar_seconds: int, start: int, end: int):
+        """
+        [start, end] (UTC 秒) 内的 K 线 [(时间, open, high, low, close, volume, wap, barCount)].
+        标的日收盘价以 today 的收盘为脚本的初始价、往前按固定的日收益倒推, 不同请求窗口得到的同一根 K 线相同;
+        日内价格在前一天收盘和当天收盘之间按时段比例插值. 期权为按该时刻标的价和脚本波动率的 BS 价.
+        """
+        symbol, sec_type, expiry, strike, right = key
+        u = self.underlyings[symbol]
+        what = what.upper()
+        if sec_type == "OPT" and what not in ("TRADES", "MIDPOINT", "BID", "ASK"):
+            return None
+        today = (self.today - datetime.date(1970, 1, 1)).days
+        first = max(start // 86400, today - 3700)
+        last = min(end // 86400, today)
+        if first > last:
+            return []
+        # log_close[i] 为第 first - 1 + i 天的收盘
+        log_close = [0.0] * (today - first + 2)
+        log_close[-1] = math.log(u["path"][0][1])
+        for i in range(len(log_close) - 1, 0, -1):
+            log_close[i - 1] = log_close[i] - self._shock(symbol, first + i - 1)
+        exp_day = None
+        if sec_type == "OPT":
+            exp_day = (datetime.datetime.strptime(expiry, "%Y%m%d").date() - datetime.date(1970, 1, 1)).days
+
+        def value(day: int, seconds: float) -> float:
+            i = day - first + 1
+            frac = min(max((seconds - SESSION_OPEN) / (SESSION_CLOSE - SESSION_OPEN), 0.0), 1.0)
+            spot = math.exp(log_close[i - 1] + frac * (log_close[i] - log_close[i - 1]))
+            if what in ("OPTION_IMPLIED_VOLATILITY", "HISTORICAL_VOLATILITY"):
+                phase = 0.0 if what[0] == "O" else 1.0
+                return u["vol"] * math.exp(0.25 * math.sin(2 * math.pi * day / 120.0 + phase)
+                                           + 0.1 * math.sin(day * 1.7 + phase) + 0.02 * frac)
+            if sec_type == "OPT":
+                years = max((exp_day - day) * 86400 - seconds + SESSION_CLOSE, 43200) / (365.0 * 86400)
+                price = bs_price(spot, strike, years, u["vol"], right)
+                half = max(0.01, price * self.spread_pct / 2)
+            else:
+                price, half = spot, max(0.01, spot * 0.0005)
+            return price - half if what == "BID" else price + half if what == "ASK" else price
+
+        bars = []
+        for day in range(first, last + 1):
+            if (day + 3) % 7 >= 5 or (exp_day is not None and day > exp_day):
+                continue
+            if bar_seconds >= 86400:
+                starts = [(day * 86400, SESSION_OPEN, SESSION_CLOSE)]
+            else:
+                starts = [(day * 86400 + s, s, min(s + bar_seconds, SESSION_CLOSE))
+                          for s in range(SESSION_OPEN, SESSION_CLOSE, bar_seconds)]
+            for ts, s0, s1 in starts:
+                if ts < start or ts > end:
+                    continue
+                rng = random.Random(f"{key}:{what}:{ts}")
+                o, c = value(day, s0), value(day, s1)
+                h = max(o, c) * (1 + 0.004 * rng.random())
+                low = min(o, c) * (1 - 0.004 * rng.random())
+                if what in _TRADE_SERIES:
+                    volume = int(rng.uniform(0.5, 1.5) * (1e6 if sec_type == "STK" else 500)
+                                 * (s1 - s0) / (SESSION_CLOSE - SESSION_OPEN)) + 1
+                    bars.append((ts, o, h, low, c, volume, (h + low + c) / 3, max(1, volume // 100)))
+                else:
+                    bars.append((ts, o, h, low, c, -1, -1, -1))
+        return bars
+
+    @staticmethod
+    def multiplier(key) -> float:
+        return 1.0 if key[1] == "STK" else 100.0
+
+    def combo_quote(self, legs, t: float):
+        """
+        组合(BAG)报价: legs 为 [(conId, ratio, action)], 买组合时
+        BUY 腿付 ask, SELL 腿收 bid; bid 侧反之.
+        """
+        bid = ask = 0.0
+        for con_id, ratio, action in legs:
+            key = self.contract_by_con_id(con_id)
+            if key is None:
+                return None
+            leg_bid, leg_ask, _, _, _ = self.quote(key, t)
+            if action == "BUY":
+                ask += ratio * leg_ask
+                bid += ratio * leg_bid
+            else:
+                ask -= ratio * leg_bid
+                bid -= ratio * leg_ask
+        return round(bid, 4), round(ask, 4), round((bid + ask) / 2, 4), self.quote_size, self.quote_size
+
+
+class _Fields:
+    """按顺序读取一条客户端消息的各个字段."""
+    def __init__(self, fields):
+        self._it = iter(fields)
+
+    def str(self) -> str:
+        return next(self._it).decode()
+
+    def int(self) -> int:
+        s = next(self._it)
+        return int(s) if s else 0
+
+    def float(self):
+        s = next(self._it)
+        return float(s) if s else None
+
+    def skip(self, n: int = 1):
+        for _ in range(n):
+            next(self._it)
+
+
+class _Session:
+    """一个客户端连接: 读线程解析请求, 发送线程按延迟发出响应, 行情线程推送流式报价与成交."""
+    def __init__(self, gateway, sock: socket.socket):
+        self.gw = gateway
+        self.sock = sock
+        self.client_id = None
+        self._outbox = []
+        self._last_due = 0.0
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self._closed = False
+        # reqId -> (key 或 None, combo legs 或 None)
+        self.subscriptions = {}
+        # orderId -> 订单状态 dict
+        self.orders = {}
+        # 持仓 / 账户 / 单合约盈亏订阅; 记录上次推送的值, 只推送变化
+        self.position_updates = False
+        self.account_updates = False
+        self.portfolio_sent = {}
+        self.pnl_subscriptions = {}  # reqId -> [key, 上次推送的值]
+        self._perm_id = itertools.count(900001)
+
+    # ---- 发送 ----
+    def send(self, *fields, delay: float = None):
+        payload = "".join(f"{f}\0" for f in fields).encode()
+        msg = struct.pack("!I", len(payload)) + payload
+        due = time.monotonic() + (self.gw.next_latency() if delay is None else delay)
+        with self._cv:
+            # 同一连接上的消息按发送顺序到达 (TCP), 随机延迟不能让 ...End 跑到数据前面
+            due = self._last_due = max(due, self._last_due)
+            heapq.heappush(self._outbox, (due, next(self._seq), msg))
+            self._cv.notify()
+
+    def _sender(self):
+        while True:
+            with self._cv:
+                while not self._closed and (not self._outbox or self._outbox[0][0] > time.monotonic()):
+                    timeout = None if not self._outbox else max(0.0, self._outbox[0][0] - time.monotonic())
+                    self._cv.wait(timeout)
+                if self._closed:
+                    return
+                _, _, msg = heapq.heappop(self._outbox)
+            try:
+                self.sock.sendall(msg)
+            except OSError:
+                self.close()
+                return
+
+    def error(self, req_id: int, code: int, msg: str):
+        self.send(IN_ERR_MSG, 2, req_id, code, msg)
+
+    # ---- 接收 ----
+    def _recv_exact(self, n: int) -> bytes:
+        buf = b""
+        while len(buf) < n:
+            chunk = self.sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError("client closed")
+            buf += chunk
+        return buf
+
+    def _read_msg(self):
+        size = struct.unpack("!I", self._recv_exact(4))[0]
+        return self._recv_exact(size).split(b"\0")[:-1]
+
+    def run(self):
+        threading.Thread(target=self._sender, daemon=True).start()
+        try:
+            prefix = self._recv_exact(4)
+            if prefix != b"API\0":
+                return
+            self._read_msg()  # "v100..xxx", 这里直接使用固定的 SERVER_VERSION
+            conn_time = datetime.datetime.now().strftime("%Y%m%d %H:%M:%S")
+            self.send(SERVER_VERSION, conn_time, delay=0.0)
+            while not self._closed:
+                fields = self._read_msg()
+                if fields:
+                    self.gw.handle(self, fields)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        with self._cv:
+            if self._closed:
+                return
+            self._closed = True
+            self._cv.notify_all()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        self.gw._drop_session(self)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+
+class FakeTWSGateway:
+    """
+    模拟 TWS 网关.
+    latency: 每个响应的固定延迟(秒), jitter: 额外的均匀随机延迟上限(秒, 固定种子, 结果可复现).
+    fill_mode: "cross"  限价穿过对手价时成交 (默认);
+               "immediate" 下单即成交;
+               "never"  永不成交.
+    fill_chunk: 每次撮合最多成交的数量, 0 表示一次全部成交.
+    tick_interval: 流式行情和撮合的节拍(秒).
+    inject_errors: {请求名: [(code, msg), ...]}, 该类请求依次返回这些错误而不做正常处理.
+    check_price_increment: 单腿限价不符合价格规则时像真实 TWS 一样返回错误 110.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 7497, script: MarketScript = None,
+                 latency: float = 0.0, jitter: float = 0.0, fill_mode: str = "cross",
+                 fill_chunk: int = 0, tick_interval: float = 0.25, inject_errors: dict = None,
+                 check_price_increment: bool = True, seed: int = 7, verbose: bool = False):
+        self.host = host
+        self.port = port
+        self.script = script or MarketScript()
+        self.latency = latency
+        self.jitter = jitter
+        self.fill_mode = fill_mode
+        self.fill_chunk = fill_chunk
+        self.tick_interval = tick_interval
+        self.inject_errors = {k: list(v) for k, v in (inject_errors or {}).items()}
+        self.check_price_increment = check_price_increment
+        self.verbose = verbose
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+        self._next_order_id = 1
+        # 账户持仓 (所有连接共享): key -> {"position", "avg_cost", "realized"}
+        self.positions = {key: {"position": qty, "avg_cost": cost, "realized": 0.0}
+                          for key, (qty, cost) in self.script.positions.items()}
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+        # 请求处理与撮合线程共用的锁, 保证订单状态只被一个线程修改
+        self._lock = threading.RLock()
+        self._server_sock = None
+        self._stop = threading.Event()
+        self._t0 = time.monotonic()
+
+        # 历史数据的限速检查: 请求内容 -> 上次时间; 合约 -> 最近的请求时间
+        self._history_requests = {}
+        self._history_by_contract = {}
+
+        # 统计: 各类请求次数, 以及 (monotonic 时间, 事件名, 详情) 事件流
+        self.stats = Counter()
+        self.events = []
+
+    # ---- 生命周期 ----
+    def start(self):
+        """在后台线程中启动网关, 返回实际监听端口 (port=0 时由系统分配)."""
+        self._server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server_sock.bind((self.host, self.port))
+        self._server_sock.listen(8)
+        self.port = self._server_sock.getsockname()[1]
+        self._t0 = time.monotonic()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        threading.Thread(target=self._pump_loop, daemon=True).start()
+        return self.port
+
+    def stop(self):
+        self._stop.set()
+        if self._server_sock is not None:
+            try:
+                self._server_sock.close()
+            except OSError:
+                pass
+        with self._sessions_lock:
+            sessions = list(self._sessions)
+        for s in sessions:
+            s.close()
+
+    def serve_forever(self):
+        self.start()
+        print(f"Fake TWS gateway listening on {self.host}:{self.port} (server version {SERVER_VERSION})")
+        try:
+            while not self._stop.is_set():
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            print("Request counts:", dict(self.stats))
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                sock, _ = self._server_sock.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _Session(self, sock)
+            with self._sessions_lock:
+                self._sessions.append(session)
+            threading.Thread(target=session.run, daemon=True).start()
+
+    def _drop_session(self, session):
+        with self._sessions_lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+
+    # ---- 工具 ----
+    def now(self) -> float:
+        """相对网关启动的秒数, 即行情脚本里的时间轴."""
+        return time.monotonic() - self._t0
+
+    def next_latency(self) -> float:
+        if self.jitter <= 0:
+            return self.latency
+        with self._rng_lock:
+            return self.latency + self._rng.uniform(0.0, self.jitter)
+
+    def _event(self, event: str, **details):
+        self.events.append((time.monotonic(), event, details))
+        if self.verbose:
+            print(f"[fake-tws] {event} {details}")
+
+    # ---- 请求分发 ----
+    def handle(self, session: _Session, fields):
+        msg_id = int(fields[0])
+        name = REQUEST_NAMES.get(msg_id)
+        if name is None:
+            return
+        f = _Fields(fields[1:])
+        if msg_id == OUT_PLACE_ORDER:
+            order_id = int(fields[1])
+            if order_id in session.orders:
+                name = "modifyOrder"
+        self.stats[name] += 1
+        self._event("request", name=name)
+
+        pending = self.inject_errors.get(name)
+        if pending:
+            code, text = pending.pop(0)
+            index = REQ_ID_FIELD.get(msg_id, 2)
+            req_id = -1 if index is None else int(fields[index])
+            session.error(req_id, code, text)
+            return
+
+        handler = getattr(self, f"_on_{name}", None)
+        if handler is not None:
+            with self._lock:
+                handler(session, f)
+
+    def _on_startApi(self, session, f):
+        f.skip()  # version
+        session.client_id = f.int()
+        session.send(IN_NEXT_VALID_ID, 1, self._next_order_id)
+        session.send(IN_MANAGED_ACCTS, 1, ACCOUNT)
+        self._event("connected", clientId=session.client_id)
+
+    def _on_reqIds(self, session, f):
+        session.send(IN_NEXT_VALID_ID, 1, self._next_order_id)
+
+    def _read_contract(self, f, with_include_expired=False):
+        """解析 conId..tradingClass 这段通用的合约字段."""
+        con_id = f.int()
+        symbol = f.str()
+        sec_type = f.str()
+        expiry = f.str()
+        strike = f.float() or 0.0
+        right = f.str()
+        f.skip(4)  # multiplier, exchange, primaryExchange, currency
+        f.skip(2)  # localSymbol, tradingClass
+        return con_id, symbol, sec_type, expiry, strike, right
+
+    def _resolve(self, con_id, symbol, sec_type, expiry, strike, right):
+        if con_id:
+            key = self.script.contract_by_con_id(con_id)
+            return [key] if key else []
+        return self.script.lookup(symbol, sec_type, expiry, strike, right)
+
+    def _on_reqContractDetails(self, session, f):
+        f.skip()  # version
+        req_id = f.int()
+        keys = self._resolve(*self._read_contract(f))
+        if not keys:
+            session.error(req_id, 200, "No security definition has been found for the request")
+            return
+        for key in keys:
+            session.send(*self._contract_data_fields(req_id, key))
+        session.send(IN_CONTRACT_DATA_END, 1, req_id)
+
+    def _contract_data_fields(self, req_id, key):
+        symbol, sec_type, expiry, strike, right = key
+        con_id = self.script.con_id(key)
+        u = self.script.underlyings[symbol]
+        under_con_id = self.script.con_id((symbol, "STK", "", 0.0, ""))
+        local_symbol = self._local_symbol(key)
+        if sec_type == "STK":
+            multiplier, min_tick = "", 0.01
+            under_sym, under_type = "", ""
+        else:
+            multiplier, min_tick = "100", u["min_tick"]
+            under_sym, under_type = symbol, "STK"
+        return [
+            IN_CONTRACT_DATA, 8, req_id,
+            symbol, sec_type, expiry, strike, right, "SMART", "USD", local_symbol,
+            symbol, symbol, con_id, min_tick,
+            1,                                      # mdSizeMultiplier
+            multiplier, "LMT,MKT", "SMART",         # multiplier, orderTypes, validExchanges
+            1,                                      # priceMagnifier
+            under_con_id if sec_type != "STK" else 0,
+            symbol, "NASDAQ",                       # longName, primaryExchange
+            expiry[:6], "", "", "", "US/Eastern", "", "",
+            "", 0,                                  # evRule, evMultiplier
+            0,                                      # secIdList 数量
+            0, under_sym, under_type,               # aggGroup, underSymbol, underSecType
+            str(self.script.market_rule_id(key)),   # marketRuleIds (每个 validExchange 一个)
+            expiry,                                 # realExpirationDate
+        ]
+
+    @staticmethod
+    def _local_symbol(key) -> str:
+        symbol, sec_type, expiry, strike, right = key
+        if sec_type == "STK":
+            return symbol
+        return f"{symbol:<6}{expiry[2:]}{right}{int(round(strike * 1000)):08d}"
+
+    def _on_reqSecDefOptParams(self, session, f):
+        req_id = f.int()
+        symbol = f.str()
+        f.skip(2)  # futFopExchange, underlyingSecType
+        under_con_id = f.int()
+        u = self.script.underlyings.get(symbol)
+        if u is not None:
+            exps, strikes = u["expirations"], u["strikes"]
+            session.send(IN_SEC_DEF_OPT_PARAMS, req_id, "SMART", under_con_id, symbol, "100",
+                         len(exps), *exps, len(strikes), *strikes)
+        session.send(IN_SEC_DEF_OPT_PARAMS_END, req_id)
+
+    def _on_reqMarketRule(self, session, f):
+        rule_id = f.int()
+        rows = self.script.market_rules.get(rule_id)
+        if rows is None:
+            session.error(-1, 321, f"Error validating request: invalid market rule id {rule_id}")
+            return
+        fields = [IN_MARKET_RULE, rule_id, len(rows)]
+        for low_edge, inc in rows:
+            fields += [low_edge, inc]
+        session.send(*fields)
+
+    def _on_reqMktData(self, session, f):
+        f.skip()  # version
+        req_id = f.int()
+        con_id, symbol, sec_type, expiry, strike, right = self._read_contract(f)
+        legs = None
+        if sec_type == "BAG":
+            legs = []
+            for _ in range(f.int()):
+                legs.append((f.int(), f.int(), f.str()))
+                f.skip()  # exchange
+            key = None
+        else:
+            keys = self._resolve(con_id, symbol, sec_type, expiry, strike, right)
+            if len(keys) != 1:
+                session.error(req_id, 200, "No security definition has been found for the request")
+                return
+            key = keys[0]
+        if f.int():  # deltaNeutralContract
+            f.skip(3)
+        f.skip()  # genericTickList
+        snapshot = bool(f.int())
+
+        quote = self._quote(key, legs)
+        if quote is None:
+            session.error(req_id, 200, "No security definition has been found for the request")
+            return
+        self._send_quote(session, req_id, quote, None, key)
+        if snapshot:
+            session.send(IN_TICK_SNAPSHOT_END, 1, req_id)
+        else:
+            session.subscriptions[req_id] = (key, legs, quote)
+
+    def _history_end(self, end_str: str) -> int:
+        """endDateTime -> UTC 秒; 为空时为脚本 today 当天的此刻 (时间取真实时钟)."""
+        if not end_str:
+            midnight = datetime.datetime.combine(self.script.today, datetime.time())
+            return int(midnight.replace(tzinfo=datetime.timezone.utc).timestamp()) + int(time.time()) % 86400
+        end = datetime.datetime.strptime(end_str[:17].replace("-", " "), "%Y%m%d %H:%M:%S")
+        return int(end.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+    def _history_paced(self, key, request) -> bool:
+        """按 IB 的历史数据限速规则检查, 违反时返回 True: 15 秒内的相同请求, 2 秒内同一合约的第 6 个请求."""
+        now = time.monotonic()
+        last = self._history_requests.get(request)
+        recent = self._history_by_contract.setdefault((key, request[-1]), deque())
+        while recent and now - recent[0] > 2.0:
+            recent.popleft()
+        if (last is not None and now - last < 15.0) or len(recent) >= 5:
+            return True
+        self._history_requests[request] = now
+        recent.append(now)
+        return False
+
+    def _on_reqHistoricalData(self, session, f):
+        req_id = f.int()
+        con_id, symbol, sec_type, expiry, strike, right = self._read_contract(f)
+        f.skip()  # includeExpired
+        end_str = f.str()
+        bar_size = f.str()
+        duration = f.str()
+        f.skip()  # useRTH, 只生成常规时段
+        what = f.str()
+        format_date = f.int()
+        keys = self._resolve(con_id, symbol, sec_type, expiry, strike, right)
+        if len(keys) != 1:
+            session.error(req_id, 200, "No security definition has been found for the request")
+            return
+        key = keys[0]
+        if self._history_paced(key, (key, end_str, bar_size, duration, what)):
+            session.error(req_id, 162, "Historical Market Data Service error message:"
+                                       "Historical data request pacing violation")
+            return
+        try:
+            step = bar_seconds(bar_size)
+            end = self._history_end(end_str)
+            start = end - duration_seconds(duration)
+        except (ValueError, KeyError):
+            session.error(req_id, 321, f"Error validating request: invalid bar size or duration "
+                                       f"'{bar_size}' / '{duration}'")
+            return
+        bars = self.script.history(key, what, step, start, end)
+        if not bars:
+            session.error(req_id, 162, "Historical Market Data Service error message:HMDS query returned no data")
+            return
+
+        def stamp(ts):
+            if step >= 86400:
+                return time.strftime("%Y%m%d", time.gmtime(ts))
+            return str(ts) if format_date == 2 else time.strftime("%Y%m%d  %H:%M:%S", time.gmtime(ts))
+
+        fields = [IN_HISTORICAL_DATA, req_id,
+                  time.strftime("%Y%m%d  %H:%M:%S", time.gmtime(start)),
+                  time.strftime("%Y%m%d  %H:%M:%S", time.gmtime(end)), len(bars)]
+        for ts, o, h, low, c, volume, wap, count in bars:
+            fields += [stamp(ts), round(o, 4), round(h, 4), round(low, 4), round(c, 4), volume,
+                       round(wap, 4), count]
+        session.send(*fields)
+
+    def _on_cancelMktData(self, session, f):
+        f.skip()  # version
+        session.subscriptions.pop(f.int(), None)
+
+    def _quote(self, key, legs):
+        t = self.now()
+        if legs is not None:
+            return self.script.combo_quote(legs, t)
+        return self.script.quote(key, t)
+
+    def _send_quote(self, session, req_id, quote, previous, key=None):
+        bid, ask, last, bid_size, ask_size = quote
+        # tickPrice 自带 size 字段, 客户端会据此再回调一次 tickSize
+        if previous is None or previous[0] != bid or previous[3] != bid_size:
+            session.send(IN_TICK_PRICE, 6, req_id, 1, bid, bid_size, 0)
+        if previous is None or previous[1] != ask or previous[4] != ask_size:
+            session.send(IN_TICK_PRICE, 6, req_id, 2, ask, ask_size, 0)
+        if previous is None or previous[2] != last:
+            session.send(IN_TICK_PRICE, 6, req_id, 4, last, 1, 0)
+        # 期权另推送模型值 (tickType 13), 与真实 TWS 一样不需要 genericTickList
+        model = self.script.model(key, self.now()) if key is not None else None
+        if model is not None:
+            iv, delta, price, gamma, vega, theta, und = model
+            session.send(IN_TICK_OPTION_COMPUTATION, 6, req_id, 13, iv, delta, price, 0.0, gamma, vega, theta, und)
+
+    # ---- 持仓与账户 ----
+    def _position_state(self, key):
+        """(数量, 市价, 市值, avgCost, 未实现盈亏, 已实现盈亏), 市价取当前中间价."""
+        pos = self.positions[key]
+        bid, ask = self._quote(key, None)[:2]
+        mark = round((bid + ask) / 2, 4)
+        value = round(pos["position"] * mark * self.script.multiplier(key), 2)
+        unrealized = round(value - pos["position"] * pos["avg_cost"], 2)
+        return pos["position"], mark, value, pos["avg_cost"], unrealized, round(pos["realized"], 2)
+
+    def _send_position(self, session, key):
+        symbol, sec_type, expiry, strike, right = key
+        mult = "" if sec_type == "STK" else "100"
+        session.send(IN_POSITION_DATA, 3, ACCOUNT, self.script.con_id(key), symbol, sec_type, expiry,
+                     strike, right, mult, "SMART", "USD", self._local_symbol(key), symbol,
+                     self.positions[key]["position"], self.positions[key]["avg_cost"])
+
+    def _send_portfolio(self, session, key, state=None):
+        symbol, sec_type, expiry, strike, right = key
+        state = state or self._position_state(key)
+        position, mark, value, avg_cost, unrealized, realized = state
+        mult = "" if sec_type == "STK" else "100"
+        session.send(IN_PORTFOLIO_VALUE, 8, self.script.con_id(key), symbol, sec_type, expiry, strike,
+                     right, mult, "NASDAQ", "USD", self._local_symbol(key), symbol,
+                     position, mark, value, avg_cost, unrealized, realized, ACCOUNT)
+        session.portfolio_sent[key] = state
+
+    def _send_pnl(self, session, req_id):
+        key = session.pnl_subscriptions[req_id][0]
+        if key in self.positions:
+            position, _, value, _, unrealized, realized = self._position_state(key)
+        else:
+            position = value = unrealized = realized = 0.0
+        # 模拟网关的会话都从当天开始, 当日盈亏 = 未实现 + 已实现
+        pnl = (int(position), round(unrealized + realized, 2), unrealized, realized, value)
+        if pnl != session.pnl_subscriptions[req_id][1]:
+            session.send(IN_PNL_SINGLE, req_id, *pnl)
+            session.pnl_subscriptions[req_id][1] = pnl
+
+    def _send_account_values(self, session):
+        value = sum(self._position_state(key)[2] for key in self.positions)
+        cash = round(self.script.cash, 2)
+        for name, amount in (("TotalCashValue", cash), ("NetLiquidation", round(cash + value, 2)),
+                             ("GrossPositionValue", round(value, 2)), ("BuyingPower", round(cash * 4, 2))):
+            session.send(IN_ACCT_VALUE, 2, name, amount, "USD", ACCOUNT)
+
+    def _on_reqPositions(self, session, f):
+        session.position_updates = True
+        for key in self.positions:
+            self._send_position(session, key)
+        session.send(IN_POSITION_END, 1)
+
+    def _on_cancelPositions(self, session, f):
+        session.position_updates = False
+
+    def _on_reqAccountUpdates(self, session, f):
+        f.skip()  # version
+        subscribe = bool(f.int())
+        session.account_updates = subscribe
+        if not subscribe:
+            session.portfolio_sent.clear()
+            return
+        self._send_account_values(session)
+        for key in self.positions:
+            self._send_portfolio(session, key)
+        session.send(IN_ACCT_UPDATE_TIME, 1, datetime.datetime.now().strftime("%H:%M"))
+        session.send(IN_ACCT_DOWNLOAD_END, 1, ACCOUNT)
+
+    def _on_reqPnLSingle(self, session, f):
+        req_id = f.int()
+        f.skip(2)  # account, modelCode
+        key = self.script.contract_by_con_id(f.int())
+        if key is None:
+            session.error(req_id, 200, "No security definition has been found for the request")
+            return
+        session.pnl_subscriptions[req_id] = [key, None]
+        self._send_pnl(session, req_id)
+
+    def _on_cancelPnLSingle(self, session, f):
+        session.pnl_subscriptions.pop(f.int(), None)
+
+    def _apply_fill(self, key, quantity: float, price: float):
+        """按成交更新持仓 (quantity 带方向), 平仓部分计入已实现盈亏, 并向订阅的连接推送变化."""
+        pos = self.positions.setdefault(key, {"position": 0.0, "avg_cost": 0.0, "realized": 0.0})
+        cost = price * self.script.multiplier(key)
+        old = pos["position"]
+        new = old + quantity
+        if old == 0 or (old > 0) == (quantity > 0):
+            pos["avg_cost"] = round((old * pos["avg_cost"] + quantity * cost) / new, 4)
+        else:
+            closed = min(abs(quantity), abs(old))
+            pos["realized"] += closed * (cost - pos["avg_cost"]) * (1 if old > 0 else -1)
+            if new == 0:
+                pos["avg_cost"] = 0.0
+            elif (new > 0) != (old > 0):
+                pos["avg_cost"] = round(cost, 4)
+        pos["position"] = new
+        self.script.cash -= quantity * cost
+        self._event("position", key=key, position=new, avgCost=pos["avg_cost"])
+        with self._sessions_lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            if session.position_updates:
+                self._send_position(session, key)
+            if session.account_updates:
+                self._send_portfolio(session, key)
+
+    def _record_fill(self, order, quantity: float, price: float):
+        sign = 1 if order["action"] == "BUY" else -1
+        if order["legs"] is None:
+            self._apply_fill(order["key"], sign * quantity, price)
+            return
+        # 组合单: 各腿按当前中间价成交, 差额计入第一腿, 使各腿合计等于组合成交价
+        legs = []
+        for con_id, ratio, action in order["legs"]:
+            key = self.script.contract_by_con_id(con_id)
+            bid, ask = self._quote(key, None)[:2]
+            leg_sign = sign * (1 if action == "BUY" else -1)
+            legs.append([key, ratio, leg_sign, (bid + ask) / 2])
+        residual = sign * price - sum(ratio * leg_sign * mid for _, ratio, leg_sign, mid in legs)
+        legs[0][3] = max(0.0, legs[0][3] + residual / (legs[0][1] * legs[0][2]))
+        for key, ratio, leg_sign, leg_price in legs:
+            self._apply_fill(key, leg_sign * ratio * quantity, round(leg_price, 4))
+
+    # ---- 订单 ----
+    def _on_placeOrder(self, session, f):
+        self._place(session, f, modify=False)
+
+    def _on_modifyOrder(self, session, f):
+        self._place(session, f, modify=True)
+
+    def _place(self, session, f, modify):
+        order_id = f.int()
+        con_id, symbol, sec_type, expiry, strike, right = self._read_contract(f)
+        f.skip(2)  # secIdType, secId
+        action = f.str()
+        quantity = f.float() or 0.0
+        order_type = f.str()
+        lmt_price = f.float()
+        f.skip(1 + 14)  # auxPrice, tif..hidden
+        legs = None
+        key = None
+        if sec_type == "BAG":
+            legs = []
+            for _ in range(f.int()):
+                legs.append((f.int(), f.int(), f.str()))
+                f.skip(5)  # exchange, openClose, shortSaleSlot, designatedLocation, exemptCode
+        else:
+            keys = self._resolve(con_id, symbol, sec_type, expiry, strike, right)
+            if len(keys) != 1:
+                session.error(order_id, 200, "No security definition has been found for the request")
+                return
+            key = keys[0]
+            if self.check_price_increment and order_type == "LMT" and lmt_price is not None:
+                inc = self.script.increment(self.script.market_rule_id(key), lmt_price)
+                ticks = lmt_price / inc
+                if abs(ticks - round(ticks)) > 1e-6:
+                    session.error(order_id, 110, "The price does not conform to the minimum price "
+                                                 "variation for this contract.")
+                    self._event("order_rejected", orderId=order_id, lmtPrice=lmt_price)
+                    return
+
+        order = session.orders.get(order_id)
+        if modify:
+            if order["status"] in TERMINAL_STATUSES:
+                session.error(order_id, 104, "Cannot modify a filled order.")
+                return
+            order.update(action=action, lmt_price=lmt_price, order_type=order_type)
+            self._event("order_modified", orderId=order_id, lmtPrice=lmt_price)
+        else:
+            self._next_order_id = max(self._next_order_id, order_id + 1)
+            order = {
+                "order_id": order_id, "key": key, "legs": legs, "action": action,
+                "quantity": quantity, "filled": 0.0, "avg_price": 0.0, "order_type": order_type,
+                "lmt_price": lmt_price, "status": "Submitted", "perm_id": next(session._perm_id),
+            }
+            session.orders[order_id] = order
+            self._event("order_placed", orderId=order_id, lmtPrice=lmt_price, quantity=quantity)
+        self._send_order_status(session, order, 0.0)
+        self._match(session, order)
+
+    def _on_cancelOrder(self, session, f):
+        f.skip()  # version
+        order_id = f.int()
+        order = session.orders.get(order_id)
+        if order is None or order["status"] in TERMINAL_STATUSES:
+            session.error(order_id, 10147, f"OrderId {order_id} that needs to be cancelled is not found.")
+            return
+        order["status"] = "Cancelled"
+        self._send_order_status(session, order, 0.0)
+        self._event("order_cancelled", orderId=order_id)
+
+    def _send_order_status(self, session, order, last_fill_price):
+        remaining = order["quantity"] - order["filled"]
+        session.send(IN_ORDER_STATUS, order["order_id"], order["status"], order["filled"], remaining,
+                     order["avg_price"], order["perm_id"], 0, last_fill_price,
+                     session.client_id or 0, "", 0.0)
+
+    def _match(self, session, order):
+        """按成交模型撮合一次."""
+        if order["status"] in TERMINAL_STATUSES or self.fill_mode == "never":
+            return
+        quote = self._quote(order["key"], order["legs"])
+        if quote is None:
+            return
+        bid, ask = quote[0], quote[1]
+        if order["order_type"] == "MKT":
+            price = ask if order["action"] == "BUY" else bid
+        else:
+            lmt = order["lmt_price"]
+            if self.fill_mode != "immediate":
+                if order["action"] == "BUY" and lmt < ask - 1e-9:
+                    return
+                if order["action"] == "SELL" and lmt > bid + 1e-9:
+                    return
+            price = lmt
+        remaining = order["quantity"] - order["filled"]
+        qty = remaining if self.fill_chunk <= 0 else min(remaining, self.fill_chunk)
+        total = order["avg_price"] * order["filled"] + price * qty
+        order["filled"] += qty
+        order["avg_price"] = round(total / order["filled"], 6)
+        self._record_fill(order, qty, price)
+        if order["filled"] >= order["quantity"] - 1e-9:
+            order["status"] = "Filled"
+            self._event("order_filled", orderId=order["order_id"], avgFillPrice=order["avg_price"])
+        else:
+            self._event("order_partial", orderId=order["order_id"], filled=order["filled"])
+        self._send_order_status(session, order, price)
+
+    def _pump_loop(self):
+        while not self._stop.wait(self.tick_interval):
+            with self._sessions_lock:
+                sessions = list(self._sessions)
+            for session in sessions:
+                if session.closed:
+                    continue
+                with self._lock:
+                    self._pump_session(session)
+
+    def _pump_session(self, session):
+        """推送变化的流式报价, 并对未完成订单再撮合一次."""
+        for req_id, (key, legs, prev) in list(session.subscriptions.items()):
+            quote = self._quote(key, legs)
+            if quote is not None and quote != prev:
+                self._send_quote(session, req_id, quote, prev, key)
+                session.subscriptions[req_id] = (key, legs, quote)
+        for order in list(session.orders.values()):
+            self._match(session, order)
+        if session.account_updates:
+            for key in self.positions:
+                state = self._position_state(key)
+                if state != session.portfolio_sent.get(key):
+                    self._send_portfolio(session, key, state)
+        for req_id in list(session.pnl_subscriptions):
+            self._send_pnl(session, req_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟 TWS 网关")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7497)
+    parser.add_argument("--script", help="行情脚本 JSON 文件")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个响应的固定延迟(秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="额外随机延迟上限(秒)")
+    parser.add_argument("--fill-mode", default="cross", choices=["cross", "immediate", "never"])
+    parser.add_argument("--fill-chunk", type=int, default=0, help="每次撮合最多成交数量, 0=全部")
+    parser.add_argument("--tick-interval", type=float, default=0.25)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    script = MarketScript.from_file(args.script) if args.script else MarketScript()
+    FakeTWSGateway(args.host, args.port, script, latency=args.latency, jitter=args.jitter,
+                   fill_mode=args.fill_mode, fill_chunk=args.fill_chunk,
+                   tick_interval=args.tick_interval, verbose=args.verbose).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持续 delta 对冲: 读取持仓组合 (IBApp.portfolio) 中某个标的的全部期权与股票,
+随标的流式报价 (或定时) 重新计算组合 delta, 超出对冲带 [target - band, target + band] 时
+通过 OrderManager.place_stock_order 买卖标的股票, 把 delta 拉回 target.
+
+计算按批进行: 持仓数量变化时才重建各期权的 行权价/剩余时间/波动率/数量 数组 (市价与盈亏推送不触发),
+每次报价只做一次向量化的 bs_delta 与点积, 几百个持仓也在 1 毫秒以内;
+两次计算之间到达的多个报价合并为一次, 只用最新价.
+隐含波动率由后台线程并发取快照刷新, 对冲线程不等待网络; 尚无 IV 的期权暂用 default_vol.
+
+运行前先确认下方参数, 然后:
+    python IBHedger.py
+"""
+
+import datetime
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from ibapi.contract import Contract
+
+from IBOptionToolOffical import IBApp, OrderManager, TERMINAL_STATUSES, TWS_HOST, TWS_PORT
+from IBPayoff import bs_delta, implied_vol
+
+########################################################
+# 对冲参数
+hedge_symbol = "NKE"
+hedge_target = 0.0       # 目标 delta (股数)
+hedge_band = 50.0        # 对冲带宽 (股数), |delta - target| 超过它才下单
+hedge_interval = 1.0     # 没有新报价时的定时重算间隔 (秒)
+hedge_cooldown = 5.0     # 两次对冲下单之间至少间隔的秒数
+hedge_max_order = 1000   # 单次对冲最多股数
+hedge_dry_run = True     # True 时只打印要下的单, 不实际下单
+########################################################
+
+
+class DeltaHedger:
+    """
+    manager: OrderManager (其 app 须已调用 subscribe_portfolio); symbol: 对冲的标的.
+    vol: 固定的期权波动率; 为 None 时按各期权快照中间价反推隐含波动率, 每 iv_refresh 秒刷新一次
+         (后台线程最多 iv_workers 个快照并发), 第一次取到之前用 default_vol.
+    order_type: "LMT" 时以对手价 (买 ask / 卖 bid) 下限价单, 未成交则每次重算时改到最新对手价.
+    """
+    def __init__(self, manager: OrderManager, symbol: str, band: float = 50.0, target: float = 0.0,
+                 interval: float = 1.0, cooldown: float = 5.0, min_order: int = 1,
+                 max_order: int = None, vol: float = None, iv_refresh: float = 300.0,
+                 iv_workers: int = 8, default_vol: float = 0.5, rate: float = 0.0, order_type: str = "LMT", confirm_timeout: float = 10.0,
+                 dry_run: bool = False):
+        self.manager = manager
+        self.app = manager.app
+        self.symbol = symbol
+        self.band = band
+        self.target = target
+        self.interval = interval
+        self.cooldown = cooldown
+        self.min_order = max(1, min_order)
+        self.max_order = max_order
+        self.vol = vol
+        self.iv_refresh = iv_refresh
+        self.iv_workers = max(1, iv_workers)
+        self.default_vol = default_vol
+        self.rate = rate
+        self.order_type = order_type.upper()
+        self.confirm_timeout = confirm_timeout
+        self.dry_run = dry_run
+
+        # 批量计算用的数组, 持仓数量变化 (portfolio.position_version) 或到了 IV 刷新时间时重建
+        self._version = None
+        self._built_at = 0.0
+        self._con_ids = []
+        self._strike = self._years = self._vol = self._qty = np.empty(0)
+        self._is_call = np.empty(0, dtype=bool)
+        self._stock = 0.0
+        self._iv_cache = {}  # conId -> (隐含波动率, 计算时间)
+        # 后台 IV 刷新: 待刷新的 (conId, 行权价, 剩余年数, 是否 call), 完成后通知对冲线程更新 _vol
+        self._iv_jobs = []
+        self._iv_lock = threading.Lock()
+        self._iv_wanted = threading.Event()
+        self._iv_updated = threading.Event()
+        self._iv_thread = None
+
+        # 自己的对冲单: 工作中的订单, 以及成交后持仓推送尚未反映时的预期股数
+        self._order_id = None
+        self._order_stock_base = 0.0
+        self._expected_stock = None
+        self._last_hedge_at = float("-inf")
+
+        self._underlying = None
+        self._req_id = None
+        self._tick = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_delta = None
+        self.hedges = []  # (时间, action, 数量, 对冲前 delta)
+
+    # ---- 对外接口 ----
+    def start(self) -> threading.Thread:
+        stock = Contract()
+        stock.symbol = self.symbol
+        stock.secType = "STK"
+        stock.exchange = "SMART"
+        stock.currency = "USD"
+        self._underlying = self.app.resolve_contract(stock)
+        if self._underlying is None:
+            raise ValueError(f"cannot resolve underlying {self.symbol}")
+        self._req_id = self.app.subscribe_market_data(self._underlying, self._on_tick)
+        if self.vol is None:
+            self._iv_thread = threading.Thread(target=self._iv_refresher, daemon=True)
+            self._iv_thread.start()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self._tick.set()
+        self._iv_wanted.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._iv_thread is not None:
+            self._iv_thread.join()
+        if self._req_id is not None:
+            self.app.unsubscribe_market_data(self._req_id)
+            self._req_id = None
+
+    def _on_tick(self, req_id, field, price):
+        # EReader 线程: 只做标记, 计算在对冲线程中进行
+        if field in ("bid", "ask", "last"):
+            self._tick.set()
+
+    # ---- delta 计算 ----
+    def _rebuild(self):
+        """按当前持仓重建期权数组; 隐含波动率按 conId 缓存."""
+        portfolio = self.app.portfolio
+        self._version = portfolio.position_version
+        self._built_at = time.monotonic()
+        options = [p for p in portfolio.positions(self.symbol) if p["secType"] in ("OPT", "FOP")]
+        self._stock = sum(p["position"] for p in portfolio.positions(self.symbol, "STK"))
+        now = datetime.datetime.now()
+        self._con_ids = [p["conId"] for p in options]
+        self._strike = np.array([p["strike"] for p in options], dtype=float)
+        self._is_call = np.array([p["right"].upper().startswith("C") for p in options], dtype=bool)
+        self._qty = np.array([p["position"] * p["multiplier"] for p in options], dtype=float)
+        # 到期日按美东收盘 16:00 计, 不足半天按半天
+        self._years = np.array([
+            max((datetime.datetime.strptime(p["expiry"][:8], "%Y%m%d").replace(hour=16) - now).total_seconds(),
+                43200.0) / (365.0 * 86400.0)
+            for p in options], dtype=float)
+        self._vol = self._vols(options)
+
+    def _vols(self, options) -> np.ndarray:
+        """各期权当前的波动率 (不做网络请求); 过期或缺失的交给后台线程刷新."""
+        if self.vol is not None:
+            return np.full(len(options), float(self.vol))
+        now = time.monotonic()
+        stale = [i for i, p in enumerate(options)
+                 if now - self._iv_cache.get(p["conId"], (None, float("-inf")))[1] > self.iv_refresh]
+        if stale:
+            with self._iv_lock:
+                self._iv_jobs = [(options[i]["conId"], self._strike[i], self._years[i], self._is_call[i])
+                                 for i in stale]
+            self._iv_wanted.set()
+        return self._cached_vols()
+
+    def _cached_vols(self) -> np.ndarray:
+        return np.array([self._iv_cache.get(c, (self.default_vol, None))[0] for c in self._con_ids],
+                        dtype=float)
+
+    def _snapshot_mid(self, con_id: int) -> float:
+        contract = Contract()
+        contract.conId = con_id
+        contract.exchange = "SMART"
+        snapshot = self.app.get_market_snapshot(contract)
+        bid, ask = snapshot.get("bid", 0.0), snapshot.get("ask", 0.0)
+        return (bid + ask) / 2.0 if bid > 0.0 and ask > 0.0 else snapshot.get("last", 0.0)
+
+    def _iv_refresher(self):
+        """后台线程: 对待刷新的期权并发取快照, 反推隐含波动率写入缓存."""
+        with ThreadPoolExecutor(max_workers=self.iv_workers) as pool:
+            while not self._stop.is_set():
+                self._iv_wanted.wait()
+                self._iv_wanted.clear()
+                with self._iv_lock:
+                    jobs, self._iv_jobs = self._iv_jobs, []
+                spot = self._spot()
+                if self._stop.is_set() or not jobs:
+                    continue
+                if not spot:
+                    # 还没有标的价, 稍后再试
+                    with self._iv_lock:
+                        self._iv_jobs = self._iv_jobs or jobs
+                    self._stop.wait(self.interval)
+                    self._iv_wanted.set()
+                    continue
+                t0 = time.monotonic()
+                mids = list(pool.map(self._snapshot_mid, [job[0] for job in jobs]))
+                strike, years, is_call = (np.array([job[i] for job in jobs]) for i in (1, 2, 3))
+                vols = implied_vol(np.array(mids, dtype=float), spot, strike, years, is_call.astype(bool),
+                                   self.rate)
+                now = time.monotonic()
+                for (con_id, *_), v in zip(jobs, vols):
+                    if np.isfinite(v):
+                        self._iv_cache[con_id] = (float(v), now)
+                self.app.latency.record("hedge.iv_refresh", int((now - t0) * 1e9))
+                self._iv_updated.set()
+                self._tick.set()
+
+    def _spot(self):
+        data = self.app.market_data.get(self._req_id) or {}
+        bid, ask = data.get("bid", 0.0), data.get("ask", 0.0)
+        if bid > 0.0 and ask > 0.0:
+            return (bid + ask) / 2.0
+        return data.get("last") or None
+
+    def stock_position(self) -> float:
+        """当前股数; 自己的对冲单已成交但持仓推送尚未到达时, 使用预期股数."""
+        if self._expected_stock is not None:
+            expected, deadline = self._expected_stock
+            if self._stock != expected and time.monotonic() < deadline:
+                return expected
+            self._expected_stock = None
+        return self._stock
+
+    def portfolio_delta(self, spot: float) -> float:
+        """组合 delta (股数) = 股票 + sum(期权数量 x 乘数 x 每股 delta)."""
+        t0 = time.monotonic_ns()
+        delta = self.stock_position()
+        if len(self._qty):
+            delta += float(np.dot(self._qty, bs_delta(spot, self._strike, self._years, self._vol,
+                                                      self._is_call, self.rate)))
+        self.app.latency.record("hedge.evaluate", time.monotonic_ns() - t0)
+        return delta
+
+    # ---- 对冲 ----
+    def _quote_price(self, action: str):
+        data = self.app.market_data.get(self._req_id) or {}
+        price = data.get("ask" if action == "BUY" else "bid", 0.0)
+        return price if price and price > 0.0 else data.get("last")
+
+    def _check_order(self) -> bool:
+        """检查工作中的对冲单; 返回 True 表示仍在工作."""
+        if self._order_id is None:
+            return False
+        info = self.app.get_order_status(self._order_id) or {}
+        details = self.manager._order_details.get(self._order_id, {})
+        if info.get("status") in TERMINAL_STATUSES:
+            sign = 1 if details.get("action") == "BUY" else -1
+            filled = float(info.get("filled", 0.0) or 0.0)
+            if filled:
+                self._expected_stock = (self._order_stock_base + sign * filled,
+                                        time.monotonic() + self.confirm_timeout)
+            self.manager._order_details.pop(self._order_id, None)
+            self._order_id = None
+            return False
+        # 限价单未成交: 改到最新对手价
+        if self.order_type == "LMT" and details:
+            price = self._quote_price(details["action"])
+            if price and abs(price - details["limit_price"]) > 1e-9:
+                price = self.manager._snap_limit_price(details["contract"], details["action"], price)
+                self.manager.modify_order(self._order_id, price)
+        return True
+
+    def _hedge(self, delta: float):
+        quantity = int(round(self.target - delta))
+        if abs(quantity) < self.min_order:
+            return
+        if self.max_order:
+            quantity = max(-self.max_order, min(self.max_order, quantity))
+        action = "BUY" if quantity > 0 else "SELL"
+        price = self._quote_price(action) or 0.0
+        print(f"Hedge {self.symbol}: delta={delta:.1f} outside {self.target:g}±{self.band:g}, "
+              f"{action} {abs(quantity)} @ {price if self.order_type == 'LMT' else 'MKT'}")
+        self._last_hedge_at = time.monotonic()
+        self.hedges.append((time.time(), action, abs(quantity), round(delta, 2)))
+        if self.dry_run:
+            return
+        self._order_stock_base = self.stock_position()
+        self._order_id = self.manager.place_stock_order(self.symbol, action, abs(quantity),
+                                                        self.order_type, price)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._tick.wait(self.interval)
+            self._tick.clear()
+            if self._stop.is_set():
+                break
+            spot = self._spot()
+            if spot is None:
+                continue
+            if (self.app.portfolio.position_version != self._version
+                    or (self.vol is None and time.monotonic() - self._built_at > self.iv_refresh)):
+                self._rebuild()
+            elif self._iv_updated.is_set():
+                self._iv_updated.clear()
+                self._vol = self._cached_vols()
+            delta = self.portfolio_delta(spot)
+            self.last_delta = delta
+            if self._check_order():
+                continue
+            if (abs(delta - self.target) > self.band
+                    and time.monotonic() - self._last_hedge_at >= self.cooldown):
+                self._hedge(delta)
+
+
+def main():
+    app = IBApp()
+    print("Connecting to IB API...")
+    try:
+        app.connect(TWS_HOST, TWS_PORT, clientId=3)
+    except Exception as e:
+        print("Could not connect to IB API:", e)
+        sys.exit(1)
+    threading.Thread(target=app.run, daemon=True).start()
+    for _ in range(30):
+        if app.next_order_id is not None:
+            break
+        time.sleep(0.1)
+    manager = OrderManager(app)
+
+    app.subscribe_portfolio()
+    app.portfolio.print_summary()
+    hedger = DeltaHedger(manager, hedge_symbol, band=hedge_band, target=hedge_target,
+                         interval=hedge_interval, cooldown=hedge_cooldown,
+                         max_order=hedge_max_order, dry_run=hedge_dry_run)
+    hedger.start()
+    print(f"Delta hedging {hedge_symbol}, band ±{hedge_band:g} around {hedge_target:g}"
+          f"{' (dry run)' if hedge_dry_run else ''}. Ctrl-C to stop.")
+    try:
+        while True:
+            time.sleep(10)
+            if hedger.last_delta is not None:
+                print(f"{hedge_symbol} portfolio delta={hedger.last_delta:.1f}")
+    except KeyboardInterrupt:
+        pass
+    hedger.stop()
+    app.unsubscribe_portfolio()
+    print("Disconnecting from IB...")
+    app.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量历史 K 线 (reqHistoricalData) 与本地增量缓存, 标的和期权合约都适用.
+
+  - BarCache: 每个序列 (conId, barSize, whatToShow, useRTH) 一个目录, 每列一个定长二进制文件, 只追加;
+    新数据与缓存重叠时从第一根重叠的 K 线处截断再追加, 最后一根未收盘的 K 线因此被新值替换.
+  - HistoricalPacer: IB 的历史数据限速规则, 同时最多 50 个未完成的请求, 15 秒内不发相同的请求,
+    2 秒内同一合约同一数据类型不超过 5 个, 30 秒及以下的 K 线每 10 分钟不超过 60 个.
+  - HistoricalFetcher: 线程池并发请求; 缓存里已有的部分不再下载, 只请求最后一根 K 线之后的尾部.
+
+第一次运行下载一年日线, 之后每个序列只请求几天的尾部;
+对观察列表计算 IV rank / 实现波动率只需每个标的两个小请求.
+
+用法:
+    python IBHistorical.py --symbols NKE PDD UVXY
+    python IBHistorical.py --watchlist watchlist.txt --lookback "2 Y" --cache bar_cache
+    python IBHistorical.py --options "NKE 20250321 75 C" --bar-size "1 hour" --lookback "10 D"
+"""
+
+import argparse
+import calendar
+import copy
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from ibapi.contract import Contract
+
+from IBPriceOffical import IBOptionDataApp
+
+COLUMNS = {
+    "time": np.int64,      # K 线开始时间 (UTC 秒), 日线为当天 0 点
+    "open": np.float64,
+    "high": np.float64,
+    "low": np.float64,
+    "close": np.float64,
+    "volume": np.float64,  # 非成交类数据 (MIDPOINT / 隐含波动率) 为 -1
+    "wap": np.float64,
+    "count": np.int64,
+}
+
+_BAR_UNITS = {"sec": 1, "min": 60, "hour": 3600, "day": 86400, "week": 7 * 86400, "month": 30 * 86400}
+_DURATION_UNITS = {"S": 1, "D": 86400, "W": 7 * 86400, "M": 30 * 86400, "Y": 365 * 86400}
+# IB 的 pacing 规则 (每 10 分钟 60 个) 只针对 30 秒及以下的 K 线
+SMALL_BAR_SECONDS = 30
+PACING_CODE = 162
+
+
+def bar_seconds(bar_size: str) -> int:
+    """"5 mins" / "1 hour" / "1 day" -> 秒数."""
+    count, unit = bar_size.split()
+    return int(count) * _BAR_UNITS[unit.rstrip("s")]
+
+
+def duration_seconds(duration: str) -> int:
+    """"30 D" / "1 Y" -> 秒数."""
+    count, unit = duration.split()
+    return int(count) * _DURATION_UNITS[unit.upper()]
+
+
+def tail_duration(last_time: int, bar_size: str, now: float = None) -> str:
+    """从缓存的最后一根 K 线 (含) 到现在需要请求的长度, 日线按自然日, 日内一天以内按秒."""
+    span = (time.time() if now is None else now) - last_time + bar_seconds(bar_size)
+    if bar_seconds(bar_size) < 86400 and span <= 86400:
+        return f"{max(int(math.ceil(span)), 60)} S"
+    days = max(int(math.ceil(span / 86400.0)), 1)
+    return f"{days} D" if days <= 365 else f"{int(math.ceil(days / 365.0))} Y"
+
+
+def bar_time(date: str) -> int:
+    """K 线的 date 字段 -> UTC 秒: 日线 "YYYYMMDD", 日内为 formatDate=2 的秒数."""
+    date = date.strip()
+    if len(date) == 8:
+        return calendar.timegm(time.strptime(date, "%Y%m%d"))
+    return int(date)
+
+
+def describe(contract: Contract) -> str:
+    """缓存中记录 conId 用的合约名: "NKE STK USD" / "NKE 20250321 75 C USD"."""
+    if contract.secType == "OPT":
+        return (f"{contract.symbol} {contract.lastTradeDateOrContractMonth} {contract.strike:g} "
+                f"{contract.right.upper()[:1]} {contract.currency}")
+    return f"{contract.symbol} {contract.secType} {contract.currency}"
+
+
+def stock_contract(symbol: str, exchange: str = "SMART", currency: str = "USD") -> Contract:
+    contract = Contract()
+    contract.symbol = symbol
+    contract.secType = "STK"
+    contract.exchange = exchange
+    contract.currency = currency
+    return contract
+
+
+def option_contract(spec: str, exchange: str = "SMART", currency: str = "USD") -> Contract:
+    """"NKE 20250321 75 C" -> 期权合约."""
+    symbol, expiry, strike, right = spec.split()
+    contract = Contract()
+    contract.symbol = symbol
+    contract.secType = "OPT"
+    contract.lastTradeDateOrContractMonth = expiry
+    contract.strike = float(strike)
+    contract.right = right.upper()[:1]
+    contract.multiplier = "100"
+    contract.exchange = exchange
+    contract.currency = currency
+    return contract
+
+
+# ---- 缓存 ----
+class _Series:
+    """一个序列的列文件和元数据."""
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        self.meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+        sizes = {col: os.path.getsize(os.path.join(path, f"{col}.bin"))
+                 if os.path.exists(os.path.join(path, f"{col}.bin")) else 0 for col in COLUMNS}
+        self.rows = min(sizes[col] // np.dtype(dtype).itemsize for col, dtype in COLUMNS.items())
+        self.files = {}
+        for col, dtype in COLUMNS.items():
+            f = open(os.path.join(path, f"{col}.bin"), "ab")
+            # 上次写到一半退出时, 丢弃各列中多出的不完整行
+            f.truncate(self.rows * np.dtype(dtype).itemsize)
+            self.files[col] = f
+
+    def column(self, col: str, start: int = 0) -> np.ndarray:
+        # 读出副本: 更新时会截断文件, 不能把 memmap 交给调用方
+        self.files[col].flush()
+        if start >= self.rows:
+            return np.empty(0, dtype=COLUMNS[col])
+        itemsize = np.dtype(COLUMNS[col]).itemsize
+        return np.fromfile(os.path.join(self.path, f"{col}.bin"), dtype=COLUMNS[col],
+                           count=self.rows - start, offset=start * itemsize)
+
+    def last_time(self):
+        return int(self.column("time", self.rows - 1)[0]) if self.rows else None
+
+    def replace_from(self, keep: int, columns: dict):
+        """保留前 keep 行, 其后换成 columns."""
+        for col, dtype in COLUMNS.items():
+            f = self.files[col]
+            f.flush()
+            if keep < self.rows:
+                f.truncate(keep * np.dtype(dtype).itemsize)
+            f.write(np.ascontiguousarray(columns[col], dtype=dtype).tobytes())
+            f.flush()
+        self.rows = keep + len(columns["time"])
+
+    def save_meta(self):
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+class BarCache:
+    """
+    root: 缓存目录, 序列目录为 <conId>/<whatToShow>_<barSize>_<rth|all>;
+    contracts.json 记录合约名 -> conId, 之后的运行不必再请求合约详情.
+    同一进程内多个线程可共享一个实例; 不支持多个进程同时写.
+    """
+    def __init__(self, root: str = "bar_cache"):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._series = {}
+        self._lock = threading.Lock()
+        self._contracts_path = os.path.join(root, "contracts.json")
+        self._contracts = {}
+        if os.path.exists(self._contracts_path):
+            with open(self._contracts_path, "r", encoding="utf-8") as f:
+                self._contracts = json.load(f)
+
+    @staticmethod
+    def _name(bar_size: str, what_to_show: str, use_rth: bool) -> str:
+        return f"{what_to_show.upper()}_{bar_size.replace(' ', '')}_{'rth' if use_rth else 'all'}"
+
+    def _get(self, con_id: int, bar_size: str, what_to_show: str, use_rth: bool) -> _Series:
+        key = (int(con_id), self._name(bar_size, what_to_show, use_rth))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series(os.path.join(self.root, str(key[0]), key[1]))
+        return series
+
+    # ---- 合约 ----
+    def con_id(self, name: str):
+        return self._contracts.get(name)
+
+    def remember(self, name: str, con_id: int):
+        with self._lock:
+            if self._contracts.get(name) == con_id:
+                return
+            self._contracts[name] = con_id
+            tmp = self._contracts_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._contracts, f, indent=1, sort_keys=True)
+            os.replace(tmp, self._contracts_path)
+
+    # ---- 读取 ----
+    def info(self, con_id: int, bar_size: str = "1 day", what_to_show: str = "TRADES",
+             use_rth: bool = True) -> dict:
+        """{"rows", "last_time", "fetched_at", "covers_from"}, 没有缓存时 rows 为 0."""
+        with self._lock:
+            series = self._get(con_id, bar_size, what_to_show, use_rth)
+            return {"rows": series.rows, "last_time": series.last_time(),
+                    "fetched_at": series.meta.get("fetched_at", 0.0),
+                    "covers_from": series.meta.get("covers_from")}
+
+    def read(self, con_id: int, bar_size: str = "1 day", what_to_show: str = "TRADES", use_rth: bool = True,
+             since: int = None) -> dict:
+        """各列数组 (COLUMNS), since: 只取该时间 (UTC 秒) 及以后的 K 线."""
+        with self._lock:
+            series = self._get(con_id, bar_size, what_to_show, use_rth)
+            start = 0
+            if since is not None and series.rows:
+                start = int(np.searchsorted(series.column("time"), since))
+            return {col: series.column(col, start) for col in COLUMNS}
+
+    # ---- 写入 ----
+    def merge(self, con_id: int, bar_size: str, what_to_show: str, use_rth: bool, bars,
+              contract: str = "", covers_from: int = None) -> int:
+        """
+        合并 request_historical_bars 返回的 K 线, 返回新增的行数 (被替换的行不计).
+        covers_from: 本次请求的起点, 是一次完整下载时记录下来, 以后请求更长的历史时据此判断是否要重新下载.
+        """
+        columns = {col: np.empty(len(bars), dtype=dtype) for col, dtype in COLUMNS.items()}
+        for i, (date, o, h, low, c, volume, wap, count) in enumerate(bars):
+            columns["time"][i] = bar_time(date)
+            columns["open"][i], columns["high"][i], columns["low"][i], columns["close"][i] = o, h, low, c
+            columns["volume"][i], columns["wap"][i], columns["count"][i] = float(volume), wap, count
+        order = np.argsort(columns["time"], kind="stable")
+        times = columns["time"][order]
+        unique = np.ones(len(times), dtype=bool)
+        unique[:-1] = times[1:] != times[:-1]  # 同一时间取最后一根
+        columns = {col: values[order][unique] for col, values in columns.items()}
+        with self._lock:
+            series = self._get(con_id, bar_size, what_to_show, use_rth)
+            before = series.rows
+            keep = before
+            if len(columns["time"]) and before:
+                keep = int(np.searchsorted(series.column("time"), columns["time"][0]))
+            series.replace_from(keep, columns)
+            series.meta.update({"con_id": int(con_id), "contract": contract, "bar_size": bar_size,
+                                "what_to_show": what_to_show.upper(), "use_rth": bool(use_rth),
+                                "fetched_at": time.time()})
+            if covers_from is not None:
+                series.meta["covers_from"] = int(covers_from)
+            series.save_meta()
+            return series.rows - before
+
+    def close(self):
+        with self._lock:
+            for series in self._series.values():
+                series.close()
+            self._series.clear()
+
+
+# ---- 限速 ----
+class HistoricalPacer:
+    """
+    IB 的历史数据限速. 请求前 acquire(...) (阻塞到可以发出, 返回等待秒数), 收到结果后 release().
+    多线程共享同一个实例即可; 同时只有一个进程向同一账户发历史请求时才能保证不触发 162.
+    """
+    def __init__(self, max_inflight: int = 50, identical_interval: float = 15.0, contract_burst: int = 5,
+                 burst_window: float = 2.0, max_small: int = 60, small_window: float = 600.0):
+        self.identical_interval = identical_interval
+        self.contract_burst = contract_burst
+        self.burst_window = burst_window
+        self.max_small = max_small
+        self.small_window = small_window
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._identical = {}
+        self._contracts = {}
+        self._small = deque()
+        self._lock = threading.Lock()
+
+    def _delay(self, request, contract, small: bool, now: float) -> float:
+        delay = 0.0
+        last = self._identical.get(request)
+        if last is not None:
+            delay = max(delay, last + self.identical_interval - now)
+        recent = self._contracts.get(contract)
+        if recent is not None:
+            while recent and now - recent[0] >= self.burst_window:
+                recent.popleft()
+            if len(recent) >= self.contract_burst:
+                delay = max(delay, recent[0] + self.burst_window - now)
+        if small:
+            while self._small and now - self._small[0] >= self.small_window:
+                self._small.popleft()
+            if len(self._small) >= self.max_small:
+                delay = max(delay, self._small[0] + self.small_window - now)
+        return delay
+
+    def acquire(self, request, contract, small: bool = False) -> float:
+        """
+        request: 请求的全部参数 (判断是否相同); contract: (conId, whatToShow);
+        small: K 线 <= 30 秒, 计入每 10 分钟 60 个的限制.
+        """
+        self._slots.acquire()
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = self._delay(request, contract, small, now)
+                if delay <= 0:
+                    self._identical = {k: t for k, t in self._identical.items()
+                                       if now - t < self.identical_interval}
+                    self._identical[request] = now
+                    self._contracts.setdefault(contract, deque()).append(now)
+                    if small:
+                        self._small.append(now)
+                    return waited
+            time.sleep(delay)
+            waited += delay
+
+    def release(self):
+        self._slots.release()
+
+
+# ---- 抓取 ----
+class HistoricalFetcher:
+    """
+    app: 已连接的 IBOptionDataApp; cache: BarCache; pacer: 默认新建 HistoricalPacer.
+    max_workers: 同时等待回报的请求数; max_age: 序列在该秒数内更新过就直接用缓存, 不发请求.
+    stats: requests / bars / fresh (直接用缓存) / errors 计数.
+    """
+    def __init__(self, app: IBOptionDataApp, cache: BarCache, pacer: HistoricalPacer = None,
+                 max_workers: int = 8, max_age: float = 300.0, timeout: float = 60.0, retries: int = 2):
+        self.app = app
+        self.cache = cache
+        self.pacer = pacer or HistoricalPacer()
+        self.max_workers = max_workers
+        self.max_age = max_age
+        self.timeout = timeout
+        self.retries = retries
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        # 合约名 -> 锁, 同一标的的多个序列并发更新时只请求一次合约详情
+        self._resolving = {}
+
+    def _count(self, name: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def contract_id(self, contract: Contract):
+        """合约的 conId: 合约自带的, 或缓存里记录的, 都没有时请求一次合约详情并记下."""
+        if contract.conId:
+            return contract.conId
+        name = describe(contract)
+        with self._stats_lock:
+            lock = self._resolving.setdefault(name, threading.Lock())
+        with lock:
+            con_id = self.cache.con_id(name)
+            if con_id is None:
+                details = self.app.request_contract_details(contract, timeout=self.timeout)
+                if not details:
+                    print(f"{name}: contract not found, skipped.")
+                    return None
+                con_id = details[0].contract.conId
+                self.cache.remember(name, con_id)
+        return con_id
+
+    def _request(self, contract: Contract, duration: str, bar_size: str, what_to_show: str, use_rth: bool):
+        """按限速发出一次请求; 被 IB 判为 pacing violation 时等待后重试."""
+        request = (contract.conId, duration, bar_size, what_to_show, use_rth)
+        small = bar_seconds(bar_size) <= SMALL_BAR_SECONDS
+        for attempt in range(self.retries + 1):
+            self.pacer.acquire(request, (contract.conId, what_to_show), small)
+            try:
+                bars, error = self.app.request_historical_bars(contract, "", duration, bar_size, what_to_show,
+                                                               use_rth, self.timeout)
+            finally:
+                self.pacer.release()
+            self._count("requests")
+            if error is None or error[0] != PACING_CODE or "pacing" not in error[1].lower():
+                return bars, error
+            # 其他进程 / 客户端占用了配额, 按相同请求的间隔等待后重试
+            self._count("pacing_retries")
+            time.sleep(self.pacer.identical_interval * (attempt + 1))
+        return [], error
+
+    def update(self, contract: Contract, bar_size: str = "1 day", what_to_show: str = "TRADES",
+               use_rth: bool = True, lookback: str = "1 Y") -> dict:
+        """
+        把一个序列更新到最新并返回 lookback 内的各列 (BarCache.read); 合约无法解析时返回 None.
+        缓存为空或比 lookback 短时下载完整的 lookback, 否则只请求最后一根 K 线之后的尾部.
+        """
+        con_id = self.contract_id(contract)
+        if not con_id:
+            return None
+        contract = copy.copy(contract)
+        contract.conId = con_id
+        contract.exchange = contract.exchange or "SMART"
+        what_to_show = what_to_show.upper()
+        now = time.time()
+        start = int(now) - duration_seconds(lookback)
+        info = self.cache.info(con_id, bar_size, what_to_show, use_rth)
+        # 只有一天的 K 线时也可能是覆盖不到 lookback 起点的那一天, 留一天余量
+        full = not info["rows"] or (info["covers_from"] or info["last_time"]) > start + 86400
+        if not full and now - info["fetched_at"] < self.max_age:
+            self._count("fresh")
+            return self.cache.read(con_id, bar_size, what_to_show, use_rth, since=start)
+
+        duration = lookback if full else tail_duration(info["last_time"], bar_size, now)
+        bars, error = self._request(contract, duration, bar_size, what_to_show, use_rth)
+        if bars:
+            self._count("bars", len(bars))
+            self.cache.merge(con_id, bar_size, what_to_show, use_rth, bars, describe(contract),
+                             covers_from=start if full else None)
+        elif error is not None:
+            self._count("errors")
+            print(f"{describe(contract)} {what_to_show} {bar_size}: error {error[0]} {error[1]}")
+        return self.cache.read(con_id, bar_size, what_to_show, use_rth, since=start)
+
+    def update_many(self, jobs) -> list:
+        """jobs: [(contract, {update 的关键字参数}), ...], 并发更新, 结果按 jobs 的顺序返回."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(lambda job: self.update(job[0], **job[1]), jobs))
+
+
+# ---- 指标 ----
+def realized_vol(close, window: int = 20, periods: float = 252.0) -> float:
+    """最近 window 个对数收益的年化标准差; 数据不足时为 NaN."""
+    close = np.asarray(close, dtype=float)
+    close = close[np.isfinite(close) & (close > 0)]
+    if len(close) < window + 1:
+        return float("nan")
+    returns = np.diff(np.log(close[-(window + 1):]))
+    return float(returns.std(ddof=1) * math.sqrt(periods))
+
+
+def iv_rank(iv, lookback: int = 252) -> float:
+    """当前 IV 在最近 lookback 个值的 [最低, 最高] 区间中的位置 (0~1)."""
+    iv = np.asarray(iv, dtype=float)
+    iv = iv[np.isfinite(iv) & (iv > 0)][-lookback:]
+    if len(iv) < 2 or iv.max() == iv.min():
+        return float("nan")
+    return float((iv[-1] - iv.min()) / (iv.max() - iv.min()))
+
+
+def iv_percentile(iv, lookback: int = 252) -> float:
+    """最近 lookback 个值中低于当前 IV 的比例 (0~1)."""
+    iv = np.asarray(iv, dtype=float)
+    iv = iv[np.isfinite(iv) & (iv > 0)][-lookback:]
+    if len(iv) < 2:
+        return float("nan")
+    return float(np.mean(iv[:-1] < iv[-1]))
+
+
+def watchlist_stats(fetcher: HistoricalFetcher, symbols, lookback: str = "1 Y", rv_window: int = 20) -> list:
+    """
+    每个标的更新日线收盘价和 IB 的 30 天隐含波动率 (OPTION_IMPLIED_VOLATILITY) 两个序列, 返回
+    [{"symbol", "close", "rv", "iv", "iv_rank", "iv_pct", "bars"}], 缺数据的字段为 NaN.
+    """
+    jobs = []
+    for symbol in symbols:
+        stock = stock_contract(symbol)
+        jobs.append((stock, {"what_to_show": "TRADES", "lookback": lookback}))
+        jobs.append((stock, {"what_to_show": "OPTION_IMPLIED_VOLATILITY", "lookback": lookback}))
+    results = fetcher.update_many(jobs)
+    nan = float("nan")
+    stats = []
+    for i, symbol in enumerate(symbols):
+        prices, ivs = results[2 * i], results[2 * i + 1]
+        close = prices["close"] if prices else np.empty(0)
+        iv = ivs["close"] if ivs else np.empty(0)
+        stats.append({
+            "symbol": symbol,
+            "close": float(close[-1]) if len(close) else nan,
+            "rv": realized_vol(close, rv_window),
+            "iv": float(iv[-1]) if len(iv) else nan,
+            "iv_rank": iv_rank(iv),
+            "iv_pct": iv_percentile(iv),
+            "bars": len(close),
+        })
+    return stats
+
+
+def print_stats(stats: list, rv_window: int):
+    print("\n======== Watchlist volatility ========")
+    print(f"{'symbol':<8}{'close':>10}{'bars':>6}{f'rv{rv_window}':>8}{'iv':>8}{'iv-rv':>8}{'ivr':>7}{'ivp':>7}")
+    for s in stats:
+        print(f"{s['symbol']:<8}{s['close']:>10.2f}{s['bars']:>6}{s['rv']:>8.3f}{s['iv']:>8.3f}"
+              f"{s['iv'] - s['rv']:>8.3f}{s['iv_rank'] * 100:>7.0f}{s['iv_pct'] * 100:>7.0f}")
+    print("======================================")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量历史 K 线与增量缓存")
+    parser.add_argument("--symbols", nargs="*", default=[])
+    parser.add_argument("--watchlist", help="观察列表文件, 每行一个标的代码")
+    parser.add_argument("--options", nargs="*", default=[], help='期权合约, 如 "NKE 20250321 75 C"')
+    parser.add_argument("--cache", default="bar_cache", help="缓存目录")
+    parser.add_argument("--lookback", default="1 Y", help='IB 的 duration 格式, 如 "6 M" / "2 Y"')
+    parser.add_argument("--bar-size", default="1 day", help="期权 K 线的周期 (标的的波动率统计固定用日线)")
+    parser.add_argument("--option-what", default="MIDPOINT", help="期权 K 线的数据类型")
+    parser.add_argument("--rv-window", type=int, default=20, help="实现波动率的天数")
+    parser.add_argument("--workers", type=int, default=8, help="同时等待回报的请求数")
+    parser.add_argument("--max-age", type=float, default=300.0, help="缓存在该秒数内更新过的序列不再请求")
+    parser.add_argument("--host", default=os.environ.get("IB_TWS_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("IB_TWS_PORT", "7496")))
+    parser.add_argument("--client-id", type=int, default=7)
+    args = parser.parse_args()
+
+    symbols = list(args.symbols)
+    if args.watchlist:
+        with open(args.watchlist, "r", encoding="utf-8") as f:
+            symbols += [line.strip().upper() for line in f if line.strip() and not line.startswith("#")]
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols and not args.options:
+        parser.error("no symbols given (use --symbols, --watchlist or --options)")
+
+    app = IBOptionDataApp()
+    app.verbose = False
+    app.connect(args.host, args.port, clientId=args.client_id)
+    api_thread = threading.Thread(target=app.run, daemon=True)
+    api_thread.start()
+    t0 = time.time()
+    while app.next_order_id is None and time.time() - t0 < 5:
+        time.sleep(0.1)
+    if app.next_order_id is None:
+        print("Could not connect to IB API.")
+        sys.exit(1)
+
+    cache = BarCache(args.cache)
+    fetcher = HistoricalFetcher(app, cache, max_workers=args.workers, max_age=args.max_age)
+    try:
+        started = time.monotonic()
+        if symbols:
+            print_stats(watchlist_stats(fetcher, symbols, args.lookback, args.rv_window), args.rv_window)
+        if args.options:
+            jobs = [(option_contract(spec), {"bar_size": args.bar_size, "what_to_show": args.option_what,
+                                             "lookback": args.lookback}) for spec in args.options]
+            for spec, bars in zip(args.options, fetcher.update_many(jobs)):
+                if bars is None or not len(bars["time"]):
+                    print(f"{spec}: no bars")
+                    continue
+                last = time.strftime("%Y-%m-%d %H:%M", time.gmtime(int(bars["time"][-1])))
+                print(f"{spec}: {len(bars['time'])} bars, last {last} UTC close {bars['close'][-1]:.2f}")
+        print(f"{dict(fetcher.stats)} in {time.monotonic() - started:.1f}s, cache {args.cache}")
+    finally:
+        cache.close()
+        app.disconnect()
+        api_thread.join(timeout=3)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IB 请求/响应往返耗时统计: 单调时钟计时 + HDR 风格直方图, 退出时打印 p50/p90/p99/max.
+"""
+
+import threading
+import time
+
+
+class LatencyHistogram:
+    """
+    HDR 风格的对数-线性分桶直方图 (单位: 纳秒).
+    每个 2 的幂区间再细分 2**sub_bucket_bits 个子桶, 相对误差约 1/2**(sub_bucket_bits-1),
+    记录一次只做几次整数运算和一次列表自增, 不产生额外对象.
+    """
+    def __init__(self, sub_bucket_bits: int = 7, max_bits: int = 48):
+        self.sub_bucket_bits = sub_bucket_bits
+        self._sub_mask = (1 << sub_bucket_bits) - 1
+        # 最大可记录 2**max_bits 纳秒 (约 78 小时), 更大的值落入最后一个桶
+        self._bucket_count = max(1, max_bits - sub_bucket_bits + 1)
+        self._counts = [0] * (self._bucket_count << sub_bucket_bits)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        bucket = value.bit_length() - self.sub_bucket_bits
+        if bucket <= 0:
+            return value
+        if bucket >= self._bucket_count:
+            return len(self._counts) - 1
+        return (bucket << self.sub_bucket_bits) + ((value >> bucket) & self._sub_mask)
+
+    def _value_at(self, index: int) -> int:
+        """返回某个桶所代表区间的上界 (保守估计)."""
+        bucket = index >> self.sub_bucket_bits
+        sub = index & self._sub_mask
+        if bucket == 0:
+            return sub
+        return (sub << bucket) + (1 << bucket) - 1
+
+    def record(self, value_ns: int):
+        if value_ns < 0:
+            value_ns = 0
+        self._counts[self._index(value_ns)] += 1
+        self.count += 1
+        self.total += value_ns
+        if value_ns > self.max:
+            self.max = value_ns
+        if self.min is None or value_ns < self.min:
+            self.min = value_ns
+
+    def percentile(self, pct: float) -> int:
+        """返回第 pct 百分位 (0~100) 的近似值 (纳秒)."""
+        if self.count == 0:
+            return 0
+        target = max(1, int(round(self.count * pct / 100.0)))
+        seen = 0
+        for idx, c in enumerate(self._counts):
+            if c:
+                seen += c
+                if seen >= target:
+                    return min(self._value_at(idx), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class LatencyRecorder:
+    """
+    按请求类型记录往返耗时.
+    start(kind, key) 在发出请求时调用, stop(kind, key) 在收到首个对应回调时调用;
+    同一 (kind, key) 只统计第一次 stop, 之后的回调直接忽略.
+    start 在请求线程、stop / discard 在 EReader 线程, _pending 由锁保护;
+    stop 都发生在 EReader 线程中, 直方图本身不加锁.
+    """
+    def __init__(self):
+        self.histograms = {}
+        # (kind, key) -> 发出请求时的 monotonic_ns
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def start(self, kind: str, key):
+        with self._lock:
+            self._pending[(kind, key)] = time.monotonic_ns()
+
+    def stop(self, kind: str, key):
+        """结束一次计时, 返回耗时(纳秒); 没有对应的 start 时返回 None."""
+        with self._lock:
+            t0 = self._pending.pop((kind, key), None)
+        if t0 is None:
+            return None
+        elapsed = time.monotonic_ns() - t0
+        self.record(kind, elapsed)
+        return elapsed
+
+    def discard(self, key):
+        """请求出错时丢弃该 key 下所有未完成的计时."""
+        with self._lock:
+            for pending_key in [k for k in list(self._pending) if k[1] == key]:
+                del self._pending[pending_key]
+
+    def record(self, kind: str, elapsed_ns: int):
+        hist = self.histograms.get(kind)
+        if hist is None:
+            hist = self.histograms[kind] = LatencyHistogram()
+        hist.record(elapsed_ns)
+
+    def summary(self) -> dict:
+        """返回 {kind: {count, p50, p90, p99, max}}, 单位毫秒."""
+        result = {}
+        for kind, hist in sorted(self.histograms.items()):
+            result[kind] = {
+                "count": hist.count,
+                "p50": hist.percentile(50) / 1e6,
+                "p90": hist.percentile(90) / 1e6,
+                "p99": hist.percentile(99) / 1e6,
+                "max": hist.max / 1e6,
+            }
+        return result
+
+    def print_summary(self):
+        """打印各请求类型的耗时分布; 没有任何样本时不输出."""
+        summary = self.summary()
+        if not summary:
+            return
+        print("\n======== IB Round-trip Latency (ms) ========")
+        print(f"{'request':<24}{'count':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+        for kind, s in summary.items():
+            print(f"{kind:<24}{s['count']:>8}{s['p50']:>10.2f}{s['p90']:>10.2f}"
+                  f"{s['p99']:>10.2f}{s['max']:>10.2f}")
+        print("============================================")
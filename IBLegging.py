@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分腿下单 (legging-in): 多腿组合的 BAG 单长时间不成交时, 改为逐腿成交.
+
+流程 (每一轮):
+  1) 对各腿取快照, 价差 (ask-bid)/mid 不超过 tight_spread 的腿视为"紧腿", 没有紧腿时取价差最小的一条;
+  2) 紧腿各自以单腿限价单并行下单, 从中间价向对手价追价;
+  3) 紧腿成交 (或超过 tight_leg_timeout) 后, 其余腿以单腿单追价, 其终止价由剩余净价预算决定:
+       预算 = 组合终止净价 x 本轮组合数 - 已成交部分的实际净支出,
+     预算不足以按对手价成交时, 按各腿剩余数量 x 价差的比例把差额分摊到各腿;
+  4) 腿之间不平衡 (已有腿成交、组合未配齐) 超过 max_legging_seconds 时,
+     complete_at_market=True 则剩余腿直接改到对手价配齐, 否则撤单并停止;
+  5) 某条腿的订单未成交完就结束 (被撤销 / Inactive) 时, 按剩余预算重新下剩余数量,
+     最多 max_leg_replacements 次, 仍失败则撤掉其余腿并停止 (本轮不计为完成).
+不平衡敞口控制: max_exposure (美元) 限制每轮组合数, 使紧腿先成交部分的权利金不超过该值.
+
+净价约定: 每组合单位的净支出, BUY 腿为正, SELL 腿为负 (与 BAG 报价和脚本里的 combo_init_price 一致).
+"""
+
+import math
+import threading
+import time
+from functools import reduce
+
+from ibapi.contract import Contract
+
+from IBOptionToolOffical import DEAD_STATUSES, TERMINAL_STATUSES, next_chase_price
+
+
+class _Leg:
+    """一条腿在整个分腿过程中的状态."""
+    def __init__(self, leg: dict, ratio: int):
+        self.leg = leg
+        self.action = leg['action'].upper()
+        self.sign = 1 if self.action == "BUY" else -1
+        self.ratio = ratio
+        self.contract = None
+        self.multiplier = float(leg.get('multiplier', "100"))
+        self.bid = self.ask = None
+        self.tight = False
+        # 当前轮的订单
+        self.order_id = None
+        self.quantity = 0
+        self.price = None
+        self.final = None
+        # 当前轮成交 (已成交数量, 成交金额)
+        self.round_filled = 0.0
+        self.round_cost = 0.0
+        # 当前轮中已结束订单的成交 (腿被重新下单时保留) 与重新下单次数
+        self.prior_filled = 0.0
+        self.prior_cost = 0.0
+        self.replacements = 0
+        # 之前各轮累计成交
+        self.filled = 0.0
+        self.cost = 0.0
+
+    @property
+    def mid(self):
+        return (self.bid + self.ask) / 2.0
+
+    @property
+    def natural(self):
+        """对手价: 买腿付 ask, 卖腿收 bid."""
+        return self.ask if self.action == "BUY" else self.bid
+
+    @property
+    def spread(self):
+        return self.ask - self.bid
+
+    def describe(self) -> str:
+        leg = self.leg
+        return f"{self.action} {leg['underlying']} {leg['right']}{leg['strike']}@{leg['lastTradeDate']}"
+
+
+class LeggedOrder:
+    """
+    manager: OrderManager; legs: 与 place_option_order 相同格式 (quantity = 比例 x 组合数量).
+    init_price / final_price: 每组合单位的起始 / 最差净价; step: 每次追价的步长; interval: 追价间隔(秒).
+    """
+    def __init__(self, manager, legs, init_price: float, final_price: float, step: float,
+                 interval: float = 5.0, tight_spread: float = 0.08, tight_leg_timeout: float = 30.0,
+                 max_exposure: float = None, max_legging_seconds: float = 60.0,
+                 complete_at_market: bool = True, max_leg_replacements: int = 2, poll: float = 0.2):
+        self.manager = manager
+        self.app = manager.app
+        self.init_price = init_price
+        self.final_price = final_price
+        self.step = step
+        self.interval = interval
+        self.tight_spread = tight_spread
+        self.tight_leg_timeout = tight_leg_timeout
+        self.max_exposure = max_exposure
+        self.max_legging_seconds = max_legging_seconds
+        self.complete_at_market = complete_at_market
+        self.max_leg_replacements = max_leg_replacements
+        self.poll = poll
+
+        quantities = [int(leg['quantity']) for leg in legs]
+        self.units = reduce(math.gcd, quantities) or 1
+        self.legs = [_Leg(leg, q // self.units) for leg, q in zip(legs, quantities)]
+        self.units_done = 0
+        self.result = None
+        self._thread = None
+
+    # ---- 对外接口 ----
+    def start(self) -> threading.Thread:
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+        return self._thread
+
+    def join(self, timeout: float = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.result
+
+    def unbalanced_exposure(self) -> float:
+        """已成交但尚未配成完整组合的部分, 按中间价计的权利金绝对值 (美元)."""
+        filled = {leg: leg.filled + leg.round_filled for leg in self.legs}
+        complete = min(filled[leg] / leg.ratio for leg in self.legs)
+        exposure = 0.0
+        for leg in self.legs:
+            extra = filled[leg] - complete * leg.ratio
+            if extra > 0 and leg.bid is not None:
+                exposure += extra * leg.mid * leg.multiplier
+        return exposure
+
+    # ---- 行情 ----
+    def _resolve(self) -> bool:
+        for idx, leg in enumerate(self.legs, start=1):
+            c = Contract()
+            c.symbol = leg.leg['underlying']
+            c.secType = leg.leg.get('secType', "OPT")
+            c.exchange = leg.leg.get('exchange', "SMART")
+            c.currency = leg.leg.get('currency', "USD")
+            c.lastTradeDateOrContractMonth = leg.leg['lastTradeDate']
+            c.strike = float(leg.leg['strike'])
+            c.right = leg.leg['right']
+            c.multiplier = leg.leg.get('multiplier', "100")
+            if leg.leg.get('conId'):
+                # 腿里已带 conId (如 IBStrategyBuilder 生成的), 不必再请求合约详情
+                c.conId = int(leg.leg['conId'])
+                leg.contract = c
+                continue
+            leg.contract = self.app.resolve_contract(c)
+            if leg.contract is None:
+                print(f"Legging: leg {idx} contract resolution failed, aborting.")
+                return False
+        return True
+
+    def _refresh_quotes(self, legs) -> bool:
+        for leg in legs:
+            snapshot = self.app.get_market_snapshot(leg.contract)
+            bid, ask = snapshot.get("bid"), snapshot.get("ask")
+            if bid is None or ask is None or bid <= 0 or ask <= 0 or ask < bid:
+                if leg.bid is None:
+                    print(f"Legging: no valid quote for {leg.describe()}.")
+                    return False
+                continue  # 沿用上一次的报价
+            leg.bid, leg.ask = bid, ask
+        return True
+
+    # ---- 下单 / 状态 ----
+    def _place(self, leg: _Leg, quantity: int, price: float, final: float):
+        order_leg = dict(leg.leg, quantity=quantity)
+        order_id = self.manager.place_option_order([order_leg], order_type="LMT", limit_price=price)
+        leg.order_id = order_id
+        leg.quantity = quantity
+        leg.price = self.manager._order_details[order_id]["limit_price"] if order_id else None
+        leg.final = final
+        return order_id
+
+    def _status(self, leg: _Leg):
+        """返回 (当前订单已成交数量, 成交均价, 是否已结束)."""
+        if leg.order_id is None:
+            return 0.0, 0.0, True
+        info = self.app.get_order_status(leg.order_id) or {}
+        filled = float(info.get("filled", 0.0) or 0.0)
+        done = info.get("status") in DEAD_STATUSES or filled >= leg.quantity - 1e-9
+        return filled, float(info.get("avgFillPrice", 0.0) or 0.0), done
+
+    def _reprice(self, leg: _Leg, target: float, jump: bool = False):
+        """按追价规则朝 target 前进一步 (jump=True 时直接改到 target)."""
+        if leg.order_id is None or leg.price is None:
+            return
+        new_price = target if jump else next_chase_price(leg.action, leg.price, self.step, target)
+        new_price = self.manager._snap_chase_price(leg.contract, leg.price, new_price, target)
+        if abs(new_price - leg.price) < 1e-10:
+            return
+        print(f"Legging: {leg.describe()} {leg.price:.2f} -> {new_price:.2f} (final {target:.2f})")
+        leg.price = new_price
+        self.manager.modify_order(leg.order_id, new_price)
+
+    # ---- 预算分摊 ----
+    def _allocate(self, legs, remaining, budget: float):
+        """
+        在剩余预算 budget 下给各腿分配限价: 预算足够时即对手价;
+        不足时按 剩余数量 x 价差 的比例把差额分摊为各腿相对对手价的让价.
+        """
+        natural_cost = sum(leg.sign * remaining[leg] * leg.natural for leg in legs)
+        if natural_cost <= budget:
+            return {leg: leg.natural for leg in legs}
+        shortfall = natural_cost - budget
+        weights = {leg: remaining[leg] * leg.spread for leg in legs}
+        total = sum(weights.values())
+        if total <= 0:
+            weights = {leg: remaining[leg] for leg in legs}
+            total = sum(weights.values())
+        prices = {}
+        for leg in legs:
+            qty = remaining[leg] or 1
+            concession = shortfall * weights[leg] / total / qty
+            prices[leg] = leg.natural - leg.sign * concession
+        return prices
+
+    # ---- 主流程 ----
+    def _run(self):
+        t_start = time.monotonic()
+        completed_at_market = False
+        if not self._resolve() or not self._refresh_quotes(self.legs):
+            self.result = self._summary(t_start, completed_at_market, aborted=True)
+            return
+
+        while self.units_done < self.units:
+            for leg in self.legs:
+                rel = leg.spread / leg.mid if leg.mid > 0 else float("inf")
+                leg.tight = rel <= self.tight_spread
+            if not any(leg.tight for leg in self.legs):
+                min(self.legs, key=lambda l: l.spread / l.mid if l.mid > 0 else float("inf")).tight = True
+            units = self._round_units()
+            print(f"Legging: round of {units} unit(s), tight legs: "
+                  + ", ".join(leg.describe() for leg in self.legs if leg.tight))
+            ok, at_market = self._run_round(units)
+            completed_at_market = completed_at_market or at_market
+            if not ok:
+                self.result = self._summary(t_start, completed_at_market, aborted=True)
+                return
+            self.units_done += units
+            if self.units_done < self.units and not self._refresh_quotes(self.legs):
+                break
+
+        self.result = self._summary(t_start, completed_at_market, aborted=self.units_done < self.units)
+
+    def _round_units(self) -> int:
+        remaining = self.units - self.units_done
+        if not self.max_exposure:
+            return remaining
+        per_unit = sum(leg.ratio * leg.mid * leg.multiplier for leg in self.legs if leg.tight)
+        if per_unit <= 0:
+            return remaining
+        return max(1, min(remaining, int(self.max_exposure // per_unit)))
+
+    def _run_round(self, units: int):
+        """完成一轮 units 个组合; 返回 (是否配齐, 是否用对手价补齐过)."""
+        for leg in self.legs:
+            leg.order_id = None
+            leg.round_filled = leg.round_cost = 0.0
+            leg.prior_filled = leg.prior_cost = 0.0
+            leg.replacements = 0
+        try:
+            return self._work_round(units)
+        finally:
+            for leg in self.legs:
+                leg.filled += leg.round_filled
+                leg.cost += leg.round_cost
+                leg.round_filled = leg.round_cost = 0.0
+
+    def _work_round(self, units: int):
+        # 1) 紧腿并行下单, 从中间价追到对手价
+        for leg in self.legs:
+            if leg.tight:
+                start = leg.mid
+                self._place(leg, leg.ratio * units, start, leg.natural)
+        phase = 1
+        t_round = time.monotonic()
+        t_unbalanced = None
+        last_reprice = time.monotonic()
+        at_market = False
+
+        while True:
+            time.sleep(self.poll)
+            now = time.monotonic()
+            working = []
+            for leg in self.legs:
+                filled, avg, done = self._status(leg)
+                leg.round_filled = leg.prior_filled + filled
+                leg.round_cost = leg.prior_cost + filled * avg
+                if leg.order_id is not None and not done:
+                    working.append(leg)
+            pending = [leg for leg in self.legs if leg.order_id is None]
+
+            # 订单已结束但未成交完的腿: 重新下剩余数量, 否则整轮失败
+            dead = [leg for leg in self.legs if leg.order_id is not None and leg not in working
+                    and leg.round_filled < leg.ratio * units - 1e-9]
+            if dead:
+                if not self._replace_legs(dead, working, units):
+                    for leg in working:
+                        self.app.cancelOrder(leg.order_id)
+                    return False, at_market
+                last_reprice = now
+                continue
+
+            if not working and not pending:
+                break
+            if t_unbalanced is None and any(leg.round_filled > 0 for leg in self.legs):
+                t_unbalanced = now
+
+            # 2) 紧腿完成或超时: 其余腿开始下单
+            if phase == 1 and (not working or now - t_round > self.tight_leg_timeout):
+                phase = 2
+                if pending:
+                    self._refresh_quotes(pending)
+                    remaining = {leg: leg.ratio * units for leg in pending}
+                    spent = sum(leg.sign * leg.round_cost for leg in self.legs)
+                    starts = self._allocate(pending, remaining, self.init_price * units - spent)
+                    finals = self._allocate(pending, remaining, self.final_price * units - spent)
+                    for leg in pending:
+                        start = min(max(starts[leg], leg.bid), leg.ask)
+                        if self._place(leg, leg.ratio * units, start, finals[leg]) is None:
+                            print(f"Legging: failed to place {leg.describe()}, cancelling remaining orders.")
+                            for other in working:
+                                self.app.cancelOrder(other.order_id)
+                            return False, False
+                    last_reprice = now
+                    continue
+
+            legging_too_long = (t_unbalanced is not None
+                                and now - t_unbalanced > self.max_legging_seconds)
+            if legging_too_long and not at_market:
+                if not self.complete_at_market:
+                    print("Legging: legs unbalanced for too long, cancelling remaining orders.")
+                    for leg in working:
+                        self.app.cancelOrder(leg.order_id)
+                    return False, at_market
+                print(f"Legging: legs unbalanced for {now - t_unbalanced:.1f}s "
+                      f"(exposure ${self.unbalanced_exposure():.0f}), completing at market.")
+                at_market = True
+                self._refresh_quotes(working)
+                for leg in working:
+                    leg.final = leg.natural
+                    self._reprice(leg, leg.natural, jump=True)
+                last_reprice = now
+                continue
+
+            if now - last_reprice < self.interval:
+                continue
+            last_reprice = now
+            if at_market:
+                # 已决定按对手价配齐: 行情变化时继续改到最新对手价
+                self._refresh_quotes(working)
+                for leg in working:
+                    leg.final = leg.natural
+                    self._reprice(leg, leg.natural, jump=True)
+                continue
+
+            # 3) 按实际成交重新计算剩余预算, 追价
+            self._refresh_quotes(working)
+            if phase == 1:
+                for leg in working:
+                    leg.final = leg.natural
+            else:
+                remaining = {leg: leg.ratio * units - leg.round_filled for leg in working}
+                spent = sum(leg.sign * leg.round_cost for leg in self.legs)
+                finals = self._allocate(working, remaining, self.final_price * units - spent)
+                for leg in working:
+                    leg.final = finals[leg]
+            for leg in working:
+                self._reprice(leg, leg.final)
+
+        return True, at_market
+
+    def _replace_legs(self, dead, working, units: int) -> bool:
+        """未成交完就结束的腿按剩余净价预算重新下单; 超过重下次数或下单失败返回 False."""
+        for leg in dead:
+            if leg.replacements >= self.max_leg_replacements:
+                print(f"Legging: {leg.describe()} ended with {leg.round_filled:g}/{leg.ratio * units} "
+                      f"filled after {leg.replacements} re-placement(s), cancelling remaining orders.")
+                return False
+        self._refresh_quotes(dead + working)
+        legs = dead + working
+        remaining = {leg: leg.ratio * units - leg.round_filled for leg in legs}
+        spent = sum(leg.sign * leg.round_cost for leg in self.legs)
+        finals = self._allocate(legs, remaining, self.final_price * units - spent)
+        for leg in dead:
+            if (self.app.get_order_status(leg.order_id) or {}).get("status") not in TERMINAL_STATUSES:
+                self.app.cancelOrder(leg.order_id)  # Inactive 的订单仍留在 IB, 先撤掉
+            leg.prior_filled, leg.prior_cost = leg.round_filled, leg.round_cost
+            leg.replacements += 1
+            quantity = int(round(remaining[leg]))
+            start = min(max(leg.price if leg.price is not None else leg.mid, leg.bid), leg.ask)
+            print(f"Legging: {leg.describe()} order {leg.order_id} ended with {quantity} unfilled, "
+                  f"re-placing ({leg.replacements}/{self.max_leg_replacements}).")
+            if self._place(leg, quantity, start, finals[leg]) is None:
+                print(f"Legging: failed to re-place {leg.describe()}, cancelling remaining orders.")
+                return False
+        for leg in working:
+            leg.final = finals[leg]
+        return True
+
+    def _summary(self, t_start: float, completed_at_market: bool, aborted: bool) -> dict:
+        complete = min(leg.filled / leg.ratio for leg in self.legs)
+        net = None
+        if complete > 0:
+            net = sum(leg.sign * leg.cost for leg in self.legs) / complete
+        result = {
+            "units": self.units,
+            "units_done": int(complete),
+            "net_price": None if net is None else round(net, 4),
+            "elapsed": round(time.monotonic() - t_start, 3),
+            "completed_at_market": completed_at_market,
+            "aborted": aborted,
+            "legs": [{"leg": leg.describe(), "filled": leg.filled,
+                      "avgFillPrice": round(leg.cost / leg.filled, 4) if leg.filled else None}
+                     for leg in self.legs],
+        }
+        print(f"Legging finished: {result['units_done']}/{self.units} combo(s), "
+              f"net price per combo={result['net_price']}, elapsed={result['elapsed']}s")
+        return result
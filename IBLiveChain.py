@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+随标的移动的实时期权链窗口: 订阅平值上下各 width 档行权价的 PUT/CALL 流式行情,
+标的价格使平值档位移动时, 只订阅新进入窗口的行权价、退订离开窗口的行权价,
+留在窗口内的行权价保持订阅, 已有报价不丢失. 全天保持窗口最新, 行情请求最少.
+
+整条链的合约在启动时用一次 reqContractDetails (只给 symbol + 到期日) 取回,
+窗口移动时不再需要逐个解析合约.
+
+运行前先确认下方参数, 然后:
+    python IBLiveChain.py
+"""
+
+import bisect
+import datetime
+import threading
+import time
+
+from ibapi.contract import Contract
+
+from IBOptionToolOffical import TWS_HOST, TWS_PORT
+from IBPriceOffical import IBOptionDataApp
+
+########################################################
+# 窗口参数
+chain_symbol = "UVXY"
+chain_expiry = None      # None 表示最近的到期日
+chain_width = 5          # 平值上下各几档行权价
+print_interval = 10.0    # 打印窗口的间隔 (秒)
+########################################################
+
+
+class LiveChainWindow:
+    """
+    app: 已连接的 IBOptionDataApp; symbol / expiry: 标的与到期日 (None 为最近的到期日).
+    hysteresis: 标的越过相邻行权价多少 (按档距的比例) 才移动窗口, 避免价格在两档之间时反复订阅/退订.
+    """
+    def __init__(self, app: IBOptionDataApp, symbol: str, expiry: str = None, width: int = 5,
+                 hysteresis: float = 0.25, rights=("P", "C"), exchange: str = "SMART",
+                 currency: str = "USD", timeout: float = 5.0):
+        self.app = app
+        self.symbol = symbol
+        self.expiry = expiry
+        self.width = width
+        self.hysteresis = hysteresis
+        self.rights = tuple(rights)
+        self.exchange = exchange
+        self.currency = currency
+        self.timeout = timeout
+
+        self.strikes = []
+        self._contracts = {}  # (strike, right) -> Contract
+        self._center = None
+        self._req_ids = {}    # (strike, right) -> reqId, 当前窗口内的订阅
+        self._lock = threading.Lock()
+
+        self._underlying_req_id = None
+        self._first_price = threading.Event()
+        self._tick = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # 统计: 订阅 / 退订次数, 窗口移动次数
+        self.subscribed = 0
+        self.cancelled = 0
+        self.shifts = 0
+
+    # ---- 对外接口 ----
+    def start(self) -> threading.Thread:
+        stock = Contract()
+        stock.symbol = self.symbol
+        stock.secType = "STK"
+        stock.exchange = self.exchange
+        stock.currency = self.currency
+        details = self.app.request_contract_details(stock, timeout=self.timeout)
+        if not details:
+            raise ValueError(f"cannot resolve underlying {self.symbol}")
+        stock = details[0].contract
+
+        if self.expiry is None:
+            chain = self.app.sec_def_chain(self.symbol, "STK", stock.conId, timeout=self.timeout)
+            if chain is None:
+                raise ValueError(f"no option chain for {self.symbol}")
+            today = datetime.date.today().strftime("%Y%m%d")
+            expirations = [e for e in (chain.expirations(self.symbol) or chain.expirations()) if e >= today]
+            if not expirations:
+                raise ValueError(f"no future expirations for {self.symbol}")
+            self.expiry = expirations[0]
+        self._load_chain()
+
+        self._underlying_req_id = self.app.subscribe_market_data(stock, self._on_underlying_tick)
+        if not self._first_price.wait(self.timeout):
+            self.app.unsubscribe_market_data(self._underlying_req_id)
+            raise ValueError(f"no quote for {self.symbol}")
+        self._recenter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self._tick.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            for req_id in self._req_ids.values():
+                self.app.unsubscribe_market_data(req_id)
+                self.cancelled += 1
+            self._req_ids.clear()
+        if self._underlying_req_id is not None:
+            self.app.unsubscribe_market_data(self._underlying_req_id)
+            self._underlying_req_id = None
+
+    def spot(self):
+        data = self.app._market_data_map.get(self._underlying_req_id) or {}
+        bid, ask = data.get("bid"), data.get("ask")
+        if bid and ask and bid > 0 and ask > 0:
+            return (bid + ask) / 2
+        return data.get("last") or None
+
+    def window(self) -> list:
+        """当前窗口内的行权价 (升序)."""
+        if self._center is None:
+            return []
+        return self.strikes[max(0, self._center - self.width):self._center + self.width]
+
+    def quotes(self) -> dict:
+        """(strike, right) -> {'bid', 'ask', 'last', IB 的 'iv' / 'delta' ...} 的副本, 只含当前窗口."""
+        with self._lock:
+            return {key: {**(self.app._market_data_map.get(req_id) or {}), **self.app.quotes.greeks(req_id)}
+                    for key, req_id in self._req_ids.items()}
+
+    def print_window(self):
+        quotes = self.quotes()
+        spot = self.spot()
+        print(f"======== {self.symbol} {self.expiry} spot={spot if spot else float('nan'):.2f} ========")
+        print(f"{'strike':>8} " + " ".join(f"{r + ' mid':>9}{r + ' iv':>8}{r + ' delta':>9}" for r in self.rights))
+        for strike in self.window():
+            cells = []
+            for right in self.rights:
+                q = quotes.get((strike, right), {})
+                bid, ask = q.get("bid"), q.get("ask")
+                cells.append(f"{(bid + ask) / 2:9.2f}" if bid and ask and bid > 0 and ask > 0 else f"{'-':>9}")
+                cells[-1] += f"{q['iv']:8.3f}" if "iv" in q else f"{'-':>8}"
+                cells[-1] += f"{q['delta']:9.3f}" if "delta" in q else f"{'-':>9}"
+            print(f"{strike:8g} " + " ".join(cells))
+
+    # ---- 窗口维护 ----
+    def _load_chain(self):
+        """一次请求取回该到期日的整条链."""
+        query = Contract()
+        query.symbol = self.symbol
+        query.secType = "OPT"
+        query.exchange = self.exchange
+        query.currency = self.currency
+        query.lastTradeDateOrContractMonth = self.expiry
+        for d in self.app.request_contract_details(query, timeout=self.timeout * 2):
+            c = d.contract
+            if c.tradingClass in ("", self.symbol) and c.right in self.rights:
+                self._contracts[(c.strike, c.right)] = c
+        self.strikes = sorted({strike for strike, _ in self._contracts})
+        if not self.strikes:
+            raise ValueError(f"no {self.symbol} options expiring {self.expiry}")
+
+    def _on_underlying_tick(self, req_id, field, price):
+        # EReader 线程: 只做标记, 订阅/退订在窗口线程中进行
+        self._first_price.set()
+        self._tick.set()
+
+    def _target_center(self, spot: float) -> int:
+        """平值档位 (bisect_left); 越过档位边界不足 hysteresis 个档距时保持原档位."""
+        strikes = self.strikes
+        target = bisect.bisect_left(strikes, spot)
+        center = self._center
+        if center is None or target == center or not 0 < target < len(strikes):
+            return target
+        margin = self.hysteresis * (strikes[target] - strikes[target - 1])
+        if target > center and spot <= strikes[target - 1] + margin:
+            target -= 1
+        elif target < center and spot >= strikes[target] - margin:
+            target += 1
+        return target
+
+    def _recenter(self):
+        spot = self.spot()
+        if spot is None:
+            return
+        center = self._target_center(spot)
+        if center == self._center:
+            return
+        old = set(self.window())
+        self._center = center
+        new = set(self.window())
+        if self._req_ids:
+            self.shifts += 1
+        with self._lock:
+            # 先退订离开的行权价, 腾出行情线路, 再订阅新进入的
+            for strike in old - new:
+                for right in self.rights:
+                    req_id = self._req_ids.pop((strike, right), None)
+                    if req_id is not None:
+                        self.app.unsubscribe_market_data(req_id)
+                        self.cancelled += 1
+            for strike in sorted(new - old):
+                for right in self.rights:
+                    contract = self._contracts.get((strike, right))
+                    if contract is not None:
+                        self._req_ids[(strike, right)] = self.app.subscribe_market_data(contract)
+                        self.subscribed += 1
+        if old:
+            print(f"{self.symbol}: spot {spot:.2f}, window moved to {min(new):g}-{max(new):g} "
+                  f"(+{len(new - old)} / -{len(old - new)} strikes)")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._tick.wait(1.0)
+            self._tick.clear()
+            if self._stop.is_set():
+                break
+            self._recenter()
+
+
+def main():
+    app = IBOptionDataApp()
+    app.verbose = False
+    print("尝试连接 TWS/网关...")
+    app.connect(TWS_HOST, TWS_PORT, clientId=4)
+    threading.Thread(target=app.run, daemon=True).start()
+    t0 = time.time()
+    while app.next_order_id is None and time.time() - t0 < 5:
+        time.sleep(0.1)
+    if app.next_order_id is None:
+        print("未能连接到 TWS/网关.")
+        return
+
+    view = LiveChainWindow(app, chain_symbol, chain_expiry, width=chain_width)
+    view.start()
+    print(f"Tracking {chain_symbol} {view.expiry} ±{chain_width} strikes. Ctrl-C to stop.")
+    try:
+        while True:
+            time.sleep(print_interval)
+            view.print_window()
+    except KeyboardInterrupt:
+        pass
+    view.stop()
+    print(f"Subscribed {view.subscribed}, cancelled {view.cancelled}, window moved {view.shifts} times.")
+    app.disconnect()
+
+
+if __name__ == "__main__":
+    main()
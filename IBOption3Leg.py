@@ -2,7 +2,8 @@ import time
 import sys
 import threading
 from ibapi.contract import Contract
-from IBOptionToolOffical import IBApp, OrderManager
+from IBOptionToolOffical import IBApp, OrderManager, TWS_HOST, TWS_PORT
+from IBQuoteStore import format_greeks
 
 ########################################################
 # 三腿下单
@@ -39,10 +40,11 @@ def main():
     # 连接到 IB TWS 或 IB Gateway（请确保 TWS/网关已运行）
     # 1) 连接 IB TWS/IB Gateway
     app = IBApp()
+    app.tracer.begin("connect", "connect")
     print("Connecting to IB API...")
     try:
         # 真实账户常用7496，纸交易常用7497
-        app.connect("127.0.0.1", 7496, clientId=1)
+        app.connect(TWS_HOST, TWS_PORT, clientId=1)
     except Exception as e:
         print("Could not connect to IB API:", e)
         sys.exit(1)
@@ -57,10 +59,12 @@ def main():
         time.sleep(0.1)
     if app.next_order_id is None:
         print("Warning: next valid order ID not received. Proceeding anyway.")
+    app.tracer.end("connect")
 
     # 2) 创建订单管理器
     manager = OrderManager(app)
 
+    app.tracer.begin("parse params", "params")
     # 构造legs列表
     legs = [
         {
@@ -88,6 +92,7 @@ def main():
             "quantity": leg3_ratio * combo_quantity
         }
     ]
+    app.tracer.end("params", legs=len(legs))
 
     # ========== 新增功能：在下单前打印每条腿信息、当前市场价格、组合价格，并询问确认 ==========
 
@@ -132,7 +137,7 @@ def main():
         print(f"Leg {idx}: Action={leg['action']} Qty={leg['quantity']}  "
               f"Exp={leg['lastTradeDate']} Strike={leg['strike']} {leg['right']}, "
               f"bid={bid:.2f}, ask={ask:.2f}, last={last:.2f}, mid~={mid:.2f}, "
-              f"Leg est. cost={leg_cost:.2f}")
+              f"Leg est. cost={leg_cost:.2f}{format_greeks(snapshot)}")
 
     print(f"--> Estimated combo total cost (for {combo_quantity} combo(s)) = {net_estimated_cost:.2f}")
     print("----------------------------------------------")
@@ -140,7 +145,9 @@ def main():
     print("==============================================")
 
     # 5) 增加一个交互：是否确认下单
+    app.tracer.begin("wait for user confirm", "confirm")
     user_input = input("是否确认下单？输入 Y 或 y 确认下单，其余任意键取消并退出: ")
+    app.tracer.end("confirm")
     if user_input.lower() != 'y':
         print("用户取消下单，程序结束。")
         # 先主动断开，以防与TWS还连接着
@@ -163,6 +170,8 @@ def main():
     # 等待追价线程执行完毕（即订单被填满/取消或到达final价）
     chase_thread.join()
 
+    app.export_trace()
+
     print("Disconnecting from IB...")
     app.disconnect()
 
@@ -2,7 +2,9 @@ import time
 import sys
 import threading
 from ibapi.contract import Contract
-from IBOptionToolOffical import IBApp, OrderManager
+from IBOptionToolOffical import IBApp, OrderManager, TWS_HOST, TWS_PORT
+from IBQuoteStore import format_greeks
+from IBPayoff import surface_from_quotes, print_summary
 
 interval = 10
 ########################################################
@@ -38,16 +40,23 @@ combo_init_price = 3.00
 
 combo_price_final = 4.13
 combo_price_step  = 0.01
+
+# 分腿模式: True 时不下 BAG 单, 先成交价差小的腿, 再在净价预算内追其余腿 (见 IBLegging.py)
+legging = False
+
+# 预览时计算组合在近月到期日前的盈亏曲面 (最大亏损/盈利、盈亏平衡点, 见 IBPayoff.py)
+show_payoff = True
 ########################################################
 
 def main():
     # 连接到 IB TWS 或 IB Gateway（请确保 TWS/网关已运行）
     # 1) 连接 IB TWS/IB Gateway
     app = IBApp()
+    app.tracer.begin("connect", "connect")
     print("Connecting to IB API...")
     try:
         # 真实账户常用7496，纸交易常用7497
-        app.connect("127.0.0.1", 7496, clientId=1)
+        app.connect(TWS_HOST, TWS_PORT, clientId=1)
     except Exception as e:
         print("Could not connect to IB API:", e)
         sys.exit(1)
@@ -62,10 +71,12 @@ def main():
         time.sleep(0.1)
     if app.next_order_id is None:
         print("Warning: next valid order ID not received. Proceeding anyway.")
+    app.tracer.end("connect")
 
     # 2) 创建订单管理器
     manager = OrderManager(app)
 
+    app.tracer.begin("parse params", "params")
     # 构造legs列表
     legs = [
         {
@@ -101,11 +112,13 @@ def main():
             "quantity": leg4_ratio * combo_quantity
         }
     ]
+    app.tracer.end("params", legs=len(legs))
 
     # ========== 新增功能：在下单前打印每条腿信息、当前市场价格、组合价格，并询问确认 ==========
 
     # 4) 打印每条腿的市场行情 + 计算组合预估净价
     net_estimated_cost = 0.0  # 组合的预估净成本(正=花费，负=收到)
+    leg_mids = []  # 各腿中间价, 用于反推隐含波动率
     print("\n======== Legs Market Data Preview ========")
     for idx, leg in enumerate(legs, start=1):
         # 为了获取准确行情，需要先构建并resolve_contract
@@ -141,19 +154,44 @@ def main():
         # leg['quantity']张合约, 每张 * 100 股
         leg_cost = mid * 100 * leg['quantity'] * sign
         net_estimated_cost += leg_cost
+        leg_mids.append(mid)
 
         print(f"Leg {idx}: Action={leg['action']} Qty={leg['quantity']}  "
               f"Exp={leg['lastTradeDate']} Strike={leg['strike']} {leg['right']}, "
               f"bid={bid:.2f}, ask={ask:.2f}, last={last:.2f}, mid~={mid:.2f}, "
-              f"Leg est. cost={leg_cost:.2f}")
+              f"Leg est. cost={leg_cost:.2f}{format_greeks(snapshot)}")
 
     print(f"--> Estimated combo total cost (for {combo_quantity} combo(s)) = {net_estimated_cost:.2f}")
+
+    if show_payoff and len(leg_mids) == len(legs):
+        stock = Contract()
+        stock.symbol = spread_symbol
+        stock.secType = "STK"
+        stock.exchange = "SMART"
+        stock.currency = "USD"
+        resolved_stock = app.resolve_contract(stock)
+        spot = 0.0
+        if resolved_stock is not None:
+            stock_snapshot = app.get_market_snapshot(resolved_stock)
+            stock_bid = stock_snapshot.get("bid", 0.0)
+            stock_ask = stock_snapshot.get("ask", 0.0)
+            spot = (stock_bid + stock_ask) / 2.0 if stock_bid > 0.0 and stock_ask > 0.0 \
+                else stock_snapshot.get("last", 0.0)
+        if spot > 0.0:
+            with app.tracer.span("payoff surface", track="params"):
+                surface = surface_from_quotes(legs, spot, leg_mids, net_estimated_cost)
+            print(f"Underlying {spread_symbol} ~ {spot:.2f}")
+            print_summary(surface)
+        else:
+            print(f"Underlying {spread_symbol}: no price, payoff preview skipped.")
     print("----------------------------------------------")
     print(f"下单金额参数: 起始={combo_init_price:.2f}, 步长={combo_price_step:.2f}, 终止={combo_price_final:.2f}")
     print("==============================================")
 
     # 5) 增加一个交互：是否确认下单
+    app.tracer.begin("wait for user confirm", "confirm")
     user_input = input("是否确认下单？输入 Y 或 y 确认下单，其余任意键取消并退出: ")
+    app.tracer.end("confirm")
     if user_input.lower() != 'y':
         print("用户取消下单，程序结束。")
         # 先主动断开，以防与TWS还连接着
@@ -161,6 +199,15 @@ def main():
         sys.exit(0)
 
     # ========= 如果用户确认，才进行下单 =========
+    if legging:
+        legged = manager.place_legged_order(legs, combo_init_price, combo_price_final,
+                                            combo_price_step, interval)
+        legged.join()
+        app.export_trace()
+        print("Disconnecting from IB...")
+        app.disconnect()
+        return
+
     order_id = manager.place_option_order(legs, order_type="LMT", limit_price=combo_init_price)
     if order_id:
         print(f"四腿组合下单完成, 订单ID={order_id}, 初始限价={combo_init_price:.2f}")
@@ -176,6 +223,8 @@ def main():
     # 等待追价线程执行完毕（即订单被填满/取消或到达final价）
     chase_thread.join()
 
+    app.export_trace()
+
     print("Disconnecting from IB...")
     app.disconnect()
 
@@ -4,28 +4,81 @@
 示例: 使用预先定义的多腿期权参数下单，并自动从初始限价逐步递价到目标限价。
 """
 
+import atexit
+import functools
+import itertools
+import os
+import queue
 import sys
 import threading
 import time
+from collections import Counter, deque
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_UP
 
 from ibapi.client import EClient
 from ibapi.wrapper import EWrapper
 from ibapi.contract import Contract, ComboLeg
 from ibapi.order import Order
 
+from IBLatency import LatencyRecorder
+from IBOrderArchive import OrderArchive, approx_size
+from IBPortfolio import Portfolio
+from IBQuoteStore import QuoteStore
+from IBRecorder import install_recorder
+from IBSecDefCache import SecDefCache, SecDefChain
+from IBThrottle import TokenBucket
+from IBTrace import TraceRecorder
+
+TERMINAL_STATUSES = ("Filled", "Cancelled", "ApiCanceled")
+# 这些状态也意味着订单已不再工作 (被拒绝 / 失效), 分腿、拆单用来判断子单是否结束
+DEAD_STATUSES = TERMINAL_STATUSES + ("Inactive",)
+# 只是提示、不代表请求或订单失败的错误码: 399 (订单警告, 如盘后), 2100-2199 (数据农场连接、2109 等),
+# 10090 (部分行情未订阅), 10167 (显示延迟行情), 10197 (竞争会话期间无行情)
+WARNING_CODES = frozenset(range(2100, 2200)) | {399, 10090, 10167, 10197}
+
+# 没有价格规则时使用的最小变动价位
+DEFAULT_PRICE_INCREMENT = Decimal("0.01")
+# 对齐价格时容忍的浮点误差 (以价位为单位)
+SNAP_TOLERANCE_TICKS = Decimal("1e-4")
+
+# TWS/IB Gateway 地址: 真实账户常用7496，纸交易常用7497
+# 可用环境变量 IB_TWS_HOST / IB_TWS_PORT 覆盖 (例如指向本地模拟网关)
+TWS_HOST = os.environ.get("IB_TWS_HOST", "127.0.0.1")
+TWS_PORT = int(os.environ.get("IB_TWS_PORT", "7496"))
+
 
 class IBApp(EWrapper, EClient):
     """IB API App, 继承自 EWrapper 和 EClient, 处理 API 连接和回调."""
-    def __init__(self):
+    def __init__(self, record_path: str = None,
+                 archive_max_orders: int = 1000, archive_ttl: float = 3600.0,
+                 order_msg_rate: float = 50.0, modify_ack_timeout: float = 5.0,
+                 order_retention: float = 60.0, trace_path: str = None):
         EClient.__init__(self, self)
         self.next_order_id = None
+        # 请求 ID 序号: 每次请求都用新的 reqId, 避免超时请求的迟到回调混入下一次请求
+        self._req_id_seq = itertools.count(1)
         # 存储合约详情查询结果: reqId -> list of Contract
         self._contract_details = {}
         # 存储行情数据: reqId -> dict of price/size
         self.market_data = {}
+        # 流式行情监听者: reqId -> listener(reqId, field, value), 在 EReader 线程中调用
+        self._tick_listeners = {}
+        # 列式行情表: bid/ask 与 IB 模型值 (tickOptionComputation 的 IV / Greeks), 每个行情请求一行
+        self.quotes = QuoteStore()
+        # 价格规则缓存: conId -> marketRuleIds (逗号分隔, 来自合约详情); ruleId -> [(lowEdge, increment)]
+        # 带 conId 的腿下单时不再请求合约详情, 规则无从补回, 因此不随订单清理 (每个合约一个短字符串)
+        self._market_rule_ids = {}
+        self.market_rules = {}
+        self._market_rule_events = {}
+        self._market_rule_lock = threading.Lock()
+        # 期权链参数 (reqSecDefOptParams): reqId -> 结果行; 按标的 conId 缓存到当天结束 (与 IBOptionDataApp 共用磁盘缓存)
+        self._sec_def_rows = {}
+        self.sec_def_cache = SecDefCache()
 
         # 存储订单状态: orderId -> dict(status, filled, remaining, avgFillPrice)
+        # 只保存未结束的订单; 已结束的移入 order_archive, 查询请用 get_order_status()
         self.order_statuses = {}
+        self.order_archive = OrderArchive(archive_max_orders, archive_ttl)
         # 标记已打印提示的订单 ID (避免重复输出)
         self._submitted_announced = set()
         self._partial_announced = set()
@@ -35,6 +88,111 @@ class IBApp(EWrapper, EClient):
         # 错误信息存储(可选)
         self.last_error = None
 
+        # 订单消息 (下单/改单/撤单) 全局限速, IB 默认每秒最多 50 条
+        self.order_throttle = TokenBucket(order_msg_rate)
+        # 已发出但尚未收到回报的改单: orderId -> 发出时间(monotonic); 超过 modify_ack_timeout 视为丢失
+        self._modify_inflight = {}
+        self.modify_ack_timeout = modify_ack_timeout
+        # 改单回报监听者 (例如 OrderManager 用来发出合并后的最新价格), 参数为 orderId
+        self._modify_ack_listeners = []
+        # 已结束的订单 (结束时间 monotonic, orderId); 超过 order_retention 秒后清理其订单细节,
+        # 留出时间给追价 / 对冲等轮询线程读取最终状态
+        self._finished_orders = deque()
+        self.order_retention = order_retention
+        # 订单清理监听者 (OrderManager 用来删除订单细节), 参数为 orderId
+        self._order_evict_listeners = []
+        # 订单结束 (Filled/Cancelled) 监听者, 参数为 orderId, 在 EReader 线程中调用
+        self._order_finish_listeners = []
+        # 订单消息计数: order_msgs / order_msgs_delayed / modify_sent / modify_deferred / modify_coalesced
+        self.order_counters = Counter()
+        atexit.register(self.print_order_counters)
+
+        # 持仓组合: subscribe_portfolio() 之后由持仓/账户/单合约盈亏推送增量更新
+        self.accounts = []
+        self.portfolio = Portfolio()
+        self._portfolio_account = None
+        self._positions_end = threading.Event()
+        self._account_download_end = threading.Event()
+        # 单合约盈亏订阅: conId -> reqId, reqId -> (account, conId); None 表示不订阅
+        self._pnl_req_ids = None
+        self._pnl_requests = {}
+
+        # 请求往返耗时统计, 程序退出时打印汇总
+        self.latency = LatencyRecorder()
+        self._placed_order_ids = set()
+        atexit.register(self.latency.print_summary)
+        # 每个订单的阶段时间线, 可导出为 Chrome trace JSON
+        self.tracer = TraceRecorder()
+        # 可选: 导出路径, 未显式传入时读取环境变量 IB_TRACE_PATH; 都没有时不写文件
+        self.trace_path = trace_path or os.environ.get("IB_TRACE_PATH")
+
+        # 可选: 把所有回调录制到二进制日志, 之后可用 IBRecorder.py 回放
+        # 未显式传入时读取环境变量 IB_RECORD_PATH
+        record_path = record_path or os.environ.get("IB_RECORD_PATH")
+        if record_path:
+            recorder = install_recorder(self, record_path)
+            atexit.register(recorder.close)
+            print(f"Recording API callbacks to {record_path}")
+
+    # EClient 请求方法重载: 发出请求时开始计时
+    def reqContractDetails(self, reqId, contract):
+        self.latency.start("reqContractDetails", reqId)
+        super().reqContractDetails(reqId, contract)
+
+    def reqMktData(self, reqId, contract, genericTickList, snapshot,
+                   regulatorySnapshot, mktDataOptions):
+        self.quotes.open(reqId, contract.conId)
+        self.latency.start("reqMktData.firstTick", reqId)
+        if snapshot:
+            self.latency.start("reqMktData.snapshotEnd", reqId)
+        super().reqMktData(reqId, contract, genericTickList, snapshot,
+                           regulatorySnapshot, mktDataOptions)
+
+    def reqSecDefOptParams(self, reqId, underlyingSymbol, futFopExchange,
+                           underlyingSecType, underlyingConId):
+        self.latency.start("reqSecDefOptParams", reqId)
+        super().reqSecDefOptParams(reqId, underlyingSymbol, futFopExchange,
+                                   underlyingSecType, underlyingConId)
+
+    def reqMarketRule(self, marketRuleId):
+        self.latency.start("reqMarketRule", marketRuleId)
+        super().reqMarketRule(marketRuleId)
+
+    def reqPositions(self):
+        self.latency.start("reqPositions", "positions")
+        super().reqPositions()
+
+    def reqAccountUpdates(self, subscribe: bool, acctCode: str):
+        if subscribe:
+            self.latency.start("reqAccountUpdates", acctCode)
+        super().reqAccountUpdates(subscribe, acctCode)
+
+    def placeOrder(self, orderId, contract, order):
+        self._throttle_order_msg()
+        # 同一 orderId 再次 placeOrder 即为改单
+        track = f"order {orderId}"
+        if orderId in self._placed_order_ids:
+            self._modify_inflight[orderId] = time.monotonic()
+            self.order_counters["modify_sent"] += 1
+            self.latency.start("modifyOrder", orderId)
+            self.tracer.begin("modify ack", ("ack", orderId), track, lmtPrice=order.lmtPrice)
+        else:
+            self._placed_order_ids.add(orderId)
+            self.latency.start("placeOrder", orderId)
+            self.tracer.begin("order lifetime", ("order", orderId), track)
+            self.tracer.begin("first ack", ("ack", orderId), track, lmtPrice=order.lmtPrice)
+        super().placeOrder(orderId, contract, order)
+
+    def cancelOrder(self, orderId, *args):
+        self._throttle_order_msg()
+        super().cancelOrder(orderId, *args)
+
+    def _throttle_order_msg(self):
+        waited = self.order_throttle.acquire()
+        self.order_counters["order_msgs"] += 1
+        if waited > 0:
+            self.order_counters["order_msgs_delayed"] += 1
+
     # EWrapper 回调方法重载:
     def nextValidId(self, orderId: int):
         """连接成功后返回下一个有效订单 ID"""
@@ -43,22 +201,45 @@ class IBApp(EWrapper, EClient):
         print(f"Connected: Next valid order ID is {orderId}")
         print("Connected to IB.")
 
+    def managedAccounts(self, accountsList: str):
+        self.accounts = [a for a in accountsList.split(",") if a]
+
     def error(self, reqId, errorCode, errorString, advancedOrderRejectJson=None):
         """错误回调"""
         err_msg = f"Info. Id: {reqId}, Code: {errorCode}, Msg: {errorString}"
         print(err_msg)
+        if errorCode in WARNING_CODES:
+            # 提示类信息: 订单仍在等待 TWS 回报, 不算改单回报, 也不丢弃计时
+            return
         self.last_error = (reqId, errorCode, errorString)
+        self.latency.discard(reqId)
+        # 改单被拒也算收到回报
+        self._modify_acked(reqId)
 
     def orderStatus(self, orderId, status, filled, remaining,
                     avgFillPrice, permId, parentId, lastFillPrice,
                     clientId, whyHeld, mktCapPrice):
         """订单状态更新回调"""
-        self.order_statuses[orderId] = {
+        self.latency.stop("placeOrder", orderId)
+        self.latency.stop("modifyOrder", orderId)
+        self._modify_acked(orderId)
+        track = f"order {orderId}"
+        self.tracer.end(("ack", orderId), status=status)
+        prev_filled = (self.get_order_status(orderId) or {}).get("filled", 0)
+        if filled > prev_filled:
+            self.tracer.instant("fill" if remaining == 0 else "partial fill", track,
+                                filled=filled, remaining=remaining, avgFillPrice=avgFillPrice)
+        state = {
             "status": status,
             "filled": filled,
             "remaining": remaining,
             "avgFillPrice": avgFillPrice
         }
+        if status in TERMINAL_STATUSES:
+            self.tracer.end(("order", orderId), status=status, avgFillPrice=avgFillPrice)
+            self._archive_order(orderId, state)
+        else:
+            self.order_statuses[orderId] = state
         print(f"OrderStatus - orderId: {orderId}, status: {status}, "
               f"filled: {filled}, remaining: {remaining}, avgFillPrice: {avgFillPrice}")
 
@@ -77,6 +258,9 @@ class IBApp(EWrapper, EClient):
 
     def openOrder(self, orderId, contract, order, orderState):
         """打开订单回调"""
+        self.latency.stop("modifyOrder", orderId)
+        self._modify_acked(orderId)
+        self.tracer.end(("ack", orderId), status=orderState.status)
         price_info = ""
         if order.orderType.upper() == "LMT":
             price_info = f"{order.lmtPrice}"
@@ -84,7 +268,7 @@ class IBApp(EWrapper, EClient):
               f"{order.action} {order.totalQuantity} @ {order.orderType} {price_info}, "
               f"Status: {orderState.status}")
 
-        if orderId not in self.order_statuses:
+        if self.get_order_status(orderId) is None and orderState.status not in TERMINAL_STATUSES:
             self.order_statuses[orderId] = {
                 "status": orderState.status,
                 "filled": 0,
@@ -100,21 +284,49 @@ class IBApp(EWrapper, EClient):
     def contractDetails(self, reqId: int, contractDetails):
         """合约详情回调"""
         cd = contractDetails
-        if reqId not in self._contract_details:
-            self._contract_details[reqId] = []
-        self._contract_details[reqId].append(cd.contract)
+        if cd.marketRuleIds:
+            self._market_rule_ids[cd.contract.conId] = cd.marketRuleIds
+        # 只收集仍在等待中的请求, 已超时释放的请求的迟到回调直接丢弃
+        details_list = self._contract_details.get(reqId)
+        if details_list is not None:
+            details_list.append(cd.contract)
 
     def contractDetailsEnd(self, reqId: int):
         """合约详情查询结束"""
+        self.latency.stop("reqContractDetails", reqId)
         if reqId in self._req_events:
             ev = self._req_events[reqId]
             if isinstance(ev, threading.Event):
                 ev.set()
 
+    def securityDefinitionOptionParameter(self, reqId: int, exchange: str, underlyingConId: int,
+                                          tradingClass: str, multiplier: str, expirations, strikes):
+        rows = self._sec_def_rows.get(reqId)
+        if rows is not None:
+            rows.append((exchange, underlyingConId, tradingClass, multiplier, expirations, strikes))
+
+    def securityDefinitionOptionParameterEnd(self, reqId: int):
+        self.latency.stop("reqSecDefOptParams", reqId)
+        ev = self._req_events.get(reqId)
+        if isinstance(ev, threading.Event):
+            ev.set()
+
+    def marketRule(self, marketRuleId: int, priceIncrements):
+        """价格规则回调: 按 lowEdge 升序保存, 用 Decimal 避免浮点误差"""
+        self.latency.stop("reqMarketRule", marketRuleId)
+        rows = sorted((Decimal(str(p.lowEdge)), Decimal(str(p.increment))) for p in priceIncrements)
+        self.market_rules[marketRuleId] = rows
+        ev = self._market_rule_events.get(marketRuleId)
+        if ev is not None:
+            ev.set()
+
     def tickPrice(self, reqId, tickType, price, attrib):
         """行情价格回调"""
-        if reqId not in self.market_data:
-            self.market_data[reqId] = {}
+        self.latency.stop("reqMktData.firstTick", reqId)
+        # 请求发出前已建好条目; 找不到说明请求已结束释放, 迟到的推送直接丢弃
+        data = self.market_data.get(reqId)
+        if data is None:
+            return
         price_fields = {
             1: "bid",
             2: "ask",
@@ -125,13 +337,19 @@ class IBApp(EWrapper, EClient):
         }
         if tickType in price_fields:
             field = price_fields[tickType]
-            self.market_data[reqId][field] = price
-        self.market_data[reqId][f"tickPrice_{tickType}"] = price
+            data[field] = price
+        data[f"tickPrice_{tickType}"] = price
+        self.quotes.on_price(reqId, tickType, price)
+        listener = self._tick_listeners.get(reqId)
+        if listener is not None:
+            listener(reqId, price_fields.get(tickType, f"tickPrice_{tickType}"), price)
 
     def tickSize(self, reqId, tickType, size):
         """行情数量回调"""
-        if reqId not in self.market_data:
-            self.market_data[reqId] = {}
+        self.latency.stop("reqMktData.firstTick", reqId)
+        data = self.market_data.get(reqId)
+        if data is None:
+            return
         size_fields = {
             0: "bidSize",
             3: "askSize",
@@ -140,27 +358,280 @@ class IBApp(EWrapper, EClient):
         }
         if tickType in size_fields:
             field = size_fields[tickType]
-            self.market_data[reqId][field] = size
-        self.market_data[reqId][f"tickSize_{tickType}"] = size
+            data[field] = size
+        data[f"tickSize_{tickType}"] = size
+        self.quotes.on_size(reqId, tickType, size)
+
+    def tickOptionComputation(self, reqId, tickType, tickAttrib, impliedVol, delta, optPrice, pvDividend,
+                              gamma, vega, theta, undPrice):
+        """IB 的模型 IV / Greeks, 写入列式行情表 (self.quotes)"""
+        self.quotes.on_option_computation(reqId, tickType, impliedVol, delta, optPrice, gamma, vega, theta,
+                                          undPrice)
 
     def tickSnapshotEnd(self, reqId: int):
         """行情快照结束回调"""
+        self.latency.stop("reqMktData.snapshotEnd", reqId)
         if reqId in self._req_events:
             ev = self._req_events[reqId]
             if isinstance(ev, threading.Event):
                 ev.set()
 
+    def position(self, account: str, contract: Contract, position, avgCost: float):
+        """持仓推送 (reqPositions): 初始全量, 之后每次变化推送一条."""
+        self.portfolio.update_position(account, contract, position, avgCost)
+        if self._pnl_req_ids is not None and contract.conId not in self._pnl_req_ids:
+            req_id = self._next_req_id(7000000)
+            self._pnl_req_ids[contract.conId] = req_id
+            self._pnl_requests[req_id] = (account, contract.conId)
+            self.reqPnLSingle(req_id, account, "", contract.conId)
+
+    def positionEnd(self):
+        self.latency.stop("reqPositions", "positions")
+        self._positions_end.set()
+
+    def updatePortfolio(self, contract: Contract, position, marketPrice: float, marketValue: float,
+                        averageCost: float, unrealizedPNL: float, realizedPNL: float, accountName: str):
+        """账户推送 (reqAccountUpdates) 中的持仓市值与盈亏."""
+        self.portfolio.update_portfolio(accountName, contract, position, marketPrice, marketValue,
+                                        averageCost, unrealizedPNL, realizedPNL)
+
+    def updateAccountValue(self, key: str, val: str, currency: str, accountName: str):
+        self.portfolio.update_account_value(accountName, key, val, currency)
+
+    def accountDownloadEnd(self, accountName: str):
+        self.latency.stop("reqAccountUpdates", accountName)
+        self._account_download_end.set()
+
+    def pnlSingle(self, reqId: int, pos, dailyPnL: float, unrealizedPnL: float,
+                  realizedPnL: float, value: float):
+        request = self._pnl_requests.get(reqId)
+        if request is not None:
+            self.portfolio.update_pnl(request[0], request[1], pos, dailyPnL,
+                                      unrealizedPnL, realizedPnL, value)
+
+    # 持仓组合订阅
+    def subscribe_portfolio(self, account: str = None, pnl_single: bool = True,
+                            timeout: float = 5.0) -> bool:
+        """
+        订阅持仓 (reqPositions) 与账户更新 (reqAccountUpdates), pnl_single 时再为每个持仓合约订阅 reqPnLSingle.
+        之后 self.portfolio 随推送自动更新; 返回初始数据是否在 timeout 内到齐.
+        """
+        account = account or (self.accounts[0] if self.accounts else "")
+        self._portfolio_account = account
+        self._pnl_req_ids = {} if pnl_single else None
+        self._positions_end.clear()
+        self._account_download_end.clear()
+        self.reqPositions()
+        self.reqAccountUpdates(True, account)
+        deadline = time.monotonic() + timeout
+        ready = self._positions_end.wait(timeout)
+        ready = self._account_download_end.wait(max(0.0, deadline - time.monotonic())) and ready
+        if not ready:
+            print(f"Warning: portfolio subscription for {account or 'default account'} not complete "
+                  f"within {timeout}s.")
+        return ready
+
+    def unsubscribe_portfolio(self):
+        if self._portfolio_account is None:
+            return
+        self.cancelPositions()
+        self.reqAccountUpdates(False, self._portfolio_account)
+        for req_id in list(self._pnl_requests):
+            self.cancelPnLSingle(req_id)
+        self._pnl_requests.clear()
+        self._pnl_req_ids = None
+        self._portfolio_account = None
+
+    # 订单状态与请求状态的清理
+    def get_order_status(self, order_id: int):
+        """返回订单最新状态 dict (活动订单或已归档的结束订单), 未知订单返回 None."""
+        state = self.order_statuses.get(order_id)
+        if state is None:
+            state = self.order_archive.get(order_id)
+        return state
+
+    def _archive_order(self, order_id: int, state: dict):
+        """订单结束: 状态移入归档, 释放该订单的提示标记和未完成的计时."""
+        self.order_statuses.pop(order_id, None)
+        self.order_archive.put(order_id, state)
+        self._submitted_announced.discard(order_id)
+        self._partial_announced.discard(order_id)
+        self._placed_order_ids.discard(order_id)
+        self._modify_inflight.pop(order_id, None)
+        self.latency.discard(order_id)
+        for listener in self._order_finish_listeners:
+            listener(order_id)
+        now = time.monotonic()
+        self._finished_orders.append((now, order_id))
+        self._evict_finished_orders(now)
+
+    def _evict_finished_orders(self, now: float):
+        """清理结束超过 order_retention 秒的订单: 通知监听者 (删除订单细节)."""
+        while self._finished_orders and now - self._finished_orders[0][0] >= self.order_retention:
+            _, order_id = self._finished_orders.popleft()
+            for listener in self._order_evict_listeners:
+                listener(order_id)
+
+    def add_order_evict_listener(self, listener):
+        self._order_evict_listeners.append(listener)
+
+    def add_order_finish_listener(self, listener):
+        self._order_finish_listeners.append(listener)
+
+    def modify_pending(self, order_id: int) -> bool:
+        """该订单是否有已发出、尚未收到回报的改单 (超时未回报的不算)."""
+        sent_at = self._modify_inflight.get(order_id)
+        if sent_at is None:
+            return False
+        if time.monotonic() - sent_at > self.modify_ack_timeout:
+            self._modify_inflight.pop(order_id, None)
+            return False
+        return True
+
+    def add_modify_ack_listener(self, listener):
+        self._modify_ack_listeners.append(listener)
+
+    def _modify_acked(self, order_id):
+        if self._modify_inflight.pop(order_id, None) is None:
+            return
+        for listener in self._modify_ack_listeners:
+            listener(order_id)
+
+    def print_order_counters(self):
+        if not self.order_counters:
+            return
+        print("Order messages: " + ", ".join(f"{k}={v}" for k, v in sorted(self.order_counters.items())))
+
+    def _next_req_id(self, base: int) -> int:
+        return base + next(self._req_id_seq)
+
+    def _release_request(self, req_id: int):
+        """请求完成 (或超时) 后释放按 reqId 保存的状态."""
+        self._req_events.pop(req_id, None)
+        self._contract_details.pop(req_id, None)
+        self._sec_def_rows.pop(req_id, None)
+        self.market_data.pop(req_id, None)
+        self.quotes.close(req_id)
+        self.latency.discard(req_id)
+
+    def export_trace(self):
+        """设置了 trace_path (或 IB_TRACE_PATH) 时导出时间线, 返回写出的路径; 否则返回 None."""
+        if not self.trace_path:
+            return None
+        path = self.tracer.export(self.trace_path)
+        print(f"Trace written to {path}")
+        return path
+
+    def memory_usage(self) -> dict:
+        """各内部状态表的条目数与估算字节数, 用于监控长时间运行时的内存."""
+        tables = {
+            "market_data": self.market_data,
+            "contract_details": self._contract_details,
+            "req_events": self._req_events,
+            "order_statuses": self.order_statuses,
+            "market_rule_ids": self._market_rule_ids,
+            "latency_pending": dict(self.latency._pending),
+            "tick_listeners": self._tick_listeners,
+            "sec_def_rows": self._sec_def_rows,
+            "portfolio": self.portfolio._positions,
+        }
+        usage = {name: {"entries": len(t), "bytes": approx_size(t)} for name, t in tables.items()}
+        usage["order_archive"] = {"entries": len(self.order_archive),
+                                  "bytes": self.order_archive.approx_bytes()}
+        usage["quote_store"] = {"entries": len(self.quotes), "bytes": self.quotes.data.nbytes}
+        usage["trace_events"] = {"entries": self.tracer.event_count,
+                                 "bytes": approx_size(self.tracer._events)}
+        usage["total_bytes"] = sum(u["bytes"] for u in usage.values())
+        return usage
+
+    # 价格规则与限价对齐
+    def get_market_rule(self, rule_id: int, timeout: float = 3.0):
+        """返回价格规则 [(lowEdge, increment)], 每个规则只向 TWS 请求一次; 失败返回 None."""
+        rows = self.market_rules.get(rule_id)
+        if rows is not None:
+            return rows
+        with self._market_rule_lock:
+            ev = self._market_rule_events.get(rule_id)
+            first = ev is None
+            if first:
+                ev = self._market_rule_events[rule_id] = threading.Event()
+        if first:
+            self.reqMarketRule(rule_id)
+        ev.wait(timeout)
+        rows = self.market_rules.get(rule_id)
+        if rows is None and first:
+            # 超时: 允许下次重新请求
+            self._market_rule_events.pop(rule_id, None)
+        return rows
+
+    def price_increment(self, contract: Contract, price: float) -> Decimal:
+        """
+        合约在 price 价位上的最小变动价位.
+        一个合约可能在多个交易所有不同规则, 这里保守地取其中最大的变动价位,
+        保证对齐后的价格在任一规则下都合法; 没有规则信息时返回 0.01.
+        组合单 (BAG) 按净价报价, 只用组合自身的规则 (通常没有, 即 0.01), 不套用各腿的规则.
+        """
+        rule_ids = set()
+        for rule_id in self._market_rule_ids.get(contract.conId, "").split(","):
+            if rule_id.strip():
+                rule_ids.add(int(rule_id))
+        level = abs(Decimal(repr(price)))
+        increment = None
+        for rule_id in rule_ids:
+            rows = self.get_market_rule(rule_id)
+            if not rows:
+                continue
+            inc = rows[0][1]
+            for low_edge, rule_inc in rows:
+                if level >= low_edge:
+                    inc = rule_inc
+            increment = inc if increment is None else max(increment, inc)
+        return increment or DEFAULT_PRICE_INCREMENT
+
+    def snap_price(self, contract: Contract, price: float, direction: str = "nearest") -> float:
+        """把价格对齐到合约的最小变动价位; direction 为 "up" / "down" / "nearest"."""
+        return snap_to_increment(price, self.price_increment(contract, price), direction)
+
+    def subscribe_market_data(self, contract: Contract, listener=None) -> int:
+        """
+        订阅流式行情, 返回 reqId; 最新报价在 self.market_data[reqId] 中,
+        listener(reqId, field, price) 在每个价格推送时被调用 (EReader 线程, 应尽快返回).
+        """
+        req_id = self._next_req_id(6000000)
+        self.market_data[req_id] = {}
+        if listener is not None:
+            self._tick_listeners[req_id] = listener
+        self.reqMktData(req_id, contract, "", False, False, [])
+        return req_id
+
+    def unsubscribe_market_data(self, req_id: int):
+        self.cancelMktData(req_id)
+        self._tick_listeners.pop(req_id, None)
+        self._release_request(req_id)
+
     # 帮助方法
-    def resolve_contract(self, contract: Contract, req_id: int = None, timeout: float = 5.0):
-        """请求合约详情, 返回填充了 conId 的 Contract 对象."""
+    def request_contract_details(self, contract: Contract, req_id: int = None, timeout: float = 5.0) -> list:
+        """
+        请求合约详情, 返回全部匹配的 Contract (带 conId); 同时记录各合约的价格规则.
+        期权只给 symbol + 到期日时, 一次请求即可拿到整条链.
+        """
         if req_id is None:
-            req_id = 1000000 + (0 if self.next_order_id is None else self.next_order_id)
+            req_id = self._next_req_id(1000000)
         self._contract_details[req_id] = []
         ev = threading.Event()
         self._req_events[req_id] = ev
-        self.reqContractDetails(req_id, contract)
-        ev.wait(timeout)
+        with self.tracer.span(f"resolve {contract.symbol} {contract.right}{contract.strike}",
+                              secType=contract.secType,
+                              expiry=contract.lastTradeDateOrContractMonth):
+            self.reqContractDetails(req_id, contract)
+            ev.wait(timeout)
         details_list = self._contract_details.get(req_id, [])
+        self._release_request(req_id)
+        return details_list
+
+    def resolve_contract(self, contract: Contract, req_id: int = None, timeout: float = 5.0):
+        """请求合约详情, 返回填充了 conId 的 Contract 对象."""
+        details_list = self.request_contract_details(contract, req_id, timeout)
         if len(details_list) == 0:
             print(f"Contract details not found (reqId {req_id}).")
             return None
@@ -171,26 +642,111 @@ class IBApp(EWrapper, EClient):
             return first
         return details_list[0]
 
+    def sec_def_chain(self, underlying_symbol: str, underlying_sec_type: str, underlying_conId: int,
+                      timeout: float = 5.0):
+        """
+        期权链参数 (IBSecDefCache.SecDefChain), 当天第一次调用才真正请求 reqSecDefOptParams; 未取到时返回 None.
+        """
+        chain = self.sec_def_cache.get(underlying_conId) if self.sec_def_cache is not None else None
+        if chain is not None:
+            return chain
+        req_id = self._next_req_id(8000000)
+        self._sec_def_rows[req_id] = []
+        ev = threading.Event()
+        self._req_events[req_id] = ev
+        self.reqSecDefOptParams(req_id, underlying_symbol, "", underlying_sec_type, underlying_conId)
+        completed = ev.wait(timeout)
+        rows = self._sec_def_rows.get(req_id, [])
+        self._release_request(req_id)
+        if not rows:
+            return None
+        # 超时时结果可能不完整, 不写入缓存
+        if self.sec_def_cache is not None and completed:
+            return self.sec_def_cache.put(underlying_conId, rows)
+        return SecDefChain(rows)
+
     def get_market_snapshot(self, contract: Contract, req_id: int = None, timeout: float = 5.0):
         if req_id is None:
-            req_id = 5000000 + (0 if self.next_order_id is None else self.next_order_id)
+            req_id = self._next_req_id(5000000)
 
         self.market_data[req_id] = {}
         ev = threading.Event()
         self._req_events[req_id] = ev
 
-        # snapshot=True，向IB请求一次性快照
-        self.reqMktData(req_id, contract, "", True, False, [])
+        with self.tracer.span(f"snapshot {contract.symbol} {contract.right}{contract.strike}",
+                              conId=contract.conId):
+            # snapshot=True，向IB请求一次性快照
+            self.reqMktData(req_id, contract, "", True, False, [])
 
-        # 等待tickSnapshotEnd 或超时
-        ev.wait(timeout)
+            # 等待tickSnapshotEnd 或超时
+            completed = ev.wait(timeout)
 
         data = self.market_data.get(req_id, {})
-        
-        # 对于快照，这里就不cancelMktData了
+        # 期权快照附带 IB 的模型值 (iv / delta / gamma / vega / theta / opt_price / und_price)
+        data.update(self.quotes.greeks(req_id))
+
+        # 对于快照，正常结束时不需要cancelMktData; 超时则取消, 避免之后还有迟到的推送
+        if not completed:
+            self.cancelMktData(req_id)
+        self._release_request(req_id)
         return data
 
 
+def snap_to_increment(price: float, increment: Decimal, direction: str = "nearest") -> float:
+    """
+    用十进制运算把 price 对齐到 increment 的整数倍, 避免 1.0799999 这类浮点价格被 IB 拒绝.
+    direction: "up" 向上取整, "down" 向下取整, "nearest" 四舍五入.
+    """
+    ticks = Decimal(repr(price)) / increment
+    # 与整数价位相差不到万分之一个价位的视为浮点误差, 直接取该价位, 否则 1.0799999 向下取整会得到 1.07
+    nearest = ticks.to_integral_value(rounding=ROUND_HALF_UP)
+    if abs(ticks - nearest) < SNAP_TOLERANCE_TICKS:
+        ticks = nearest
+    else:
+        rounding = {"up": ROUND_CEILING, "down": ROUND_FLOOR}.get(direction, ROUND_HALF_UP)
+        ticks = ticks.to_integral_value(rounding=rounding)
+    return float(ticks * increment)
+
+
+def next_chase_price(action: str, current_price: float, step: float, final_price: float) -> float:
+    """
+    追价的下一档价格: 朝 final_price 方向移动一个 step, 越过则取 final_price.
+    BUY单： 若 final_price > current，则加价；若更低则减价
+    SELL单： 若 final_price < current，则减价；若更高则加价
+    返回值等于 current_price 时表示已到达 final_price.
+    (纯函数, 供追价线程和 IBChaseBacktest 离线回测共用)
+    """
+    if action.upper() == "BUY":
+        direction = 1 if final_price > current_price else -1
+    else:
+        direction = -1 if final_price < current_price else 1
+    candidate_price = current_price + direction * step
+    # 如果越过final_price，就设为final_price
+    if direction > 0 and candidate_price > final_price:
+        candidate_price = final_price
+    elif direction < 0 and candidate_price < final_price:
+        candidate_price = final_price
+    return candidate_price
+
+
+def snap_chase_price(snap, current_price: float, new_price: float, final_price: float) -> float:
+    """
+    追价价格对齐: 朝移动方向取整 (保证每一步至少前进一个价位),
+    但不越过按反方向取整后的 final_price; 返回 current_price 表示已无法继续追价.
+    snap(price, direction) 把价格对齐到最小变动价位, 实盘为 IBApp.snap_price, 离线回测为固定价位.
+    (纯函数, 供追价线程和 IBChaseBacktest 离线回测共用)
+    """
+    if new_price > current_price:
+        snapped = snap(new_price, "up")
+        limit = snap(final_price, "down")
+        return max(current_price, min(snapped, limit))
+    if new_price < current_price:
+        snapped = snap(new_price, "down")
+        limit = snap(final_price, "up")
+        return min(current_price, max(snapped, limit))
+    return new_price
+
+
 class OrderManager:
     """订单管理器, 提供高层交易功能封装"""
     def __init__(self, app: IBApp):
@@ -203,12 +759,118 @@ class OrderManager:
         # 存储订单细节 (用于后续追价或修改)
         self._order_details = {}
 
+        # 改单合并: 上一次改单尚未回报时只更新目标价, 收到回报后由发送线程补发最新价格
+        self._deferred_modifications = set()
+        self._modify_lock = threading.Lock()
+        self._modify_queue = queue.Queue()
+        self.app.add_modify_ack_listener(self._on_modify_ack)
+        # 订单结束时丢弃推迟的改单
+        self.app.add_order_finish_listener(self._on_order_finished)
+        # 订单结束一段时间后 (IBApp.order_retention) 删除其订单细节
+        self.app.add_order_evict_listener(self._on_order_evicted)
+        threading.Thread(target=self._modify_sender, daemon=True).start()
+
     def _get_next_order_id(self):
         with self._order_id_lock:
             oid = self._order_id
             self._order_id += 1
             return oid
 
+    def _snap_limit_price(self, contract, action: str, limit_price: float) -> float:
+        """下单限价对齐到最小变动价位: 买单向下、卖单向上取整, 不会比给定价格更差."""
+        snapped = self.app.snap_price(contract, limit_price, "down" if action == "BUY" else "up")
+        if abs(snapped - limit_price) > 1e-9:
+            print(f"Limit price {limit_price} snapped to {snapped} (price increment rule).")
+        return snapped
+
+    def _snap_chase_price(self, contract, current_price: float, new_price: float,
+                          final_price: float) -> float:
+        """按合约的最小变动价位对齐追价价格, 规则见 snap_chase_price."""
+        return snap_chase_price(functools.partial(self.app.snap_price, contract), current_price, new_price,
+                                final_price)
+
+    def modify_order(self, order_id: int, new_price: float) -> bool:
+        """
+        把限价单改到 new_price.
+        若该订单上一次改单还没有回报, 则只记录目标价, 等回报到达后再发出 (期间多次改价合并为最后一次);
+        立即发出返回 True, 被推迟返回 False.
+        """
+        details = self._order_details.get(order_id)
+        if not details:
+            return False
+        with self._modify_lock:
+            details["limit_price"] = new_price
+            if self.app.modify_pending(order_id):
+                if order_id in self._deferred_modifications:
+                    # 之前推迟的目标价被新的目标价覆盖
+                    self.app.order_counters["modify_coalesced"] += 1
+                else:
+                    self._deferred_modifications.add(order_id)
+                    self.app.order_counters["modify_deferred"] += 1
+                return False
+            # 上一次改单回报超时: 直接发出最新价格, 之前推迟的目标价随之作废
+            self._deferred_modifications.discard(order_id)
+        self._send_modification(order_id, details)
+        return True
+
+    def _send_modification(self, order_id: int, details: dict):
+        new_price = details["limit_price"]
+        mod_order = Order()
+        mod_order.action = details["action"]
+        mod_order.orderType = "LMT"
+        mod_order.totalQuantity = details["quantity"]
+        mod_order.lmtPrice = new_price
+        with self.app.tracer.span("reprice", f"order {order_id}",
+                                  old=details.get("sent_price"), new=new_price):
+            self.app.placeOrder(order_id, details["contract"], mod_order)
+        details["sent_price"] = new_price
+
+    def _on_modify_ack(self, order_id: int):
+        # 在 EReader 线程中调用, 只做登记, 实际发送交给 _modify_sender
+        with self._modify_lock:
+            if order_id not in self._deferred_modifications:
+                return
+            self._deferred_modifications.discard(order_id)
+        self._modify_queue.put(order_id)
+
+    def _on_order_finished(self, order_id: int):
+        with self._modify_lock:
+            self._deferred_modifications.discard(order_id)
+
+    def _on_order_evicted(self, order_id: int):
+        self._order_details.pop(order_id, None)
+
+    def _flush_lost_acks(self):
+        """改单回报超过 modify_ack_timeout 仍未到达: 不再等待, 把推迟的目标价交给发送线程."""
+        with self._modify_lock:
+            lost = [oid for oid in self._deferred_modifications if not self.app.modify_pending(oid)]
+            self._deferred_modifications.difference_update(lost)
+        for order_id in lost:
+            self.app.order_counters["modify_ack_lost"] += 1
+            self._modify_queue.put(order_id)
+
+    def _modify_sender(self):
+        poll = max(0.05, self.app.modify_ack_timeout / 4)
+        last_flush = time.monotonic()
+        while True:
+            try:
+                order_id = self._modify_queue.get(timeout=poll)
+            except queue.Empty:
+                order_id = None
+            if time.monotonic() - last_flush >= poll:
+                last_flush = time.monotonic()
+                self._flush_lost_acks()
+            if order_id is None:
+                continue
+            details = self._order_details.get(order_id)
+            status_info = self.app.get_order_status(order_id) or {}
+            if not details or status_info.get("status") in TERMINAL_STATUSES:
+                continue
+            try:
+                self._send_modification(order_id, details)
+            except Exception as e:
+                print(f"Order {order_id}: deferred modify failed: {e}")
+
     def place_option_order(self, legs, order_type="LMT", limit_price=0.0):
         """
         下单:
@@ -220,8 +882,11 @@ class OrderManager:
           - action: "BUY" 或 "SELL"
           - quantity: 数量(手)
           - 可选: secType, exchange, currency, multiplier
+          - 可选: conId (如 IBStrategyBuilder 生成的腿), 给出时不再请求合约详情
         order_type: "LMT" / "MKT"
         limit_price: 限价(多腿净价)
+        多腿组合的方向以第一腿为准: 第一腿为 SELL 时整张组合按 SELL 下单, limit_price 为收到的净价
+        (例如卖出铁鹰收 1.20 即 limit_price=1.20), 各腿仍按 legs 中给出的方向成交.
         返回订单ID
         """
         num_legs = len(legs)
@@ -242,9 +907,12 @@ class OrderManager:
             contract.right = leg['right']
             contract.multiplier = leg.get('multiplier', "100")
 
-            resolved_contract = self.app.resolve_contract(contract)
-            if resolved_contract:
-                contract = resolved_contract
+            if leg.get('conId'):
+                contract.conId = int(leg['conId'])
+            else:
+                resolved_contract = self.app.resolve_contract(contract)
+                if resolved_contract:
+                    contract = resolved_contract
 
             total_quantity = leg['quantity']
             order_action = leg['action'].upper()
@@ -253,6 +921,7 @@ class OrderManager:
             order.totalQuantity = total_quantity
             order.orderType = order_type.upper()
             if order.orderType == "LMT":
+                limit_price = self._snap_limit_price(contract, order_action, limit_price)
                 order.lmtPrice = limit_price
 
             order_id = self._get_next_order_id()
@@ -260,12 +929,14 @@ class OrderManager:
                   f"{leg['underlying']} {leg['right']}{leg['strike']}@{leg['lastTradeDate']}, "
                   f"Price={'MKT' if order.orderType != 'LMT' else limit_price}")
 
-            self.app.placeOrder(order_id, contract, order)
+            with self.app.tracer.span("place", f"order {order_id}", legs=1, lmtPrice=order.lmtPrice):
+                self.app.placeOrder(order_id, contract, order)
             self._order_details[order_id] = {
                 "contract": contract,
                 "action": order.action,
                 "type": order.orderType,
                 "limit_price": (order.lmtPrice if order.orderType == "LMT" else None),
+                "sent_price": (order.lmtPrice if order.orderType == "LMT" else None),
                 "quantity": order.totalQuantity
             }
             return order_id
@@ -282,26 +953,29 @@ class OrderManager:
                     print("Error: All legs must have the same underlying symbol for combo orders.")
                     return None
 
-                contract = Contract()
-                contract.symbol = leg['underlying']
-                contract.secType = leg.get('secType', "OPT")
-                contract.exchange = leg.get('exchange', "SMART")
-                contract.currency = leg.get('currency', "USD")
-                contract.lastTradeDateOrContractMonth = leg['lastTradeDate']
-                contract.strike = float(leg['strike'])
-                contract.right = leg['right']
-                contract.multiplier = leg.get('multiplier', "100")
-
-                resolved = self.app.resolve_contract(contract)
-                if not resolved:
-                    print(f"Leg {idx}: contract resolution failed, aborting combo order.")
-                    return None
-
                 combo_leg = ComboLeg()
-                combo_leg.conId = resolved.conId
+                if leg.get('conId'):
+                    combo_leg.conId = int(leg['conId'])
+                    combo_leg.exchange = leg.get('exchange', "SMART")
+                else:
+                    contract = Contract()
+                    contract.symbol = leg['underlying']
+                    contract.secType = leg.get('secType', "OPT")
+                    contract.exchange = leg.get('exchange', "SMART")
+                    contract.currency = leg.get('currency', "USD")
+                    contract.lastTradeDateOrContractMonth = leg['lastTradeDate']
+                    contract.strike = float(leg['strike'])
+                    contract.right = leg['right']
+                    contract.multiplier = leg.get('multiplier', "100")
+
+                    resolved = self.app.resolve_contract(contract)
+                    if not resolved:
+                        print(f"Leg {idx}: contract resolution failed, aborting combo order.")
+                        return None
+                    combo_leg.conId = resolved.conId
+                    combo_leg.exchange = resolved.exchange if resolved.exchange else leg.get('exchange', "SMART")
                 combo_leg.ratio = int(leg['quantity'])
                 combo_leg.action = leg['action'].upper()
-                combo_leg.exchange = resolved.exchange if resolved.exchange else leg.get('exchange', "SMART")
                 combo_legs.append(combo_leg)
                 total_leg_quantities.append(int(leg['quantity']))
 
@@ -324,27 +998,96 @@ class OrderManager:
 
             # 组合单顶层 action: 以第一腿的 action 为基准
             order_action = "BUY" if legs[0]['action'].upper() == "BUY" else "SELL"
+            if order_action == "SELL":
+                # IB 对 SELL 的组合单会把每条腿的方向反过来, 这里先反一次, 使实际成交方向与 legs 一致
+                for combo_leg in combo_legs:
+                    combo_leg.action = "BUY" if combo_leg.action == "SELL" else "SELL"
             order = Order()
             order.action = order_action
             order.totalQuantity = total_quantity
             order.orderType = order_type.upper()
             if order.orderType == "LMT":
+                limit_price = self._snap_limit_price(combo_contract, order_action, limit_price)
                 order.lmtPrice = limit_price
 
             order_id = self._get_next_order_id()
             print(f"Placing combo order (ID {order_id}): {order.action} {total_quantity}x Combo {underlying_symbol}, "
                   f"Price={'MKT' if order.orderType != 'LMT' else limit_price}")
 
-            self.app.placeOrder(order_id, combo_contract, order)
+            with self.app.tracer.span("place", f"order {order_id}", legs=num_legs,
+                                      lmtPrice=order.lmtPrice):
+                self.app.placeOrder(order_id, combo_contract, order)
             self._order_details[order_id] = {
                 "contract": combo_contract,
                 "action": order.action,
                 "type": order.orderType,
                 "limit_price": (order.lmtPrice if order.orderType == "LMT" else None),
+                "sent_price": (order.lmtPrice if order.orderType == "LMT" else None),
                 "quantity": order.totalQuantity
             }
             return order_id
 
+    def place_stock_order(self, symbol: str, action: str, quantity: int, order_type: str = "LMT",
+                          limit_price: float = 0.0, exchange: str = "SMART", currency: str = "USD"):
+        """下股票单 (例如对冲标的 delta), 返回订单ID; 合约解析失败返回 None."""
+        contract = Contract()
+        contract.symbol = symbol
+        contract.secType = "STK"
+        contract.exchange = exchange
+        contract.currency = currency
+        resolved_contract = self.app.resolve_contract(contract)
+        if resolved_contract is None:
+            print(f"Stock {symbol}: contract resolution failed.")
+            return None
+        contract = resolved_contract
+
+        order = Order()
+        order.action = action.upper()
+        order.totalQuantity = quantity
+        order.orderType = order_type.upper()
+        if order.orderType == "LMT":
+            limit_price = self._snap_limit_price(contract, order.action, limit_price)
+            order.lmtPrice = limit_price
+
+        order_id = self._get_next_order_id()
+        print(f"Placing stock order (ID {order_id}): {order.action} {quantity} {symbol}, "
+              f"Price={'MKT' if order.orderType != 'LMT' else limit_price}")
+        with self.app.tracer.span("place", f"order {order_id}", legs=0, lmtPrice=order.lmtPrice):
+            self.app.placeOrder(order_id, contract, order)
+        self._order_details[order_id] = {
+            "contract": contract,
+            "action": order.action,
+            "type": order.orderType,
+            "limit_price": (order.lmtPrice if order.orderType == "LMT" else None),
+            "sent_price": (order.lmtPrice if order.orderType == "LMT" else None),
+            "quantity": order.totalQuantity
+        }
+        return order_id
+
+    def place_legged_order(self, legs, init_price: float, final_price: float, step: float,
+                           interval: float = 5.0, **options):
+        """
+        分腿模式: 不下 BAG 单, 先并行成交价差小的腿, 再在剩余净价预算内追其余的腿.
+        init_price / final_price 为每组合单位的净价 (BUY 腿为正, SELL 腿为负);
+        其余参数见 IBLegging.LeggedOrder. 返回已启动的 LeggedOrder, 用 join() 等待结果.
+        """
+        from IBLegging import LeggedOrder
+        legged = LeggedOrder(self, legs, init_price, final_price, step, interval, **options)
+        legged.start()
+        return legged
+
+    def place_sliced_order(self, legs, init_price: float, final_price: float, step: float,
+                           interval: float = 5.0, mode: str = "twap", **options):
+        """
+        拆单模式: 把 legs 的总数量拆成多个子单 (mode="twap" 均匀拆分, "adaptive" 跟随盘口挂单量),
+        每个子单各自追价, 母单整体均价不差于 final_price. 其余参数见 IBSlicing.SlicedOrder.
+        返回已启动的 SlicedOrder, 用 join() 等待结果.
+        """
+        from IBSlicing import SlicedOrder
+        sliced = SlicedOrder(self, legs, init_price, final_price, step, interval, mode=mode, **options)
+        sliced.start()
+        return sliced
+
     def chase_order_to_final(self, order_id: int,
                              step: float,
                              final_price: float,
@@ -357,13 +1100,15 @@ class OrderManager:
         def _chase_logic(order_id, step, final_price, interval):
             while True:
                 time.sleep(interval)
-                status_info = self.app.order_statuses.get(order_id)
+                status_info = self.app.get_order_status(order_id)
                 if not status_info:
                     continue
                 status = status_info.get("status")
                 remaining = status_info.get("remaining", 0)
-                if status in ("Filled", "Cancelled", "ApiCanceled") or remaining == 0:
+                if status in TERMINAL_STATUSES or remaining == 0:
                     print(f"Chase-to-final: Order {order_id} completed or cancelled, stop chasing.")
+                    # 订单已结束, 追价所需的订单细节也不再需要
+                    self._order_details.pop(order_id, None)
                     break
 
                 details = self._order_details.get(order_id)
@@ -379,25 +1124,8 @@ class OrderManager:
                 order_action = details["action"].upper()
 
                 # 根据 BUY/SELL 和 final_price 与 current_price 的大小关系计算 new_price
-                new_price = current_price
-                if order_action == "BUY":
-                    direction = 1 if final_price > current_price else -1
-                    candidate_price = current_price + direction * step
-                    # 如果越过final_price，就设为final_price
-                    if direction > 0 and candidate_price > final_price:
-                        candidate_price = final_price
-                    elif direction < 0 and candidate_price < final_price:
-                        candidate_price = final_price
-                    new_price = candidate_price
-                else:
-                    # SELL
-                    direction = -1 if final_price < current_price else 1
-                    candidate_price = current_price + direction * step
-                    if direction > 0 and candidate_price > final_price:
-                        candidate_price = final_price
-                    elif direction < 0 and candidate_price < final_price:
-                        candidate_price = final_price
-                    new_price = candidate_price
+                new_price = next_chase_price(order_action, current_price, step, final_price)
+                new_price = self._snap_chase_price(details["contract"], current_price, new_price, final_price)
 
                 # 如果已经到达final_price，则停止
                 if abs(new_price - current_price) < 1e-10:
@@ -405,17 +1133,11 @@ class OrderManager:
                     break
 
                 # 提交新价格
-                details["limit_price"] = new_price
-                self._order_details[order_id] = details
-
                 print(f"Chase-to-final: Adjusting price from {current_price:.2f} to {new_price:.2f}")
-                mod_order = Order()
-                mod_order.action = order_action
-                mod_order.orderType = "LMT"
-                mod_order.totalQuantity = details["quantity"]
-                mod_order.lmtPrice = new_price
                 try:
-                    self.app.placeOrder(order_id, details["contract"], mod_order)
+                    if not self.modify_order(order_id, new_price):
+                        print(f"Chase-to-final: Previous modify of order {order_id} not acknowledged yet, "
+                              f"{new_price:.2f} will be sent after the ack.")
                 except Exception as e:
                     print(f"Chase-to-final: Order modify failed: {e}")
                     break
@@ -438,7 +1160,7 @@ if __name__ == "__main__":
     print("Connecting to IB API...")
     try:
         # 真实账户常用7496，纸交易常用7497
-        app.connect("127.0.0.1", 7496, clientId=1)
+        app.connect(TWS_HOST, TWS_PORT, clientId=1)
     except Exception as e:
         print("Could not connect to IB API:", e)
         sys.exit(1)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+已结束订单 (Filled / Cancelled) 的有界归档, 以及估算内存占用的小工具.
+长时间运行的进程里, 订单结束后把状态从活动表移到这里, 按条数 (LRU) 和存活时间 (TTL) 淘汰.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class OrderArchive:
+    """
+    orderId -> 最终状态 dict.
+    max_entries: 最多保留的订单数, 超出时淘汰最久未访问的;
+    ttl: 归档后保留的秒数, None 表示不按时间淘汰.
+    回调线程写入、下单/追价线程读取, 内部加锁.
+    """
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # orderId -> (归档时间 monotonic, 状态)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def put(self, order_id, state: dict):
+        with self._lock:
+            self._entries[order_id] = (time.monotonic(), state)
+            self._entries.move_to_end(order_id)
+            self._prune_locked()
+
+    def get(self, order_id, default=None):
+        with self._lock:
+            item = self._entries.get(order_id)
+            if item is None:
+                return default
+            if self._expired(item[0], time.monotonic()):
+                del self._entries[order_id]
+                self.evicted += 1
+                return default
+            self._entries.move_to_end(order_id)
+            return item[1]
+
+    def __contains__(self, order_id) -> bool:
+        return self.get(order_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def prune(self) -> int:
+        """淘汰过期和超量的条目, 返回淘汰数量."""
+        with self._lock:
+            return self._prune_locked()
+
+    def _expired(self, archived_at: float, now: float) -> bool:
+        return self.ttl is not None and now - archived_at > self.ttl
+
+    def _prune_locked(self) -> int:
+        removed = 0
+        now = time.monotonic()
+        # OrderedDict 按访问顺序排列, 头部是最久未访问的
+        while self._entries:
+            order_id, (archived_at, _) = next(iter(self._entries.items()))
+            if len(self._entries) > self.max_entries or self._expired(archived_at, now):
+                del self._entries[order_id]
+                removed += 1
+            else:
+                break
+        self.evicted += removed
+        return removed
+
+    def approx_bytes(self) -> int:
+        with self._lock:
+            return approx_size(self._entries)
+
+
+def approx_size(obj, _depth: int = 0) -> int:
+    """
+    递归估算 dict / list / tuple / set / deque 及其元素的内存占用 (字节).
+    只用于内存监控, 共享对象会被重复计算, 深度超过 4 层的不再展开.
+    """
+    size = sys.getsizeof(obj)
+    if _depth >= 4:
+        return size
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += approx_size(k, _depth + 1) + approx_size(v, _depth + 1)
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        for item in obj:
+            size += approx_size(item, _depth + 1)
+    return size
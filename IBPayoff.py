@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多腿组合的盈亏曲面: 用向量化的 Black-Scholes 在 标的价 x 日期 x IV 平移 的网格上
+一次算出整个组合的盈亏, 并给出最大亏损 / 最大盈利 / 盈亏平衡点.
+
+不同到期日的腿 (如 IBOption4Leg 的双对角) 在近月到期日按内在价值结算, 远月腿仍按剩余时间估值.
+结果按腿签名 (到期日, 行权价, 方向, 数量...) 与网格参数缓存, 同一组合重复预览时直接复用;
+每条腿在网格上的理论价也单独缓存, 只是建仓成本、数量变化或换掉部分腿时, 未变的腿不必重算.
+
+用法:
+    surface = surface_from_quotes(legs, spot, mids, entry_cost)
+    print_summary(surface)
+"""
+
+import datetime
+import math
+from functools import lru_cache
+
+import numpy as np
+
+# 默认的 IV 平移 (绝对波动率点) 与网格密度
+DEFAULT_IV_SHIFTS = (-0.10, -0.05, 0.0, 0.05, 0.10)
+DEFAULT_PRICE_POINTS = 501
+DEFAULT_DATE_POINTS = 8
+MIN_VOL = 0.01
+
+
+# 标准正态分布函数表: [-8, 8] 步长 0.001, 线性插值误差 < 1e-7, 超出范围按 0 / 1 处理
+_CDF_LOW, _CDF_STEP = -8.0, 0.001
+_CDF_Y = 0.5 * np.array([math.erfc(-(_CDF_LOW + i * _CDF_STEP) / math.sqrt(2.0)) for i in range(16002)])
+# 相邻表项之差, 插值时少取一次表
+_CDF_DY = np.append(np.diff(_CDF_Y), 0.0)
+
+
+def norm_cdf(x):
+    """
+    标准正态分布函数: 等距查表 + 线性插值, 下标直接算出, 不做二分查找,
+    比逐点计算 erf (或 np.interp) 快得多且不依赖 scipy.
+    """
+    # 就地运算, 大数组上少分配几个临时数组
+    pos = np.subtract(x, _CDF_LOW, out=np.empty(np.shape(x)))
+    pos *= 1.0 / _CDF_STEP
+    np.clip(pos, 0.0, len(_CDF_Y) - 2.0, out=pos)
+    idx = pos.astype(np.intp)
+    pos -= idx
+    pos *= _CDF_DY.take(idx)
+    pos += _CDF_Y.take(idx)
+    return pos if pos.ndim else pos[()]
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * np.square(x)) / math.sqrt(2.0 * math.pi)
+
+
+def bs_price(spot, strike, t, vol, is_call, rate: float = 0.0):
+    """
+    向量化的 Black-Scholes 理论价, 参数可以是任意可广播的数组.
+    t <= 0 或 vol <= 0 时返回内在价值.
+    """
+    spot, strike, t, vol, is_call = np.broadcast_arrays(
+        np.asarray(spot, dtype=float), np.asarray(strike, dtype=float),
+        np.asarray(t, dtype=float), np.asarray(vol, dtype=float), np.asarray(is_call, dtype=bool))
+    intrinsic = np.where(is_call, np.maximum(spot - strike, 0.0), np.maximum(strike - spot, 0.0))
+    live = (t > 0) & (vol > 0) & (spot > 0)
+    t_ = np.where(live, t, 1.0)
+    vol_ = np.where(live, vol, 1.0)
+    spot_ = np.where(live, spot, 1.0)
+    sqrt_t = np.sqrt(t_)
+    d1 = (np.log(spot_ / strike) + (rate + 0.5 * vol_ * vol_) * t_) / (vol_ * sqrt_t)
+    d2 = d1 - vol_ * sqrt_t
+    disc = strike * np.exp(-rate * t_)
+    call = spot_ * norm_cdf(d1) - disc * norm_cdf(d2)
+    put = disc * norm_cdf(-d2) - spot_ * norm_cdf(-d1)
+    return np.where(live, np.where(is_call, call, put), intrinsic)
+
+
+def bs_delta(spot, strike, t, vol, is_call, rate: float = 0.0):
+    """
+    向量化的 Black-Scholes delta (每股), 参数可以是任意可广播的数组.
+    t <= 0 或 vol <= 0 时按到期处理: 实值为 ±1, 虚值为 0.
+    """
+    spot, strike, t, vol, is_call = np.broadcast_arrays(
+        np.asarray(spot, dtype=float), np.asarray(strike, dtype=float),
+        np.asarray(t, dtype=float), np.asarray(vol, dtype=float), np.asarray(is_call, dtype=bool))
+    live = (t > 0) & (vol > 0)
+    t_ = np.where(live, t, 1.0)
+    vol_ = np.where(live, vol, 1.0)
+    sig_sqrt_t = vol_ * np.sqrt(t_)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * vol_ * vol_) * t_) / sig_sqrt_t
+    call = np.where(live, norm_cdf(d1), (spot > strike).astype(float))
+    return np.where(is_call, call, call - 1.0)
+
+
+def bs_greeks(spot, strike, t, vol, is_call, rate: float = 0.0) -> dict:
+    """
+    向量化的 delta / gamma / vega (每 1 个波动率点) / theta (每日历日), 均为每股.
+    t <= 0 或 vol <= 0 时 gamma / vega / theta 为 0.
+    """
+    spot, strike, t, vol, is_call = np.broadcast_arrays(
+        np.asarray(spot, dtype=float), np.asarray(strike, dtype=float),
+        np.asarray(t, dtype=float), np.asarray(vol, dtype=float), np.asarray(is_call, dtype=bool))
+    live = (t > 0) & (vol > 0)
+    t_ = np.where(live, t, 1.0)
+    vol_ = np.where(live, vol, 1.0)
+    sqrt_t = np.sqrt(t_)
+    sig_sqrt_t = vol_ * sqrt_t
+    d1 = (np.log(spot / strike) + (rate + 0.5 * vol_ * vol_) * t_) / sig_sqrt_t
+    d2 = d1 - sig_sqrt_t
+    pdf = norm_pdf(d1)
+    cdf_d1 = norm_cdf(d1)
+    disc = strike * np.exp(-rate * t_)
+    call_delta = np.where(live, cdf_d1, (spot > strike).astype(float))
+    # theta: 看涨 -S*pdf*sigma/(2*sqrt(t)) - r*K*e^(-rt)*N(d2), 看跌把 N(d2) 换成 -N(-d2)
+    decay = -spot * pdf * vol_ / (2.0 * sqrt_t)
+    carry = rate * disc * np.where(is_call, norm_cdf(d2), norm_cdf(d2) - 1.0)
+    return {
+        "delta": np.where(is_call, call_delta, call_delta - 1.0),
+        "gamma": np.where(live, pdf / (spot * sig_sqrt_t), 0.0),
+        "vega": np.where(live, spot * pdf * sqrt_t / 100.0, 0.0),
+        "theta": np.where(live, (decay - carry) / 365.0, 0.0),
+    }
+
+
+def implied_vol(price, spot, strike, t, is_call, rate: float = 0.0,
+                low: float = 1e-4, high: float = 5.0, iterations: int = 30, tol: float = 1e-8):
+    """
+    向量化求隐含波动率: 牛顿法, 步子跳出 [low, high] 区间时退回二分.
+    价格低于内在价值时返回 low, 高于上限时返回 high.
+    """
+    price, spot, strike, t, is_call = np.broadcast_arrays(
+        np.asarray(price, dtype=float), np.asarray(spot, dtype=float), np.asarray(strike, dtype=float),
+        np.asarray(t, dtype=float), np.asarray(is_call, dtype=bool))
+    lo = np.full(price.shape, low)
+    hi = np.full(price.shape, high)
+    vol = np.full(price.shape, 0.5)
+    sqrt_t = np.sqrt(np.maximum(t, 1e-12))
+    for _ in range(iterations):
+        diff = bs_price(spot, strike, t, vol, is_call, rate) - price
+        if np.all(np.abs(diff) < tol):
+            break
+        hi = np.where(diff > 0, vol, hi)
+        lo = np.where(diff > 0, lo, vol)
+        d1 = (np.log(spot / strike) + (rate + 0.5 * vol * vol) * t) / (vol * sqrt_t)
+        vega = spot * norm_pdf(d1) * sqrt_t
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            newton = vol - diff / vega
+        vol = np.where((newton > lo) & (newton < hi), newton, 0.5 * (lo + hi))
+    return vol
+
+
+def _parse_date(value) -> datetime.date:
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(str(value)[:8], "%Y%m%d").date()
+
+
+def leg_signature(legs) -> tuple:
+    """腿的可哈希签名: (到期日, 行权价, C/P, 带方向的数量, 乘数), 作为缓存键的一部分."""
+    signature = []
+    for leg in legs:
+        sign = 1 if leg['action'].upper() == "BUY" else -1
+        signature.append((
+            str(leg['lastTradeDate'])[:8],
+            float(leg['strike']),
+            leg['right'].upper()[0],
+            sign * int(leg['quantity']),
+            float(leg.get('multiplier', 100)),
+        ))
+    return tuple(signature)
+
+
+class PayoffSurface:
+    """
+    pnl[v, d, i]: IV 平移 iv_shifts[v]、日期 dates[d]、标的价 prices[i] 时整个组合的盈亏 (美元).
+    dates 的最后一个是最近的到期日; 汇总 (最大亏损/盈利、盈亏平衡点) 取该日、IV 不平移的切片.
+    """
+    def __init__(self, signature, prices, dates, iv_shifts, pnl, entry_cost):
+        self.signature = signature
+        self.prices = prices
+        self.dates = dates
+        self.iv_shifts = iv_shifts
+        self.pnl = pnl
+        self.entry_cost = entry_cost
+        base = iv_shifts.index(0.0) if 0.0 in iv_shifts else len(iv_shifts) // 2
+        self.expiry_pnl = pnl[base, -1]
+        self.max_loss = float(self.expiry_pnl.min())
+        self.max_gain = float(self.expiry_pnl.max())
+        self.breakevens = _zero_crossings(prices, self.expiry_pnl)
+        # 标的价趋于无穷时的斜率 (每 1 美元标的价变动的盈亏), 非零说明上方盈亏无界
+        self.upside_slope = sum(qty * mult for _, _, right, qty, mult in signature if right == "C")
+
+    def at(self, date_index: int = -1, iv_shift: float = 0.0):
+        """取某个日期、某个 IV 平移下的盈亏曲线."""
+        return self.pnl[self.iv_shifts.index(iv_shift), date_index]
+
+
+def _zero_crossings(prices, pnl) -> list:
+    """盈亏曲线过零点, 相邻网格点之间线性插值."""
+    sign = np.sign(pnl)
+    idx = np.nonzero(sign[:-1] * sign[1:] < 0)[0]
+    x0, x1 = prices[idx], prices[idx + 1]
+    y0, y1 = pnl[idx], pnl[idx + 1]
+    crossings = x0 - y0 * (x1 - x0) / (y1 - y0)
+    # 恰好落在网格点上的零值
+    exact = prices[1:-1][(sign[1:-1] == 0) & (sign[:-2] != 0)]
+    return sorted(round(float(x), 4) for x in np.concatenate([crossings, exact]))
+
+
+def payoff_surface(legs, spot: float, vols, entry_cost: float, today=None,
+                   price_range: float = 0.5, price_points: int = DEFAULT_PRICE_POINTS,
+                   date_points: int = DEFAULT_DATE_POINTS, iv_shifts=DEFAULT_IV_SHIFTS,
+                   rate: float = 0.0) -> PayoffSurface:
+    """
+    legs: 与 place_option_order 相同格式 (lastTradeDate / strike / right / action / quantity).
+    vols: 每条腿的隐含波动率 (列表) 或统一的一个值.
+    entry_cost: 建仓净成本 (美元, 正=花费, 负=收到), 与预览中的 Estimated combo total cost 一致.
+    price_range: 标的价网格覆盖 spot x (1 ± price_range).
+    """
+    signature = leg_signature(legs)
+    if np.ndim(vols) == 0:
+        vols = [float(vols)] * len(legs)
+    today = _parse_date(today or datetime.date.today())
+    return _cached_surface(signature, round(float(spot), 4), tuple(round(float(v), 6) for v in vols),
+                           round(float(entry_cost), 4), today, float(price_range), int(price_points),
+                           int(date_points), tuple(float(s) for s in iv_shifts), float(rate))
+
+
+@lru_cache(maxsize=256)
+def _cached_surface(signature, spot, vols, entry_cost, today, price_range, price_points,
+                    date_points, iv_shifts, rate) -> PayoffSurface:
+    expiries = [_parse_date(leg[0]) for leg in signature]
+    horizon = min(expiries)
+    days = max((horizon - today).days, 0)
+    offsets = np.unique(np.linspace(0, days, max(1, date_points)).round().astype(int))
+    dates = [today + datetime.timedelta(days=int(d)) for d in offsets]
+    grid = (max(spot * (1 - price_range), 0.01), spot * (1 + price_range), price_points)
+    prices = np.linspace(*grid)
+
+    pnl = np.full((len(iv_shifts), len(dates), len(prices)), -entry_cost)
+    for (_, strike, right, qty, mult), exp, vol in zip(signature, expiries, vols):
+        # 各腿在每个网格日期的剩余年数
+        years = tuple(max((exp - d).days, 0) / 365.0 for d in dates)
+        value = _leg_values(strike, right == "C", years, vol, iv_shifts, grid, rate)
+        pnl += (qty * mult) * value
+    prices.setflags(write=False)
+    pnl.setflags(write=False)
+    return PayoffSurface(signature, prices, dates, list(iv_shifts), pnl, entry_cost)
+
+
+# 每项为 (IV 平移 x 日期 x 标的价) 的数组, 默认网格约 160 KB, 数量不宜过多
+@lru_cache(maxsize=64)
+def _leg_values(strike, is_call, years, vol, iv_shifts, grid, rate) -> np.ndarray:
+    """
+    一张期权 (每股) 在网格上的理论价, 维度 (IV 平移, 日期, 标的价); grid 为 linspace 的 (起, 止, 点数).
+    已到期的日期 (years 为 0) 只有内在价值, 与 IV 无关.
+    """
+    prices = np.linspace(*grid)
+    years = np.asarray(years)
+    value = np.empty((len(iv_shifts), len(years), len(prices)))
+    value[:, years <= 0, :] = np.maximum(prices - strike, 0.0) if is_call else np.maximum(strike - prices, 0.0)
+    live = np.nonzero(years > 0)[0]
+    if len(live):
+        t = years[live]
+        sig = np.maximum(vol + np.asarray(iv_shifts), MIN_VOL)[:, None]
+        sig_sqrt_t = sig * np.sqrt(t)
+        disc = strike * np.exp(-rate * t)
+        shift = (-math.log(strike) + (rate + 0.5 * sig * sig) * t) / sig_sqrt_t
+        d1 = np.log(prices) * (1.0 / sig_sqrt_t)[:, :, None]
+        d1 += shift[:, :, None]
+        call = norm_cdf(d1)
+        call *= prices
+        d1 -= sig_sqrt_t[:, :, None]
+        # 只算看涨, 看跌用平价关系 put = call - S + K*exp(-rt)
+        call -= disc[None, :, None] * norm_cdf(d1)
+        if not is_call:
+            call += disc[None, :, None] - prices
+        value[:, live, :] = call
+    value.setflags(write=False)
+    return value
+
+
+def surface_from_quotes(legs, spot: float, mids, entry_cost: float, today=None, rate: float = 0.0,
+                        **grid) -> PayoffSurface:
+    """用各腿的中间价反推隐含波动率, 再计算盈亏曲面 (预览时使用)."""
+    today = _parse_date(today or datetime.date.today())
+    strike = np.array([float(leg['strike']) for leg in legs])
+    is_call = np.array([leg['right'].upper().startswith("C") for leg in legs])
+    years = np.array([max((_parse_date(leg['lastTradeDate']) - today).days, 0.5) / 365.0 for leg in legs])
+    vols = implied_vol(np.asarray(mids, dtype=float), spot, strike, years, is_call, rate)
+    return payoff_surface(legs, spot, vols.tolist(), entry_cost, today=today, rate=rate, **grid)
+
+
+def print_summary(surface: PayoffSurface, columns: int = 9):
+    """打印近月到期日的最大亏损/盈利、盈亏平衡点, 以及各日期的盈亏简表."""
+    horizon = surface.dates[-1].strftime("%Y%m%d")
+    max_gain = f"{surface.max_gain:.2f}"
+    if surface.upside_slope > 0:
+        max_gain += " (unbounded above)"
+    max_loss = f"{surface.max_loss:.2f}"
+    if surface.upside_slope < 0:
+        max_loss += " (unbounded above)"
+    print(f"======== Payoff at {horizon} (spot grid {surface.prices[0]:.2f}~{surface.prices[-1]:.2f}) ========")
+    print(f"Max loss={max_loss}, Max gain={max_gain}, "
+          f"Breakevens={', '.join(f'{b:.2f}' for b in surface.breakevens) or 'none'}")
+    picks = np.linspace(0, len(surface.prices) - 1, columns).round().astype(int)
+    print("date      " + "".join(f"{surface.prices[i]:>10.2f}" for i in picks))
+    for d, date in enumerate(surface.dates):
+        row = surface.at(d)
+        print(f"{date.strftime('%Y%m%d')}  " + "".join(f"{row[i]:>10.0f}" for i in picks))
+    print("==============================================")
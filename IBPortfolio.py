@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内存中的持仓组合: 由 reqPositions / reqAccountUpdates / reqPnLSingle 的推送逐条增量更新,
+不再反复查询. 每个标的的汇总 (股数、期权净张数、市值、盈亏...) 随每条回调增量维护,
+读取为 O(1), 供下单前检查和对冲直接使用.
+"""
+
+import threading
+
+# 每个标的汇总的字段
+AGGREGATE_FIELDS = (
+    "positions",         # 非零持仓的合约数
+    "stock",             # 股票股数
+    "option_contracts",  # 期权净张数 (多头为正)
+    "long_contracts",
+    "short_contracts",
+    "cost_basis",        # sum(position * avgCost)
+    "market_value",
+    "unrealized_pnl",
+    "realized_pnl",
+    "daily_pnl",
+)
+
+
+def _num(value) -> float:
+    """IB 用 None 或 Double.MAX 表示未知值, 汇总时按 0 处理."""
+    if value is None or abs(value) > 1e300:
+        return 0.0
+    return float(value)
+
+
+class Portfolio:
+    """
+    (account, conId) -> 持仓 dict:
+        symbol / secType / expiry / strike / right / multiplier,
+        position / avgCost / marketPrice / marketValue / unrealizedPNL / realizedPNL / dailyPnL
+    期权的 symbol 即标的代码, 按 symbol 汇总.
+    回调线程写入, 下单/对冲线程读取, 内部加锁.
+    """
+    def __init__(self):
+        self._positions = {}
+        self._by_underlying = {}
+        self.account_values = {}  # (account, key, currency) -> value
+        self._lock = threading.Lock()
+        # 每次变化递增, 读取方可据此判断是否需要重新计算
+        self.version = 0
+        # 只在持仓数量变化 (新增 / 平仓 / 数量改变) 时递增; 市价与盈亏推送不改变它
+        self.position_version = 0
+        # 变化监听者, 参数为 (symbol, 持仓 dict 副本)
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    # ---- 写入 (回调线程) ----
+    def update_position(self, account: str, contract, position: float, avg_cost: float = None):
+        """reqPositions 的 position 回调."""
+        return self._update(account, contract, position=float(position), avgCost=avg_cost)
+
+    def update_portfolio(self, account: str, contract, position: float, market_price: float,
+                         market_value: float, avg_cost: float, unrealized_pnl: float, realized_pnl: float):
+        """reqAccountUpdates 的 updatePortfolio 回调."""
+        return self._update(account, contract, position=float(position), avgCost=avg_cost,
+                            marketPrice=market_price, marketValue=market_value,
+                            unrealizedPNL=unrealized_pnl, realizedPNL=realized_pnl)
+
+    def update_pnl(self, account: str, con_id: int, position: float, daily_pnl: float,
+                   unrealized_pnl: float, realized_pnl: float, value: float):
+        """reqPnLSingle 的 pnlSingle 回调; 尚未收到该合约的持仓信息时忽略."""
+        with self._lock:
+            entry = self._positions.get((account, con_id))
+            if entry is None:
+                return None
+        return self._update(account, None, con_id=con_id, position=float(position), dailyPnL=daily_pnl,
+                            unrealizedPNL=unrealized_pnl, realizedPNL=realized_pnl, marketValue=value)
+
+    def update_account_value(self, account: str, key: str, value: str, currency: str):
+        self.account_values[(account, key, currency)] = value
+
+    def _update(self, account, contract, con_id: int = None, **fields):
+        con_id = contract.conId if contract is not None else con_id
+        key = (account, con_id)
+        with self._lock:
+            old = self._positions.get(key)
+            entry = dict(old) if old is not None else {
+                "account": account, "conId": con_id, "position": 0.0, "avgCost": 0.0,
+                "marketPrice": None, "marketValue": None, "unrealizedPNL": None,
+                "realizedPNL": None, "dailyPnL": None,
+            }
+            if contract is not None:
+                entry.update(symbol=contract.symbol, secType=contract.secType,
+                             expiry=contract.lastTradeDateOrContractMonth, strike=contract.strike,
+                             right=contract.right, multiplier=float(contract.multiplier or 1))
+            entry.update({k: v for k, v in fields.items() if v is not None})
+            if "symbol" not in entry:
+                return None
+            symbol = entry["symbol"]
+            agg = self._by_underlying.get(symbol)
+            if agg is None:
+                agg = self._by_underlying[symbol] = dict.fromkeys(AGGREGATE_FIELDS, 0.0)
+            if old is not None:
+                self._apply(agg, old, -1)
+            self._apply(agg, entry, 1)
+            if entry["position"] == 0 and not _num(entry["realizedPNL"]):
+                self._positions.pop(key, None)
+            else:
+                self._positions[key] = entry
+            if agg["positions"] == 0 and not agg["realized_pnl"]:
+                # 清仓后重置, 避免反复加减累积浮点误差
+                del self._by_underlying[symbol]
+            self.version += 1
+            if old is None or old["position"] != entry["position"]:
+                self.position_version += 1
+            snapshot = dict(entry)
+        for listener in self._listeners:
+            listener(symbol, snapshot)
+        return snapshot
+
+    @staticmethod
+    def _apply(agg: dict, entry: dict, sign: int):
+        """把一条持仓对汇总的贡献加上 (sign=1) 或减去 (sign=-1)."""
+        position = entry["position"]
+        if position:
+            agg["positions"] += sign
+        if entry["secType"] == "STK":
+            agg["stock"] += sign * position
+        elif entry["secType"] in ("OPT", "FOP"):
+            agg["option_contracts"] += sign * position
+            if position > 0:
+                agg["long_contracts"] += sign * position
+            else:
+                agg["short_contracts"] -= sign * position
+        agg["cost_basis"] += sign * position * _num(entry["avgCost"])
+        agg["market_value"] += sign * _num(entry["marketValue"])
+        agg["unrealized_pnl"] += sign * _num(entry["unrealizedPNL"])
+        agg["realized_pnl"] += sign * _num(entry["realizedPNL"])
+        agg["daily_pnl"] += sign * _num(entry["dailyPnL"])
+
+    # ---- 读取 ----
+    def underlying(self, symbol: str) -> dict:
+        """某个标的的汇总 (O(1)); 没有持仓时各字段为 0."""
+        with self._lock:
+            agg = self._by_underlying.get(symbol)
+            return dict(agg) if agg is not None else dict.fromkeys(AGGREGATE_FIELDS, 0.0)
+
+    def symbols(self):
+        with self._lock:
+            return list(self._by_underlying)
+
+    def position(self, con_id: int, account: str = None) -> float:
+        """某个合约的持仓数量 (account 为 None 时合计所有账户)."""
+        with self._lock:
+            return sum(e["position"] for (acct, cid), e in self._positions.items()
+                       if cid == con_id and (account is None or acct == account))
+
+    def positions(self, symbol: str = None, sec_type: str = None) -> list:
+        """持仓 dict 副本列表, 可按标的和证券类型过滤 (例如对冲时取某标的的全部期权)."""
+        with self._lock:
+            return [dict(e) for e in self._positions.values() if e["position"]
+                    and (symbol is None or e["symbol"] == symbol)
+                    and (sec_type is None or e["secType"] == sec_type)]
+
+    def print_summary(self):
+        print("======== Portfolio ========")
+        for symbol in sorted(self.symbols()):
+            agg = self.underlying(symbol)
+            print(f"{symbol}: stock={agg['stock']:g}, options={agg['option_contracts']:+g} "
+                  f"(long {agg['long_contracts']:g} / short {agg['short_contracts']:g}), "
+                  f"value={agg['market_value']:.2f}, uPnL={agg['unrealized_pnl']:.2f}, "
+                  f"rPnL={agg['realized_pnl']:.2f}, daily={agg['daily_pnl']:.2f}")
+        print("===========================")
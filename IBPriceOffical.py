@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import atexit
 import threading
 import time
-import bisect
 import numpy as np
 
 from ibapi.client import EClient
@@ -13,6 +13,19 @@ from ibapi.contract import Contract
 from ibapi.contract import ContractDetails
 from ibapi.contract import ComboLeg
 
+from IBLatency import LatencyRecorder
+from IBOptionToolOffical import WARNING_CODES
+from IBOrderArchive import approx_size
+from IBSecDefCache import SecDefCache, SecDefChain
+from IBChainIndex import ChainIndex
+from IBVolSurface import VolSurface
+from IBQuoteStore import QuoteStore, format_greeks, solver_check
+
+# tickPrice / tickSize 中保存的字段
+_PRICE_FIELDS = {1: "bid", 2: "ask", 4: "last"}
+_SIZE_FIELDS = {0: "bid_size", 3: "ask_size"}
+
+
 # ---- 自定义的应用类，继承 EWrapper + EClient ----
 class IBOptionDataApp(EWrapper, EClient):
     def __init__(self):
@@ -28,6 +41,11 @@ class IBOptionDataApp(EWrapper, EClient):
         # 存放期权链数据
         self._sec_def_params = []  # 这里会存储 (exchange, underlyingConId, tradingClass, multiplier, expirations, strikes)
         self._sec_def_params_received = threading.Event()
+        # 可并发的期权链请求: reqId -> 结果列表 / 结束事件 (见 fetch_sec_def_opt_params)
+        self._sec_def_params_map = {}
+        self._sec_def_params_events = {}
+        # 按标的 conId 缓存到当天结束 (内存 + 磁盘), 设为 None 则每次都请求
+        self.sec_def_cache = SecDefCache()
 
         # 存放每个合约详情查询结果 (reqId -> list of ContractDetails)
         self._contract_details_map = {}
@@ -36,6 +54,15 @@ class IBOptionDataApp(EWrapper, EClient):
         # 存放市场行情 (reqId -> { 'bid': x, 'ask': y })
         self._market_data_map = {}
         self._market_data_end_events = {}
+        # 流式行情的价格推送监听者 (reqId -> listener), 见 subscribe_market_data
+        self._tick_listeners = {}
+        # 列式行情表: bid/ask 与 IB 模型值 (tickOptionComputation 的 IV / Greeks), 每个行情请求一行
+        self.quotes = QuoteStore()
+
+        # 历史 K 线 (reqId -> [(date, open, high, low, close, volume, wap, barCount)]), 以及请求的错误 (code, msg)
+        self._historical_bars = {}
+        self._historical_end_events = {}
+        self._historical_errors = {}
 
         # 全局锁，防止多线程竞争访问数据
         self._lock = threading.Lock()
@@ -44,12 +71,89 @@ class IBOptionDataApp(EWrapper, EClient):
         self._req_id = 1000
         self._req_id_lock = threading.Lock()
 
+        # 请求往返耗时统计, 程序退出时打印汇总
+        self.latency = LatencyRecorder()
+        atexit.register(self.latency.print_summary)
+
+        # 可选的请求限速 (IBThrottle.TokenBucket), 批量扫描时避免超过 IB 的消息频率限制
+        self.request_throttle = None
+        # 为 False 时不打印每个请求结束的提示 (批量扫描时使用)
+        self.verbose = True
+
     def get_new_req_id(self) -> int:
         with self._req_id_lock:
             val = self._req_id
             self._req_id += 1
             return val
 
+    def _release_request(self, req_id: int):
+        """请求完成 (或超时) 后释放按 reqId 保存的状态."""
+        with self._lock:
+            self._market_data_map.pop(req_id, None)
+            self._market_data_end_events.pop(req_id, None)
+            self._contract_details_map.pop(req_id, None)
+            self._contract_details_end_events.pop(req_id, None)
+            self._sec_def_params_map.pop(req_id, None)
+            self._sec_def_params_events.pop(req_id, None)
+            self._historical_bars.pop(req_id, None)
+            self._historical_end_events.pop(req_id, None)
+            self._historical_errors.pop(req_id, None)
+        self.quotes.close(req_id)
+        self.latency.discard(req_id)
+
+    def memory_usage(self) -> dict:
+        """各内部状态表的条目数与估算字节数, 用于监控长时间运行时的内存."""
+        tables = {
+            "market_data": self._market_data_map,
+            "market_data_end_events": self._market_data_end_events,
+            "contract_details": self._contract_details_map,
+            "contract_details_end_events": self._contract_details_end_events,
+            "sec_def_params": self._sec_def_params,
+            "sec_def_params_map": self._sec_def_params_map,
+            "sec_def_cache": self.sec_def_cache._entries if self.sec_def_cache is not None else {},
+            "tick_listeners": self._tick_listeners,
+            "historical_bars": self._historical_bars,
+            "latency_pending": dict(self.latency._pending),
+        }
+        usage = {name: {"entries": len(t), "bytes": approx_size(t)} for name, t in tables.items()}
+        usage["quote_store"] = {"entries": len(self.quotes), "bytes": self.quotes.data.nbytes}
+        usage["total_bytes"] = sum(u["bytes"] for u in usage.values())
+        return usage
+
+    # ---- EClient 请求方法重载: 发出请求时开始计时 ----
+    def _throttle(self):
+        if self.request_throttle is not None:
+            self.request_throttle.acquire()
+
+    def reqContractDetails(self, reqId, contract):
+        self._throttle()
+        self.latency.start("reqContractDetails", reqId)
+        super().reqContractDetails(reqId, contract)
+
+    def reqSecDefOptParams(self, reqId, underlyingSymbol, futFopExchange,
+                           underlyingSecType, underlyingConId):
+        self._throttle()
+        self.latency.start("reqSecDefOptParams", reqId)
+        super().reqSecDefOptParams(reqId, underlyingSymbol, futFopExchange,
+                                   underlyingSecType, underlyingConId)
+
+    def reqMktData(self, reqId, contract, genericTickList, snapshot,
+                   regulatorySnapshot, mktDataOptions):
+        self._throttle()
+        self.quotes.open(reqId, contract.conId)
+        self.latency.start("reqMktData.firstTick", reqId)
+        if snapshot:
+            self.latency.start("reqMktData.snapshotEnd", reqId)
+        super().reqMktData(reqId, contract, genericTickList, snapshot,
+                           regulatorySnapshot, mktDataOptions)
+
+    def reqHistoricalData(self, reqId, contract, endDateTime, durationStr, barSizeSetting, whatToShow,
+                          useRTH, formatDate, keepUpToDate, chartOptions):
+        self._throttle()
+        self.latency.start("reqHistoricalData", reqId)
+        super().reqHistoricalData(reqId, contract, endDateTime, durationStr, barSizeSetting, whatToShow,
+                                  useRTH, formatDate, keepUpToDate, chartOptions)
+
     # ---- EWrapper 回调实现 ----
     @iswrapper
     def nextValidId(self, orderId: int):
@@ -64,6 +168,18 @@ class IBOptionDataApp(EWrapper, EClient):
         msg = f"[error] reqId={reqId}, code={errorCode}, msg={errorString}"
         # 2104,2106,2158 等是常见的“数据农场连接”提示，不是致命错误
         print(msg)
+        if errorCode in WARNING_CODES:
+            # 提示类信息之后数据仍会到达, 不结束等待
+            return
+        self.latency.discard(reqId)
+        if reqId in self._historical_end_events:
+            self._historical_errors[reqId] = (errorCode, errorString)
+        # 请求出错 (如合约不存在) 时结束等待, 不必等到超时
+        for events in (self._market_data_end_events, self._contract_details_end_events,
+                       self._sec_def_params_events, self._historical_end_events):
+            ev = events.get(reqId)
+            if ev is not None:
+                ev.set()
 
     @iswrapper
     def tickPrice(self, reqId, tickType, price, attrib):
@@ -71,26 +187,47 @@ class IBOptionDataApp(EWrapper, EClient):
         行情价格回调 (bid=1, ask=2, last=4, etc.)
         这里只用来获取 bid/ask/last
         """
-        if reqId not in self._market_data_map:
-            self._market_data_map[reqId] = {}
+        self.latency.stop("reqMktData.firstTick", reqId)
+        # 请求发出前已建好条目; 找不到说明请求已结束释放, 迟到的推送直接丢弃
+        data = self._market_data_map.get(reqId)
+        if data is None:
+            return
 
+        field = _PRICE_FIELDS.get(tickType)  # bid=1, ask=2, last=4
+        if field is None:
+            return
         with self._lock:
-            if tickType == 1:  # bid
-                self._market_data_map[reqId]['bid'] = price
-            elif tickType == 2:  # ask
-                self._market_data_map[reqId]['ask'] = price
-            elif tickType == 4:  # last
-                self._market_data_map[reqId]['last'] = price
+            data[field] = price
+        self.quotes.on_price(reqId, tickType, price)
+
+        listener = self._tick_listeners.get(reqId)
+        if listener is not None:
+            listener(reqId, field, price)
 
     @iswrapper
     def tickSize(self, reqId, tickType, size):
-        # 如果需要量，可在这里处理
-        pass
+        self.latency.stop("reqMktData.firstTick", reqId)
+        data = self._market_data_map.get(reqId)
+        field = _SIZE_FIELDS.get(tickType)  # bid_size=0, ask_size=3
+        if data is None or field is None:
+            return
+        with self._lock:
+            data[field] = float(size)
+        self.quotes.on_size(reqId, tickType, size)
+
+    @iswrapper
+    def tickOptionComputation(self, reqId, tickType, tickAttrib, impliedVol, delta, optPrice, pvDividend,
+                              gamma, vega, theta, undPrice):
+        """IB 的模型 IV / Greeks, 写入列式行情表 (self.quotes)."""
+        self.quotes.on_option_computation(reqId, tickType, impliedVol, delta, optPrice, gamma, vega, theta,
+                                          undPrice)
 
     @iswrapper
     def tickSnapshotEnd(self, reqId: int):
         """快照行情结束标志"""
-        print(f"[tickSnapshotEnd] reqId={reqId}")
+        if self.verbose:
+            print(f"[tickSnapshotEnd] reqId={reqId}")
+        self.latency.stop("reqMktData.snapshotEnd", reqId)
         if reqId in self._market_data_end_events:
             ev = self._market_data_end_events[reqId]
             ev.set()
@@ -105,30 +242,57 @@ class IBOptionDataApp(EWrapper, EClient):
         strikes: set[float]
         """
         with self._lock:
-            self._sec_def_params.append((exchange, underlyingConId, tradingClass, multiplier, expirations, strikes))
+            row = (exchange, underlyingConId, tradingClass, multiplier, expirations, strikes)
+            rows = self._sec_def_params_map.get(reqId)
+            if rows is not None:
+                rows.append(row)
+            else:
+                self._sec_def_params.append(row)
 
     @iswrapper
     def securityDefinitionOptionParameterEnd(self, reqId: int):
         """
         所有 securityDefinitionOptionParameter 回调结束
         """
-        print(f"[securityDefinitionOptionParameterEnd] reqId={reqId}")
-        self._sec_def_params_received.set()
+        if self.verbose:
+            print(f"[securityDefinitionOptionParameterEnd] reqId={reqId}")
+        self.latency.stop("reqSecDefOptParams", reqId)
+        ev = self._sec_def_params_events.get(reqId)
+        if ev is not None:
+            ev.set()
+        else:
+            self._sec_def_params_received.set()
 
     # ---- 获取合约详情 ----
     @iswrapper
     def contractDetails(self, reqId: int, details: ContractDetails):
         with self._lock:
-            if reqId not in self._contract_details_map:
-                self._contract_details_map[reqId] = []
-            self._contract_details_map[reqId].append(details)
+            details_list = self._contract_details_map.get(reqId)
+            if details_list is not None:
+                details_list.append(details)
 
     @iswrapper
     def contractDetailsEnd(self, reqId: int):
-        print(f"[contractDetailsEnd] reqId={reqId}")
+        if self.verbose:
+            print(f"[contractDetailsEnd] reqId={reqId}")
+        self.latency.stop("reqContractDetails", reqId)
         if reqId in self._contract_details_end_events:
             self._contract_details_end_events[reqId].set()
 
+    @iswrapper
+    def historicalData(self, reqId: int, bar):
+        bars = self._historical_bars.get(reqId)
+        if bars is not None:
+            bars.append((bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume, bar.average,
+                         bar.barCount))
+
+    @iswrapper
+    def historicalDataEnd(self, reqId: int, start: str, end: str):
+        self.latency.stop("reqHistoricalData", reqId)
+        ev = self._historical_end_events.get(reqId)
+        if ev is not None:
+            ev.set()
+
     # ---- 帮助方法：等待市场数据，获取“标的价格” ----
     def request_underlying_price(self, symbol: str = "UVXY", exchange: str = "SMART", currency: str = "USD"):
         """
@@ -160,6 +324,7 @@ class IBOptionDataApp(EWrapper, EClient):
 
         # 取到的数据
         data = self._market_data_map.get(req_id, {})
+        self._release_request(req_id)
         last = data.get('last')
         bid = data.get('bid')
         ask = data.get('ask')
@@ -180,8 +345,15 @@ class IBOptionDataApp(EWrapper, EClient):
     # ---- 帮助方法：请求期权链 ----
     def request_sec_def_opt_params(self, underlying_symbol: str, underlying_sec_type: str, underlying_conId: int):
         """
-        发送 reqSecDefOptParams 获取期权链数据
+        发送 reqSecDefOptParams 获取期权链数据 (当天已缓存时直接使用缓存)
         """
+        chain = self.sec_def_cache.get(underlying_conId) if self.sec_def_cache is not None else None
+        if chain is not None:
+            self._sec_def_params[:] = chain.rows
+            self._sec_def_params_received.set()
+            print(f"期权链信息来自缓存 (conId={underlying_conId}).")
+            return
+
         req_id = self.get_new_req_id()
         self._sec_def_params.clear()
         self._sec_def_params_received.clear()
@@ -196,11 +368,48 @@ class IBOptionDataApp(EWrapper, EClient):
 
         if not self._sec_def_params:
             print("未获取到期权链信息。")
+        elif self.sec_def_cache is not None and self._sec_def_params_received.is_set():
+            self.sec_def_cache.put(underlying_conId, list(self._sec_def_params))
+
+    def fetch_sec_def_opt_params(self, underlying_symbol: str, underlying_sec_type: str,
+                                 underlying_conId: int, timeout: float = 5.0):
+        """
+        与 request_sec_def_opt_params 相同, 但结果按 reqId 单独保存并直接返回, 可在多个线程中并发调用.
+        返回 [(exchange, underlyingConId, tradingClass, multiplier, expirations, strikes), ...]
+        """
+        chain = self.sec_def_chain(underlying_symbol, underlying_sec_type, underlying_conId, timeout)
+        return chain.rows if chain is not None else []
+
+    def sec_def_chain(self, underlying_symbol: str, underlying_sec_type: str,
+                      underlying_conId: int, timeout: float = 5.0):
+        """
+        返回解析后的期权链 (IBSecDefCache.SecDefChain), 当天第一次调用才真正请求; 未取到时返回 None.
+        """
+        if self.sec_def_cache is not None:
+            chain = self.sec_def_cache.get(underlying_conId)
+            if chain is not None:
+                return chain
+        req_id = self.get_new_req_id()
+        ev = threading.Event()
+        with self._lock:
+            self._sec_def_params_map[req_id] = []
+            self._sec_def_params_events[req_id] = ev
+        self.reqSecDefOptParams(req_id, underlying_symbol, "", underlying_sec_type, underlying_conId)
+        completed = ev.wait(timeout)
+        rows = self._sec_def_params_map.get(req_id, [])
+        self._release_request(req_id)
+        if not rows:
+            return None
+        # 超时时结果可能不完整, 不写入缓存
+        if self.sec_def_cache is not None and completed:
+            return self.sec_def_cache.put(underlying_conId, rows)
+        return SecDefChain(rows)
 
     # ---- 帮助方法：请求合约详情、获取 conId ----
-    def resolve_option_contract(self, contract: Contract, timeout=3.0):
+    def request_contract_details(self, contract: Contract, timeout=3.0):
         """
-        通过 reqContractDetails 查询并返回第一个匹配的合约详情，以便拿到 conId 等信息。
+        返回 reqContractDetails 的全部结果 (list of ContractDetails).
+        期权只给 symbol + 到期日时, 一次请求即可拿到整条链 (所有行权价和 C/P).
         """
         req_id = self.get_new_req_id()
         self._contract_details_map[req_id] = []
@@ -211,8 +420,16 @@ class IBOptionDataApp(EWrapper, EClient):
         ev.wait(timeout)
 
         details_list = self._contract_details_map.get(req_id, [])
+        self._release_request(req_id)
+        return details_list
+
+    def resolve_option_contract(self, contract: Contract, timeout=3.0):
+        """
+        通过 reqContractDetails 查询并返回第一个匹配的合约详情，以便拿到 conId 等信息。
+        """
+        details_list = self.request_contract_details(contract, timeout)
         if not details_list:
-            print(f"resolve_option_contract: 没有合约详情返回 (reqId={req_id})。")
+            print(f"resolve_option_contract: 没有合约详情返回 ({contract.symbol} {contract.secType})。")
             return None
 
         # 只取第一条
@@ -220,6 +437,14 @@ class IBOptionDataApp(EWrapper, EClient):
 
     # ---- 帮助方法：请求单个期权合约的快照行情 (bid/ask) ----
     def request_option_market_snapshot(self, contract: Contract, timeout=3.0):
+        quote = self.request_option_quote(contract, timeout)
+        return quote.get('bid'), quote.get('ask')
+
+    def request_option_quote(self, contract: Contract, timeout=3.0) -> dict:
+        """
+        快照行情, 返回 {'bid', 'ask', 'last', 'bid_size', 'ask_size'} 中收到的字段,
+        期权另有 IB 模型值 'iv', 'delta', 'gamma', 'vega', 'theta', 'opt_price', 'und_price'.
+        """
         req_id = self.get_new_req_id()
         self._market_data_map[req_id] = {}
         ev = threading.Event()
@@ -233,16 +458,65 @@ class IBOptionDataApp(EWrapper, EClient):
         except:
             pass
 
-        data = self._market_data_map.get(req_id, {})
-        bid = data.get('bid')
-        ask = data.get('ask')
-        return bid, ask
+        data = dict(self._market_data_map.get(req_id, {}))
+        data.update(self.quotes.greeks(req_id))
+        self._release_request(req_id)
+        return data
+
 
+    # ---- 帮助方法：历史 K 线 ----
+    def request_historical_bars(self, contract: Contract, end: str = "", duration: str = "1 Y",
+                                bar_size: str = "1 day", what_to_show: str = "TRADES", use_rth: bool = True,
+                                timeout: float = 60.0):
+        """
+        reqHistoricalData, 返回 (bars, error): bars 为 [(date, open, high, low, close, volume, wap, barCount)],
+        date 日线为 "YYYYMMDD", 日内为 UTC 秒 (formatDate=2); error 为 (code, msg), 成功时为 None.
+        end 为空表示到当前时刻. 不做 IB 的历史数据限速, 批量请求见 IBHistorical.HistoricalFetcher.
+        """
+        req_id = self.get_new_req_id()
+        self._historical_bars[req_id] = []
+        ev = threading.Event()
+        self._historical_end_events[req_id] = ev
+
+        self.reqHistoricalData(req_id, contract, end, duration, bar_size, what_to_show, int(use_rth), 2,
+                               False, [])
+        if not ev.wait(timeout):
+            try:
+                self.cancelHistoricalData(req_id)
+            except:
+                pass
+            self._historical_errors.setdefault(req_id, (-1, f"timeout after {timeout:g}s"))
+
+        bars = self._historical_bars.get(req_id, [])
+        error = self._historical_errors.get(req_id)
+        self._release_request(req_id)
+        return bars, error
+
+    def subscribe_market_data(self, contract: Contract, listener=None) -> int:
+        """
+        订阅流式行情, 返回 reqId; 最新 bid/ask/last 在 self._market_data_map[reqId] 中,
+        listener(reqId, field, price) 在每个价格推送时被调用 (EReader 线程, 应尽快返回).
+        """
+        req_id = self.get_new_req_id()
+        self._market_data_map[req_id] = {}
+        if listener is not None:
+            self._tick_listeners[req_id] = listener
+        self.reqMktData(req_id, contract, "", False, False, [])
+        return req_id
+
+    def unsubscribe_market_data(self, req_id: int):
+        self.cancelMktData(req_id)
+        self._tick_listeners.pop(req_id, None)
+        self._release_request(req_id)
 
-def get_option_data(expiry_date='20250314'):
+
+def get_option_data(expiry_date='20250314', archive=None, surface=None):
     """
     使用官方 ibapi 方式获取指定到期日的 UVXY 期权数据，
     并打印 (PUT/ CALL) 行权价上下各 5档的中间价。
+    archive: 可选的 IBChainArchive.ChainArchive, 本次快照的 bid/ask 会追加进去。
+    surface: 可选的 IBVolSurface.VolSurface (多次调用时传同一个, 拟合从上次的参数继续);
+             没有买卖价的行权价显示曲面给出的理论价, 而不是 "无报价"。
     """
     app = IBOptionDataApp()
 
@@ -297,31 +571,19 @@ def get_option_data(expiry_date='20250314'):
             underlying_sec_type="STK",
             underlying_conId=underlying_conId
         )
-        time.sleep(1.0)
-
-        # 4) 从期权链中找与我们想要的 expiry_date、tradingClass='UVXY' 相匹配的 strikes
-        #    这里可能返回了多个 exchange / multiplier，但UVXY一般 multiplier=100, exchange=???
-        #    原 ib_insync 的写法: chain = next(c for c in chains if ...)
-        #    我们此处手动去匹配
-        matched_strikes = []
-        for (exchange, uConId, tClass, multiplier, expirations, strikes) in app._sec_def_params:
-            if (tClass == 'UVXY' or tClass == 'UVXY?') and (expiry_date in expirations):
-                # 只要 multiplier == '100' 也可以检查
-                matched_strikes.extend(strikes)
-
-        if not matched_strikes:
+        # request_sec_def_opt_params 发出请求时已等待回调结束, 命中缓存时立即返回, 不必再等待
+
+        # 4) 用期权链索引 (tradingClass='UVXY') 选行权价: 二分定位当前价, 不再遍历整条链
+        index = ChainIndex.from_chain(SecDefChain(app._sec_def_params), "UVXY")
+        if not len(index.strikes(expiry_date)):
             print(f"期权链中未找到到期日={expiry_date} 或 tradingClass=UVXY 的记录。")
             return
+        # 只在 5 < strike < 当前价 * 3 内选
+        below, above = index.window(expiry_date, current_price, 5, 5, lo=5, hi=current_price * 3)
 
-        # 过滤 strikes
-        valid_strikes = sorted([s for s in matched_strikes if 5 < s < current_price * 3])
-
-        # 找到当前价附近的索引
-        index = bisect.bisect_left(valid_strikes, current_price)
-        # put 取 index 前 5个，call 取 index 后 5个
-        # 这里原代码 put 是从高到低 (max->index->reverse)；call 是从低到高
-        put_strikes = valid_strikes[max(0, index - 5):index][::-1]
-        call_strikes = valid_strikes[index:index + 5]
+        # put 取当前价以下 5 档 (从高到低)，call 取当前价及以上 5 档 (从低到高)
+        put_strikes = below[::-1].tolist()
+        call_strikes = above.tolist()
 
         print(f"目标 PUT 行权价: {put_strikes[:5]}")
         print(f"目标 CALL 行权价: {call_strikes[:5]}")
@@ -368,23 +630,30 @@ def get_option_data(expiry_date='20250314'):
         # 6) 逐个请求快照行情，并计算中间价
         #    原 ib_insync 代码是一次性 reqTickers(*qualified)，这里就循环请求 snapshot
         option_data = {}  # key: (strike, 'P'/'C'), value: mid-price
-        # PUT
-        for c in put_contracts:
-            bid, ask = app.request_option_market_snapshot(c, timeout=3)
+        quotes = {}  # key: (strike, 'P'/'C'), value: (bid, ask), 供归档
+        snapshots = {}  # key: (strike, 'P'/'C'), value: request_option_quote 的结果 (含 IB 的 IV / Greeks)
+        for c in put_contracts + call_contracts:
+            snapshot = app.request_option_quote(c, timeout=3)
+            bid, ask = snapshot.get('bid'), snapshot.get('ask')
+            quotes[(c.strike, c.right)] = (bid, ask)
+            snapshots[(c.strike, c.right)] = snapshot
             if bid and ask and bid > 0 and ask > 0:
                 mid = (bid + ask) / 2
                 option_data[(c.strike, c.right)] = f"{mid:.2f}"
             else:
                 option_data[(c.strike, c.right)] = "无报价"
 
-        # CALL
-        for c in call_contracts:
-            bid, ask = app.request_option_market_snapshot(c, timeout=3)
-            if bid and ask and bid > 0 and ask > 0:
-                mid = (bid + ask) / 2
-                option_data[(c.strike, c.right)] = f"{mid:.2f}"
-            else:
-                option_data[(c.strike, c.right)] = "无报价"
+        # 用有报价的行权价拟合 SVI 曲线, 给没有报价的行权价估一个理论价
+        missing = [key for key, value in option_data.items() if value == "无报价"]
+        if missing:
+            surface = surface if surface is not None else VolSurface("UVXY")
+            keys = list(quotes)
+            surface.update(expiry_date, current_price, [k[0] for k in keys], [k[1] for k in keys],
+                           [quotes[k][0] or np.nan for k in keys], [quotes[k][1] or np.nan for k in keys])
+            for strike, right in missing:
+                fair = surface.fair_value(expiry_date, [strike], right, current_price)
+                if fair is not None:
+                    option_data[(strike, right)] = f"{float(fair[0]):.2f} (SVI 理论价, 无报价)"
 
         # 7) 输出
         print("\n【最终结果】")
@@ -393,12 +662,24 @@ def get_option_data(expiry_date='20250314'):
         print("\nPUT期权（行权价从高到低）:")
         for strike in put_strikes[:5]:
             price = option_data.get((strike, 'P'), "无数据")
-            print(f"PUT {strike:>5} | 中间价: {price}")
+            print(f"PUT {strike:>5} | 中间价: {price}{format_greeks(snapshots.get((strike, 'P'), {}))}")
 
         print("\nCALL期权（行权价从低到高）:")
         for strike in call_strikes[:5]:
             price = option_data.get((strike, 'C'), "无数据")
-            print(f"CALL {strike:>5} | 中间价: {price}")
+            print(f"CALL {strike:>5} | 中间价: {price}{format_greeks(snapshots.get((strike, 'C'), {}))}")
+
+        # 本地 IV / Greeks 求解与 IB 模型值的最大偏差
+        keys = list(snapshots)
+        years = index.years(expiry_date)
+        check = solver_check([snapshots[k] for k in keys], [k[0] for k in keys], years,
+                             [k[1] == "C" for k in keys])
+        if check["count"]:
+            print(f"\n本地求解 vs IB ({check['count']} 个期权): 最大偏差 iv={check['iv']:.4f} "
+                  f"delta={check['delta']:.4f} vega={check['vega']:.4f} theta={check['theta']:.4f}")
+
+        if archive is not None:
+            archive.append_snapshot("UVXY", expiry_date, current_price, quotes)
 
     except Exception as e:
         print(f"发生错误: {str(e)}")
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列式行情表: 每个行情请求 (reqId) 占一行, 预分配的 float64 数组里按列保存
+bid / ask / last / 买卖量, 以及 tickOptionComputation 推送的 IB 模型值
+(隐含波动率、delta、gamma、vega、theta、理论价、标的价).
+
+回调里只是往预先取好的列 (按列存储的表的一维视图) 写一个数, 不为每个 tick 新建 dict、数组或下标元组;
+回调中的加锁用 acquire / release 而不是 with (with 每次会分配约 144 字节的临时对象).
+只有开新行且表满时才扩容.
+IBApp / IBOptionDataApp 在发出 reqMktData 时 open(reqId), 释放请求时 close(reqId).
+
+IB 的 Greeks 口径: delta / gamma 每股, vega 为波动率变动 1 个百分点的价格变化, theta 为每日.
+"""
+
+import math
+import threading
+
+import numpy as np
+
+from IBPayoff import bs_greeks, implied_vol
+
+COLUMNS = ("bid", "ask", "last", "bid_size", "ask_size",
+           "iv", "delta", "gamma", "vega", "theta", "opt_price", "und_price", "bid_iv", "ask_iv")
+GREEKS = ("iv", "delta", "gamma", "vega", "theta", "opt_price", "und_price")
+_COL = {name: i for i, name in enumerate(COLUMNS)}
+
+# tickType -> 列
+_PRICE_COLS = {1: _COL["bid"], 2: _COL["ask"], 4: _COL["last"]}
+_SIZE_COLS = {0: _COL["bid_size"], 3: _COL["ask_size"]}
+# tickOptionComputation: 13 模型值 (83 为延迟行情); 10 / 11 只取 bid / ask 的隐含波动率
+_MODEL_TICKS = (13, 83)
+_SIDE_IV_COLS = {10: _COL["bid_iv"], 11: _COL["ask_iv"], 80: _COL["bid_iv"], 81: _COL["ask_iv"]}
+
+_NAN = float("nan")
+
+
+class QuoteStore:
+    """
+    capacity: 初始行数, 表满时按倍数扩容.
+    data: (行, 列) 数组 (按列存储), 行号由 row(req_id) 给出; con_ids: 每行对应的合约 conId.
+    """
+    def __init__(self, capacity: int = 256):
+        self.data = np.full((capacity, len(COLUMNS)), np.nan, order="F")
+        self.con_ids = np.zeros(capacity, dtype=np.int64)
+        self._rows = {}
+        self._free = list(range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+        self._views()
+
+    def _views(self):
+        """各列的一维视图, 回调直接写 col[row]."""
+        cols = [self.data[:, i] for i in range(len(COLUMNS))]
+        self._price_cols = {tick: cols[i] for tick, i in _PRICE_COLS.items()}
+        self._size_cols = {tick: cols[i] for tick, i in _SIZE_COLS.items()}
+        self._side_iv_cols = {tick: cols[i] for tick, i in _SIDE_IV_COLS.items()}
+        self._greek_cols = tuple(cols[_COL[name]] for name in GREEKS)
+
+    # ---- 行管理 ----
+    def open(self, req_id: int, con_id: int = 0) -> int:
+        with self._lock:
+            row = self._rows.get(req_id)
+            if row is None:
+                if not self._free:
+                    self._grow()
+                row = self._free.pop()
+                self._rows[req_id] = row
+            self.data[row] = np.nan
+            self.con_ids[row] = con_id or 0
+            return row
+
+    def close(self, req_id: int):
+        with self._lock:
+            row = self._rows.pop(req_id, None)
+            if row is not None:
+                self._free.append(row)
+
+    def _grow(self):
+        old = len(self.data)
+        data = np.full((old * 2, len(COLUMNS)), np.nan, order="F")
+        data[:old] = self.data
+        con_ids = np.zeros(old * 2, dtype=np.int64)
+        con_ids[:old] = self.con_ids
+        self.data, self.con_ids = data, con_ids
+        self._views()
+        self._free.extend(range(old * 2 - 1, old - 1, -1))
+
+    def row(self, req_id: int):
+        return self._rows.get(req_id)
+
+    def __len__(self):
+        return len(self._rows)
+
+    # ---- 回调写入 (EReader 线程) ----
+    def on_price(self, req_id: int, tick_type: int, price: float):
+        self._lock.acquire()
+        try:
+            col = self._price_cols.get(tick_type)
+            row = self._rows.get(req_id)
+            if col is not None and row is not None:
+                col[row] = price
+        finally:
+            self._lock.release()
+
+    def on_size(self, req_id: int, tick_type: int, size):
+        self._lock.acquire()
+        try:
+            col = self._size_cols.get(tick_type)
+            row = self._rows.get(req_id)
+            if col is not None and row is not None:
+                col[row] = size
+        finally:
+            self._lock.release()
+
+    def on_option_computation(self, req_id: int, tick_type: int, iv, delta, opt_price, gamma, vega, theta,
+                              und_price):
+        """未计算的字段 (ibapi 解码为 None) 记为 NaN."""
+        self._lock.acquire()
+        try:
+            row = self._rows.get(req_id)
+            if row is None:
+                return
+            if tick_type in _MODEL_TICKS:
+                iv_col, delta_col, gamma_col, vega_col, theta_col, opt_col, und_col = self._greek_cols
+                iv_col[row] = _NAN if iv is None else iv
+                delta_col[row] = _NAN if delta is None else delta
+                gamma_col[row] = _NAN if gamma is None else gamma
+                vega_col[row] = _NAN if vega is None else vega
+                theta_col[row] = _NAN if theta is None else theta
+                opt_col[row] = _NAN if opt_price is None else opt_price
+                und_col[row] = _NAN if und_price is None else und_price
+            else:
+                col = self._side_iv_cols.get(tick_type)
+                if col is not None:
+                    col[row] = _NAN if iv is None else iv
+        finally:
+            self._lock.release()
+
+    # ---- 读取 ----
+    def get(self, req_id: int, columns=COLUMNS) -> dict:
+        """一行中已收到的字段 (NaN 的不返回)."""
+        with self._lock:
+            row = self._rows.get(req_id)
+            if row is None:
+                return {}
+            values = self.data[row].tolist()
+        return {name: values[_COL[name]] for name in columns if not math.isnan(values[_COL[name]])}
+
+    def greeks(self, req_id: int) -> dict:
+        return self.get(req_id, GREEKS)
+
+    def column(self, name: str, req_ids) -> np.ndarray:
+        """多个请求的同一列 (一次取整条链的 IV / delta 等), 不在表中的为 NaN."""
+        with self._lock:
+            rows = np.array([self._rows.get(r, -1) for r in req_ids], dtype=np.intp)
+            values = self.data[rows, _COL[name]]
+        values[rows < 0] = np.nan
+        return values
+
+
+def format_greeks(quote: dict) -> str:
+    """预览输出用: ', IB iv=0.812 delta=-0.35 ...', 没有模型值时返回空字符串."""
+    if "iv" not in quote and "delta" not in quote:
+        return ""
+    parts = [f"{name}={quote[name]:.3f}" for name in ("iv", "delta", "gamma", "vega", "theta") if name in quote]
+    return ", IB " + " ".join(parts)
+
+
+def solver_check(quotes, strikes, years, is_call, rate: float = 0.0) -> dict:
+    """
+    用 IB 的标的价和各期权的中间价跑本地的 implied_vol / bs_greeks, 与 IB 的模型值比较.
+    quotes: 与 strikes 等长的 dict 列表 (get / request_option_quote 的返回值).
+    返回 {"count", "iv", "delta", "vega", "theta"}: 后四项为最大绝对误差, 没有可比较的报价时 count 为 0.
+    """
+    fields = ("bid", "ask", "und_price", "iv", "delta", "vega", "theta")
+    rows = np.array([[q.get(name, np.nan) for name in fields] for q in quotes], dtype=float).reshape(-1, len(fields))
+    bid, ask, und, ib_iv, ib_delta, ib_vega, ib_theta = rows.T
+    ok = (bid > 0) & (ask >= bid) & (und > 0) & np.isfinite(ib_iv)
+    result = {"count": int(ok.sum())}
+    if not ok.any():
+        return result
+    strikes = np.broadcast_to(np.asarray(strikes, dtype=float), ok.shape)[ok]
+    years = np.broadcast_to(np.asarray(years, dtype=float), ok.shape)[ok]
+    is_call = np.broadcast_to(np.asarray(is_call, dtype=bool), ok.shape)[ok]
+    iv = implied_vol(0.5 * (bid[ok] + ask[ok]), und[ok], strikes, years, is_call, rate)
+    local = bs_greeks(und[ok], strikes, years, iv, is_call, rate)
+    result["iv"] = float(np.nanmax(np.abs(iv - ib_iv[ok])))
+    for name, ib in (("delta", ib_delta), ("vega", ib_vega), ("theta", ib_theta)):
+        diff = np.abs(local[name] - ib[ok])
+        result[name] = float(np.nanmax(diff)) if np.isfinite(diff).any() else float("nan")
+    return result
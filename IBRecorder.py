@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API 回调流的录制与回放.
+
+录制: 在 EWrapper 边界把每个回调 (方法名 + 参数 + 接收时间) 追加写入紧凑的二进制日志;
+回放: 按原始节奏或尽可能快地把日志重新喂给同一组回调, 用于离线复现 / 性能分析一次真实会话.
+
+日志格式 (小端):
+    文件头  b"HTRC" + 版本号(1 字节)
+    记录    <q 接收时间 time_ns> <H 方法编号> <I 负载长度> <负载>
+    方法编号 0xFFFF 表示"方法名定义"记录, 负载为 UTF-8 方法名, 按出现顺序依次编号;
+    方法编号 0xFFFE 表示新的一段录制 (追加到已有文件时写入), 之前的方法编号作废;
+    其余记录的负载为参数元组的 pickle.
+
+用法:
+    IB_RECORD_PATH=session.iblog python IBOption4Leg.py      # 录制
+    python IBRecorder.py dump session.iblog                  # 查看统计
+    python IBRecorder.py replay session.iblog --speed 0      # 尽快回放
+    python IBRecorder.py replay session.iblog --profile      # 回放并 cProfile
+"""
+
+import argparse
+import contextlib
+import os
+import pickle
+import struct
+import sys
+import time
+from collections import Counter
+
+from ibapi.wrapper import EWrapper
+
+MAGIC = b"HTRC"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<qHI")
+_NAME_RECORD = 0xFFFF
+_SEGMENT_RECORD = 0xFFFE
+
+# 所有需要录制的 EWrapper 回调名
+WRAPPER_METHODS = sorted(
+    name for name, value in vars(EWrapper).items()
+    if callable(value) and not name.startswith("_") and name != "logAnswer"
+)
+
+
+class CallbackRecorder:
+    """把回调追加写入二进制日志; 回调都在 EReader 线程上执行, 因此只有一个写者."""
+    def __init__(self, path: str):
+        self.path = path
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._f = open(path, "ab", buffering=1 << 16)
+        if new_file:
+            self._f.write(MAGIC + bytes([FORMAT_VERSION]))
+        else:
+            self._f.write(_HEADER.pack(0, _SEGMENT_RECORD, 0))
+        self._ids = {}
+        self.count = 0
+
+    def record(self, method: str, args: tuple):
+        mid = self._ids.get(method)
+        if mid is None:
+            mid = self._ids[method] = len(self._ids)
+            name = method.encode()
+            self._f.write(_HEADER.pack(0, _NAME_RECORD, len(name)) + name)
+        payload = pickle.dumps(args, protocol=pickle.HIGHEST_PROTOCOL)
+        self._f.write(_HEADER.pack(time.time_ns(), mid, len(payload)) + payload)
+        self.count += 1
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        if not self._f.closed:
+            self._f.close()
+
+
+def install_recorder(app, path: str) -> CallbackRecorder:
+    """
+    在 app 实例上包一层 EWrapper 回调: 先写日志, 再调用原方法.
+    解码器通过 getattr(wrapper, name) 调用回调, 所以实例属性即可拦截.
+    """
+    recorder = CallbackRecorder(path)
+    for name in WRAPPER_METHODS:
+        original = getattr(app, name)
+
+        def _wrapped(*args, _name=name, _original=original):
+            recorder.record(_name, args)
+            return _original(*args)
+
+        setattr(app, name, _wrapped)
+    app._callback_recorder = recorder
+    return recorder
+
+
+def uninstall_recorder(app):
+    recorder = getattr(app, "_callback_recorder", None)
+    if recorder is None:
+        return
+    for name in WRAPPER_METHODS:
+        app.__dict__.pop(name, None)
+    recorder.close()
+    app._callback_recorder = None
+
+
+def read_log(path: str):
+    """逐条产出 (time_ns, method, args)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a callback log")
+    pos = len(MAGIC) + 1
+    names = []
+    while pos < len(data):
+        if pos + _HEADER.size > len(data):
+            break  # 末尾不完整的记录 (进程被强杀时可能出现)
+        ts, mid, size = _HEADER.unpack_from(data, pos)
+        pos += _HEADER.size
+        payload = data[pos:pos + size]
+        if len(payload) < size:
+            break
+        pos += size
+        if mid == _NAME_RECORD:
+            names.append(payload.decode())
+            continue
+        if mid == _SEGMENT_RECORD:
+            names = []
+            continue
+        yield ts, names[mid], pickle.loads(payload)
+
+
+def replay(path: str, app, speed: float = 1.0, methods=None) -> int:
+    """
+    把日志回放给 app 的回调.
+    speed: 1.0 按原始节奏, 2.0 两倍速, 0 或 None 表示不等待、尽可能快.
+    methods: 只回放这些回调 (默认全部).
+    回放的 app 没有发出过这些请求, 行情回调 (tick*) 中出现的 reqId 先登记到
+    app.market_data / app.quotes, 否则会被当作已释放请求的迟到推送丢弃.
+    返回回放的记录数.
+    """
+    count = 0
+    t0_log = None
+    t0 = time.monotonic()
+    opened = set()
+    market_data = getattr(app, "market_data", None)
+    quotes = getattr(app, "quotes", None)
+    for ts, method, args in read_log(path):
+        if methods is not None and method not in methods:
+            continue
+        if method.startswith("tick") and args and args[0] not in opened:
+            opened.add(args[0])
+            if market_data is not None:
+                market_data.setdefault(args[0], {})
+            if quotes is not None:
+                quotes.open(args[0])
+        if speed:
+            if t0_log is None:
+                t0_log = ts
+            delay = (ts - t0_log) / 1e9 / speed - (time.monotonic() - t0)
+            if delay > 0:
+                time.sleep(delay)
+        getattr(app, method)(*args)
+        count += 1
+    return count
+
+
+def dump(path: str):
+    counts = Counter()
+    first = last = None
+    for ts, method, _ in read_log(path):
+        counts[method] += 1
+        first = ts if first is None else first
+        last = ts
+    total = sum(counts.values())
+    span = (last - first) / 1e9 if total else 0.0
+    print(f"{path}: {total} callbacks over {span:.1f} s")
+    for method, n in counts.most_common():
+        print(f"  {method:<36}{n:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API 回调日志查看 / 回放")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_dump = sub.add_parser("dump", help="打印日志统计")
+    p_dump.add_argument("path")
+    p_replay = sub.add_parser("replay", help="回放日志到 IBApp")
+    p_replay.add_argument("path")
+    p_replay.add_argument("--speed", type=float, default=1.0, help="回放倍速, 0 表示尽可能快")
+    p_replay.add_argument("--quiet", action="store_true", help="屏蔽回调中的打印输出")
+    p_replay.add_argument("--profile", action="store_true", help="用 cProfile 分析回放过程")
+    args = parser.parse_args()
+
+    if args.command == "dump":
+        dump(args.path)
+        return
+
+    from IBOptionToolOffical import IBApp
+    app = IBApp()
+    out = open(os.devnull, "w") if args.quiet else sys.stdout
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        if args.profile:
+            import cProfile
+            import pstats
+            profiler = cProfile.Profile()
+            n = profiler.runcall(replay, args.path, app, args.speed)
+        else:
+            n = replay(args.path, app, args.speed)
+    elapsed = time.perf_counter() - t0
+    print(f"Replayed {n} callbacks in {elapsed:.3f} s")
+    if args.profile:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+reqSecDefOptParams 结果缓存: 到期日和行权价每天最多变化一次, 按标的 conId 缓存到当天收盘后失效
+(以美东交易日为界, 周末沿用周五的结果), 内存 + 磁盘 (JSON) 两级, 同一天内重启进程也不必重新请求.
+
+缓存的是解析后的有序数组: 每个 (tradingClass, expiry) 对应一个有序的行权价 numpy 数组,
+取链、找平值附近行权价都不再需要等待 IB 回报.
+"""
+
+import datetime
+import json
+import os
+import threading
+
+import numpy as np
+
+try:
+    from zoneinfo import ZoneInfo
+    _EASTERN = ZoneInfo("America/New_York")
+except Exception:  # 没有时区数据时按本地时间
+    _EASTERN = None
+
+# 默认的磁盘缓存路径, 可用环境变量 IB_SECDEF_CACHE 覆盖
+DEFAULT_PATH = os.environ.get(
+    "IB_SECDEF_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sec_def_cache.json"))
+
+
+def trading_day(now: datetime.datetime = None) -> str:
+    """当前的美东交易日 (YYYYMMDD); 周六、周日算作前一个周五."""
+    if now is None:
+        now = datetime.datetime.now(_EASTERN) if _EASTERN is not None else datetime.datetime.now()
+    day = now.date()
+    if day.weekday() >= 5:
+        day -= datetime.timedelta(days=day.weekday() - 4)
+    return day.strftime("%Y%m%d")
+
+
+class SecDefChain:
+    """
+    一个标的的期权链参数.
+    rows: 与 securityDefinitionOptionParameter 相同格式的原始行
+          (exchange, underlyingConId, tradingClass, multiplier, expirations, strikes);
+    各交易所的同一 tradingClass 合并为一份有序的到期日列表和行权价数组.
+    """
+    def __init__(self, rows):
+        self.rows = [(exchange, con_id, trading_class, multiplier, set(expirations), set(strikes))
+                     for exchange, con_id, trading_class, multiplier, expirations, strikes in rows]
+        merged = {}
+        for _, _, trading_class, multiplier, expirations, strikes in self.rows:
+            entry = merged.setdefault(trading_class, [multiplier, set(), set()])
+            entry[1].update(expirations)
+            entry[2].update(strikes)
+        self.multipliers = {tc: m for tc, (m, _, _) in merged.items()}
+        self._expirations = {tc: sorted(e) for tc, (_, e, _) in merged.items()}
+        # (tradingClass, expiry) -> 有序行权价; 同一 tradingClass 的各到期日共用一个数组
+        self._strikes = {}
+        for tc, (_, expirations, strikes) in merged.items():
+            array = np.array(sorted(strikes), dtype=float)
+            for expiry in expirations:
+                self._strikes[(tc, expiry)] = array
+
+    @property
+    def trading_classes(self) -> list:
+        return sorted(self._expirations)
+
+    def expirations(self, trading_class: str = None) -> list:
+        """有序到期日; trading_class 为 None 时合并所有 tradingClass."""
+        if trading_class is not None:
+            return self._expirations.get(trading_class, [])
+        return sorted({e for expirations in self._expirations.values() for e in expirations})
+
+    def strikes(self, trading_class: str, expiry: str) -> np.ndarray:
+        return self._strikes.get((trading_class, expiry), np.empty(0))
+
+    def near(self, trading_class: str, expiry: str, spot: float, count: int) -> np.ndarray:
+        """spot 上下各 count 档行权价."""
+        strikes = self.strikes(trading_class, expiry)
+        index = int(np.searchsorted(strikes, spot))
+        return strikes[max(0, index - count):index + count]
+
+
+class SecDefCache:
+    """
+    underlyingConId -> SecDefChain, 按交易日失效.
+    path: 磁盘缓存文件, None 表示只缓存在内存. 多个线程共享, 内部加锁.
+    """
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        # conId -> (交易日, SecDefChain)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def get(self, con_id: int):
+        """当天已缓存则返回 SecDefChain, 否则 None."""
+        day = trading_day()
+        with self._lock:
+            entry = self._entries.get(int(con_id))
+            if entry is not None and entry[0] == day:
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[int(con_id)]
+            self.misses += 1
+            return None
+
+    def put(self, con_id: int, rows) -> SecDefChain:
+        chain = SecDefChain(rows)
+        with self._lock:
+            self._entries[int(con_id)] = (trading_day(), chain)
+        self._save()
+        return chain
+
+    def invalidate(self, con_id: int = None):
+        """丢弃一个 (con_id 为 None 时全部) 标的的缓存."""
+        with self._lock:
+            if con_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(int(con_id), None)
+        self._save(merge=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    # ---- 磁盘 ----
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[SecDefCache] 无法读取 {self.path}: {e}")
+            return
+        day = trading_day()
+        for con_id, entry in data.items():
+            if entry.get("day") == day:
+                self._entries[int(con_id)] = (day, SecDefChain(entry["rows"]))
+
+    def _save(self, merge: bool = True):
+        if not self.path:
+            return
+        with self._lock:
+            # 同一文件可能被其他实例 (如 IBApp 与 IBOptionDataApp) 同时使用, 保留它们写入的当天条目
+            data = {}
+            if merge and os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        day = trading_day()
+                        data = {k: v for k, v in json.load(f).items() if v.get("day") == day}
+                except (OSError, ValueError):
+                    data = {}
+            data.update({str(con_id): {"day": day, "rows": [
+                            [exchange, uid, tc, multiplier, sorted(expirations), sorted(strikes)]
+                            for exchange, uid, tc, multiplier, expirations, strikes in chain.rows]}
+                         for con_id, (day, chain) in self._entries.items()})
+            # 先写临时文件再替换, 进程中途退出也不会留下半个文件
+            tmp = f"{self.path}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"[SecDefCache] 无法写入 {self.path}: {e}")
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大单拆分 (child order slicing): 把一张大的母单拆成若干子单依次下出, 每个子单各自追价,
+母单汇总成交数量并维护剩余预算, 避免一次挂出全部数量.
+
+拆分方式:
+  - "twap": 在 duration 秒内均匀下出 slices 个子单, 每个子单数量 = 剩余数量 / 剩余份数;
+  - "adaptive": 子单数量跟随对手方挂单量 (买单看 askSize, 卖单看 bidSize) x participation,
+                并限制在 [min_child, max_child] 之间, 上一个子单完成后立即下一个.
+
+预算: 母单整体均价不差于 final_price. 每个子单的终止价由剩余预算决定:
+    子单终止价 = (final_price x 总数量 - 已成交金额 - 在场子单未成交数量 x 其终止价) / 未分配数量,
+前面的子单成交得越好, 后面的子单可以追得越远; 在场子单全部按终止价成交时母单均价也不差于 final_price.
+"""
+
+import math
+import threading
+import time
+from functools import reduce
+
+from IBOptionToolOffical import DEAD_STATUSES, TERMINAL_STATUSES
+
+
+class SlicedOrder:
+    """
+    manager: OrderManager; legs: 与 place_option_order 相同格式, quantity 为母单的总数量.
+    init_price / final_price / step / interval: 每个子单的起始价、母单最差均价、追价步长和间隔.
+    max_active: 同时在场的子单数; child_timeout: 子单追到终止价后仍未成交多少秒即撤单, 未成交部分回到母单.
+    max_retries: 未成交完就结束 (撤单 / Inactive) 的子单超过这个数后不再下新子单 (剩余数量重下的次数上限);
+    deadline: 母单最长运行秒数 (None 为不限), 到时撤掉在场子单并结束.
+    """
+    def __init__(self, manager, legs, init_price: float, final_price: float, step: float,
+                 interval: float = 5.0, mode: str = "twap", slices: int = 6, duration: float = 300.0,
+                 participation: float = 0.5, min_child: int = 1, max_child: int = None,
+                 max_active: int = 1, child_timeout: float = 30.0, max_retries: int = 3,
+                 deadline: float = None, poll: float = 0.5):
+        if mode not in ("twap", "adaptive"):
+            raise ValueError(f"unknown slicing mode {mode}")
+        self.manager = manager
+        self.app = manager.app
+        self.init_price = init_price
+        self.final_price = final_price
+        self.step = step
+        self.interval = interval
+        self.mode = mode
+        self.slices = max(1, slices)
+        self.duration = duration
+        self.participation = participation
+        self.min_child = max(1, min_child)
+        self.max_child = max_child
+        self.max_active = max(1, max_active)
+        self.child_timeout = child_timeout
+        self.max_retries = max(0, max_retries)
+        self.deadline = deadline
+        self.poll = poll
+
+        quantities = [int(leg['quantity']) for leg in legs]
+        self.units = reduce(math.gcd, quantities) or 1
+        self.legs = [dict(leg, quantity=q // self.units) for leg, q in zip(legs, quantities)]
+        # 与 place_option_order 一致: 组合方向以第一腿为准
+        self.action = "BUY" if legs[0]['action'].upper() == "BUY" else "SELL"
+
+        # 子单: dict(order_id, quantity, final, thread, chase_done_at, filled, avg_price, done)
+        self.children = []
+        self._contract = None
+        self.result = None
+        self._thread = None
+
+    # ---- 对外接口 ----
+    def start(self) -> threading.Thread:
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+        return self._thread
+
+    def join(self, timeout: float = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.result
+
+    @property
+    def filled(self) -> float:
+        return sum(child["filled"] for child in self.children)
+
+    @property
+    def spent(self) -> float:
+        """已成交金额 (每单位价格 x 数量)."""
+        return sum(child["filled"] * child["avg_price"] for child in self.children)
+
+    @property
+    def reserved(self) -> float:
+        """在场子单未成交部分按各自终止价预留的金额."""
+        return sum((c["quantity"] - c["filled"]) * c["final"] for c in self.children if not c["done"])
+
+    def child_final_price(self, remaining: float) -> float:
+        """剩余预算 (扣除已成交和在场子单的预留) 下, 未分配的 remaining 数量可以接受的最差价格."""
+        if remaining <= 0:
+            return self.final_price
+        return (self.final_price * self.units - self.spent - self.reserved) / remaining
+
+    def worst_case_average(self, extra_quantity: float = 0.0, extra_final: float = 0.0) -> float:
+        """所有在场子单 (及新子单 extra) 都按终止价成交、未分配部分按 final_price 成交时的母单均价."""
+        working = sum(c["quantity"] - c["filled"] for c in self.children if not c["done"])
+        unassigned = self.units - self.filled - working - extra_quantity
+        total = self.spent + self.reserved + extra_quantity * extra_final + unassigned * self.final_price
+        return total / self.units
+
+    # ---- 子单 ----
+    def _next_size(self, unassigned: int) -> int:
+        launched = len(self.children)
+        size = math.ceil(unassigned / max(1, self.slices - launched))
+        if self.mode == "adaptive" and self._contract is not None:
+            snapshot = self.app.get_market_snapshot(self._contract)
+            displayed = snapshot.get("askSize" if self.action == "BUY" else "bidSize")
+            if displayed:
+                size = int(displayed * self.participation)
+        size = max(self.min_child, size)
+        if self.max_child:
+            size = min(self.max_child, size)
+        return min(size, unassigned)
+
+    def _launch(self, size: int, unassigned_after: int):
+        legs = [dict(leg, quantity=leg['quantity'] * size) for leg in self.legs]
+        order_id = self.manager.place_option_order(legs, order_type="LMT", limit_price=self.init_price)
+        if order_id is None:
+            return None
+        details = self.manager._order_details.get(order_id, {})
+        self._contract = details.get("contract", self._contract)
+        # 在场子单的未成交数量按其终止价预留预算
+        working = sum(c["quantity"] - c["filled"] for c in self.children if not c["done"])
+        remaining = self.units - self.filled - working
+        # 追价时终止价会再按最小变动价位向保守方向取整
+        final = self.child_final_price(remaining)
+        worst = self.worst_case_average(size, final)
+        sign = 1 if self.action == "BUY" else -1
+        if sign * (worst - self.final_price) > 1e-9:
+            # 不应发生 (预算公式保证), 保守地退回母单终止价
+            print(f"Slicing: worst-case average {worst:.4f} beyond final price {self.final_price:.4f}, "
+                  f"capping child final.")
+            final = self.final_price
+        print(f"Slicing: child order {order_id} for {size} ({unassigned_after} left unassigned), "
+              f"final price {final:.2f}")
+        child = {
+            "order_id": order_id, "quantity": size, "filled": 0.0, "avg_price": 0.0,
+            "final": final, "done": False, "chase_done_at": None,
+            "thread": self.manager.chase_order_to_final(order_id, self.step, final, self.interval),
+        }
+        self.children.append(child)
+        return child
+
+    def _update_children(self, now: float):
+        for child in self.children:
+            if child["done"]:
+                continue
+            info = self.app.get_order_status(child["order_id"]) or {}
+            child["filled"] = float(info.get("filled", 0.0) or 0.0)
+            child["avg_price"] = float(info.get("avgFillPrice", 0.0) or 0.0)
+            status = info.get("status")
+            if status in DEAD_STATUSES or child["filled"] >= child["quantity"] - 1e-9:
+                child["done"] = True
+                if status not in TERMINAL_STATUSES and child["filled"] < child["quantity"] - 1e-9:
+                    # Inactive (被拒绝) 的子单撤掉, 其追价线程随之结束
+                    print(f"Slicing: child order {child['order_id']} is {status}, cancelling.")
+                    self.app.cancelOrder(child["order_id"])
+                continue
+            if not child["thread"].is_alive():
+                if child["chase_done_at"] is None:
+                    child["chase_done_at"] = now
+                elif self.child_timeout is not None and now - child["chase_done_at"] > self.child_timeout:
+                    print(f"Slicing: child order {child['order_id']} not filled at final price, cancelling.")
+                    self.app.cancelOrder(child["order_id"])
+                    child["chase_done_at"] = float("inf")
+
+    @property
+    def failed_children(self) -> int:
+        """未成交完就结束的子单数."""
+        return sum(1 for c in self.children if c["done"] and c["filled"] < c["quantity"] - 1e-9)
+
+    def _cancel_active(self):
+        for child in self.children:
+            if not child["done"]:
+                self.app.cancelOrder(child["order_id"])
+                child["done"] = True
+
+    # ---- 主流程 ----
+    def _run(self):
+        t_start = time.monotonic()
+        next_launch = t_start
+        slot = self.duration / self.slices if self.mode == "twap" else 0.0
+        while True:
+            now = time.monotonic()
+            self._update_children(now)
+            if self.filled >= self.units - 1e-9:
+                break
+            if self.deadline is not None and now - t_start > self.deadline:
+                print(f"Slicing: deadline {self.deadline:g}s reached, cancelling working child orders.")
+                self._cancel_active()
+                break
+            active = [c for c in self.children if not c["done"]]
+            working = sum(c["quantity"] - c["filled"] for c in active)
+            unassigned = int(round(self.units - self.filled - working))
+            if self.failed_children > self.max_retries:
+                if not active:
+                    print(f"Slicing: {self.failed_children} child order(s) ended unfilled, stop.")
+                    break
+            elif unassigned > 0 and len(active) < self.max_active and now >= next_launch:
+                size = self._next_size(unassigned)
+                if self._launch(size, unassigned - size) is None:
+                    print("Slicing: failed to place child order, stop.")
+                    break
+                next_launch = now + slot
+            elif not active and unassigned <= 0:
+                break
+            time.sleep(self.poll)
+
+        for child in self.children:
+            child["thread"].join()
+        filled = self.filled
+        self.result = {
+            "quantity": self.units,
+            "filled": filled,
+            "avg_price": round(self.spent / filled, 4) if filled else None,
+            "children": len(self.children),
+            "elapsed": round(time.monotonic() - t_start, 3),
+        }
+        print(f"Slicing finished: filled {filled}/{self.units} in {len(self.children)} child order(s), "
+              f"avg price={self.result['avg_price']}, elapsed={self.result['elapsed']}s")
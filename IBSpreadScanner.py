@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+整条期权链的价差扫描: 列出一个标的在给定 DTE 区间、给定最大宽度内的
+全部垂直价差 (credit)、日历价差和铁鹰, 并逐个打分:
+    credit_width  中间价权利金 / 宽度 (垂直价差、铁鹰)
+    edge          中间价与对价 (natural: 卖在 bid、买在 ask) 之差, 越小越容易按中间价成交
+    pop           到期盈利概率 (按短腿隐含波动率的对数正态分布)
+    spread_pct    各腿中最大的买卖价差 / 中间价; size: 按对价成交时各腿可成交量的最小值
+
+期权链排成稠密的列式数组 (到期日 x 行权价 x P/C), 组合由行权价/到期日的下标对广播生成,
+打分全部是整列的 NumPy 运算, 不逐个组合循环. 组合数可达数百万, 用 --benchmark 测量.
+
+用法:
+    python IBSpreadScanner.py --symbol NKE --max-width 5 --min-dte 7 --max-dte 45 --rank-by pop
+    python IBSpreadScanner.py --benchmark --bench-expiries 12 --bench-strikes 200 --max-width 10
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from IBPayoff import bs_price, implied_vol, norm_cdf, norm_pdf
+
+RIGHTS = ("P", "C")
+KINDS = ("vertical", "calendar", "iron_condor")
+# 结果表的列; 价格均为每股, mid / natural 为净收入 (负数为净支出)
+# 行权价: 垂直价差 k1=短腿 k2=长腿; 日历 k1=k2=行权价; 铁鹰 k1 买 put, k2 卖 put, k3 卖 call, k4 买 call
+COLUMNS = ("kind", "right", "near", "far", "k1", "k2", "k3", "k4", "width", "mid", "natural", "edge",
+           "credit_width", "pop", "spread_pct", "size")
+# 可排序的指标, True 表示越大越好
+RANK_METRICS = {"credit_width": True, "pop": True, "edge": False, "spread_pct": False, "size": True,
+                "mid": True}
+# 日历价差估算盈利概率时, 近月到期时标的价格的网格点数
+CALENDAR_GRID = 48
+
+
+def _years(expiry: str, now: datetime.datetime) -> float:
+    close = datetime.datetime.strptime(expiry[:8], "%Y%m%d").replace(hour=16)
+    return max((close - now).total_seconds(), 43200.0) / (365.0 * 86400.0)
+
+
+def _prob_above(spot: float, level, vol, t, rate: float = 0.0) -> np.ndarray:
+    """到期时标的高于 level 的概率 (对数正态); level <= 0 为 1, 缺少波动率为 NaN."""
+    level, vol, t = np.broadcast_arrays(np.asarray(level, dtype=float), np.asarray(vol, dtype=float),
+                                        np.asarray(t, dtype=float))
+    out = np.full(level.shape, np.nan)
+    ok = np.isfinite(level) & np.isfinite(vol) & (vol > 0) & (level > 0)
+    sig_t = vol[ok] * np.sqrt(t[ok])
+    out[ok] = norm_cdf((np.log(spot / level[ok]) + (rate - 0.5 * vol[ok] ** 2) * t[ok]) / sig_t)
+    out[np.isfinite(level) & (level <= 0)] = 1.0
+    return out
+
+
+class OptionChain:
+    """
+    一个标的的稠密列式期权链: bid / ask / bid_size / ask_size / iv 均为 (到期日, 行权价, P/C) 形状,
+    未挂牌或没有报价处为 NaN. iv 不给时由中间价反解.
+    """
+    def __init__(self, symbol: str, spot: float, expiries, strikes, bid, ask, bid_size=None,
+                 ask_size=None, iv=None, now: datetime.datetime = None, rate: float = 0.0):
+        self.symbol = symbol
+        self.spot = float(spot)
+        self.rate = rate
+        self.expiries = [e[:8] for e in expiries]
+        self.strikes = np.asarray(strikes, dtype=float)
+        shape = (len(self.expiries), len(self.strikes), 2)
+        self.bid = np.asarray(bid, dtype=float).reshape(shape)
+        self.ask = np.asarray(ask, dtype=float).reshape(shape)
+        self.bid_size = (np.full(shape, np.nan) if bid_size is None
+                         else np.asarray(bid_size, dtype=float).reshape(shape))
+        self.ask_size = (np.full(shape, np.nan) if ask_size is None
+                         else np.asarray(ask_size, dtype=float).reshape(shape))
+        now = now or datetime.datetime.now()
+        self.today = now.date()
+        self.years = np.array([_years(e, now) for e in self.expiries])
+        self.dte = np.array([(datetime.datetime.strptime(e, "%Y%m%d").date() - self.today).days
+                             for e in self.expiries])
+
+        quoted = (self.bid > 0) & (self.ask >= self.bid)
+        self.mid = np.where(quoted, 0.5 * (self.bid + self.ask), np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.spread_pct = (self.ask - self.bid) / self.mid
+        if iv is None:
+            iv = np.full(shape, np.nan)
+            e, k, r = np.nonzero(quoted)
+            iv[e, k, r] = implied_vol(self.mid[e, k, r], self.spot, self.strikes[k], self.years[e], r == 1, rate)
+        self.iv = np.asarray(iv, dtype=float).reshape(shape)
+
+    @classmethod
+    def from_quotes(cls, symbol: str, spot: float, quoted, now: datetime.datetime = None):
+        """quoted: [(contract, quote)], quote 为 request_option_quote 返回的字段."""
+        expiries = sorted({c.lastTradeDateOrContractMonth[:8] for c, _ in quoted})
+        strikes = np.unique([c.strike for c, _ in quoted])
+        shape = (len(expiries), len(strikes), 2)
+        columns = {name: np.full(shape, np.nan) for name in ("bid", "ask", "bid_size", "ask_size")}
+        expiry_index = {e: i for i, e in enumerate(expiries)}
+        for c, quote in quoted:
+            at = (expiry_index[c.lastTradeDateOrContractMonth[:8]], int(np.searchsorted(strikes, c.strike)),
+                  1 if c.right.upper().startswith("C") else 0)
+            for name, column in columns.items():
+                value = quote.get(name)
+                if value is not None and value > 0:
+                    column[at] = value
+        return cls(symbol, spot, expiries, strikes, now=now, **columns)
+
+    def expiry_range(self, min_dte: int = 0, max_dte: int = None) -> np.ndarray:
+        """DTE 在 [min_dte, max_dte] 内的到期日下标."""
+        ok = self.dte >= min_dte
+        if max_dte is not None:
+            ok &= self.dte <= max_dte
+        return np.nonzero(ok)[0]
+
+
+def fetch_chain(app, symbol: str, min_dte: int = 0, max_dte: int = 60, strikes: int = 1000,
+                rate: float = 45.0, max_inflight: int = 40, timeout: float = 3.0) -> OptionChain:
+    """用 IBChainScanner.ChainFetcher (限速并发) 拉取 max_dte 以内、标的上下各 strikes 档的报价."""
+    from IBChainScanner import ChainFetcher
+
+    fetcher = ChainFetcher(app, rate=rate, max_inflight=max_inflight, timeout=timeout)
+    quoted = fetcher.fetch_quotes([symbol], expiries=1000, strikes=strikes, max_dte=max_dte)
+    if not quoted:
+        raise ValueError(f"no option quotes for {symbol}")
+    chain = OptionChain.from_quotes(symbol, quoted[0][1], [(c, q) for _, _, c, q in quoted])
+    keep = chain.expiry_range(min_dte, max_dte)
+    chain.expiries = [chain.expiries[i] for i in keep]
+    for name in ("bid", "ask", "bid_size", "ask_size", "mid", "spread_pct", "iv"):
+        setattr(chain, name, getattr(chain, name)[keep])
+    chain.years, chain.dte = chain.years[keep], chain.dte[keep]
+    return chain
+
+
+# ---- 组合生成与打分 ----
+def _table(kind: int, right, near, far, k1, k2, k3, k4, width, mid, natural, pop, spread, size) -> dict:
+    n = len(mid)
+    full = lambda value, dtype=float: np.broadcast_to(np.asarray(value, dtype=dtype), (n,))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        credit_width = mid / width
+    return {
+        "kind": full(kind, np.int8), "right": full(right, np.int8),
+        "near": full(near, np.int16), "far": full(far, np.int16),
+        "k1": full(k1), "k2": full(k2), "k3": full(k3), "k4": full(k4), "width": full(width),
+        "mid": mid, "natural": natural, "edge": mid - natural, "credit_width": credit_width,
+        "pop": pop, "spread_pct": spread, "size": size,
+    }
+
+
+def _concat(tables) -> dict:
+    tables = [t for t in tables if len(t["mid"])]
+    if not tables:
+        return {name: np.empty(0) for name in COLUMNS}
+    return {name: np.concatenate([t[name] for t in tables]) for name in COLUMNS}
+
+
+def _strike_pairs(strikes: np.ndarray, max_width: float):
+    """宽度在 (0, max_width] 内的行权价下标对 (lo, hi), lo < hi."""
+    width = strikes[None, :] - strikes[:, None]
+    return np.nonzero((width > 0) & (width <= max_width + 1e-9))
+
+
+def _credit_verticals(chain: OptionChain, expiries: np.ndarray, max_width: float, right: int):
+    """
+    指定到期日的全部 credit 垂直价差的列 (每列形状为 (到期日数, 行权价对数)):
+    put 卖高买低, call 卖低买高.
+    """
+    lo, hi = _strike_pairs(chain.strikes, max_width)
+    short, long = (hi, lo) if right == 0 else (lo, hi)
+    e = expiries[:, None]
+    mid = chain.mid[e, short, right] - chain.mid[e, long, right]
+    natural = chain.bid[e, short, right] - chain.ask[e, long, right]
+    k_short = np.broadcast_to(chain.strikes[short], mid.shape)
+    breakeven = k_short - mid if right == 0 else k_short + mid
+    above = _prob_above(chain.spot, breakeven, chain.iv[e, short, right], chain.years[e], chain.rate)
+    return {
+        "near": np.broadcast_to(e, mid.shape),
+        "short": k_short,
+        "long": np.broadcast_to(chain.strikes[long], mid.shape),
+        "width": np.broadcast_to(chain.strikes[hi] - chain.strikes[lo], mid.shape),
+        "mid": mid, "natural": natural,
+        "pop": above if right == 0 else 1.0 - above,
+        "spread": np.fmax(chain.spread_pct[e, short, right], chain.spread_pct[e, long, right]),
+        "size": np.fmin(chain.bid_size[e, short, right], chain.ask_size[e, long, right]),
+        "iv": chain.iv[e, short, right],
+    }
+
+
+def _credit_ok(v: dict) -> np.ndarray:
+    """有报价、收入为正且小于宽度 (收入超过宽度是报价异常, 多见于深度实值)."""
+    return np.isfinite(v["mid"]) & np.isfinite(v["natural"]) & (v["mid"] > 0) & (v["mid"] < v["width"])
+
+
+def verticals(chain: OptionChain, expiries: np.ndarray, max_width: float) -> dict:
+    tables = []
+    for right in (0, 1):
+        v = _credit_verticals(chain, expiries, max_width, right)
+        ok = _credit_ok(v)
+        tables.append(_table(0, right, v["near"][ok], v["near"][ok], v["short"][ok], v["long"][ok],
+                             np.nan, np.nan, v["width"][ok], v["mid"][ok], v["natural"][ok], v["pop"][ok],
+                             v["spread"][ok], v["size"][ok]))
+    return _concat(tables)
+
+
+def iron_condors(chain: OptionChain, expiries: np.ndarray, max_width: float, equal_wings: bool = False,
+                 chunk: int = 1 << 22) -> dict:
+    """同一到期日的 put credit 价差 x call credit 价差 (卖 put 行权价 <= 卖 call 行权价), 按块广播."""
+    tables = []
+    for e in expiries:
+        sides = []
+        for right in (0, 1):
+            v = _credit_verticals(chain, np.array([e]), max_width, right)
+            ok = _credit_ok(v)[0]
+            sides.append({name: column[0][ok] for name, column in v.items()})
+        put, call = sides
+        if not len(put["mid"]) or not len(call["mid"]):
+            continue
+        step = max(1, chunk // len(call["mid"]))
+        for start in range(0, len(put["mid"]), step):
+            p = {name: column[start:start + step] for name, column in put.items()}
+            mask = p["short"][:, None] <= call["short"][None, :]
+            if equal_wings:
+                mask &= p["width"][:, None] == call["width"][None, :]
+            i, j = np.nonzero(mask)
+            width = np.fmax(p["width"][i], call["width"][j])
+            mid = p["mid"][i] + call["mid"][j]
+            keep = mid < width
+            i, j, width, mid = i[keep], j[keep], width[keep], mid[keep]
+            pop = (_prob_above(chain.spot, p["short"][i] - mid, p["iv"][i], chain.years[e], chain.rate)
+                   - _prob_above(chain.spot, call["short"][j] + mid, call["iv"][j], chain.years[e], chain.rate))
+            tables.append(_table(2, -1, e, e, p["long"][i], p["short"][i], call["short"][j], call["long"][j],
+                                 width, mid, p["natural"][i] + call["natural"][j],
+                                 np.clip(pop, 0.0, 1.0), np.fmax(p["spread"][i], call["spread"][j]),
+                                 np.fmin(p["size"][i], call["size"][j])))
+    return _concat(tables)
+
+
+def calendars(chain: OptionChain, expiries: np.ndarray, chunk: int = 1 << 20) -> dict:
+    """
+    同一行权价、买远月卖近月. 盈利概率: 近月到期时 (远月期权按远月 IV 的理论价 - 近月内在价值) 高于
+    支付的净权利金的概率, 在 CALENDAR_GRID 个标的价格点上按对数正态积分.
+    """
+    near, far = np.triu_indices(len(expiries), k=1)
+    near, far = expiries[near], expiries[far]
+    n, f = near[:, None, None], far[:, None, None]
+    k = np.arange(len(chain.strikes))[None, :, None]
+    r = np.arange(2)[None, None, :]
+    shape = (len(near), len(chain.strikes), 2)
+    mid = chain.mid[n, k, r] - chain.mid[f, k, r]
+    natural = chain.bid[n, k, r] - chain.ask[f, k, r]
+    ok = np.isfinite(mid) & np.isfinite(natural) & (mid < 0) & np.isfinite(chain.iv[n, k, r]) \
+        & np.isfinite(chain.iv[f, k, r])
+    idx = np.nonzero(ok)
+    near_e = np.broadcast_to(n, shape)[idx]
+    far_e = np.broadcast_to(f, shape)[idx]
+    strike_i = np.broadcast_to(k, shape)[idx]
+    right = np.broadcast_to(r, shape)[idx]
+    strike = chain.strikes[strike_i]
+    debit = -mid[idx]
+
+    z = np.linspace(-4.0, 4.0, CALENDAR_GRID)
+    weight = norm_pdf(z)
+    weight /= weight.sum()
+    pop = np.empty(len(debit))
+    t_near, t_far = chain.years[near_e], chain.years[far_e]
+    iv_near, iv_far = chain.iv[near_e, strike_i, right], chain.iv[far_e, strike_i, right]
+    step = max(1, chunk // CALENDAR_GRID)
+    for s in range(0, len(debit), step):
+        sl = slice(s, s + step)
+        sig_t = (iv_near[sl] * np.sqrt(t_near[sl]))[:, None]
+        prices = chain.spot * np.exp(-0.5 * sig_t ** 2 + sig_t * z[None, :])
+        is_call = (right[sl] == 1)[:, None]
+        k_ = strike[sl][:, None]
+        value = (bs_price(prices, k_, (t_far[sl] - t_near[sl])[:, None], iv_far[sl][:, None], is_call, chain.rate)
+                 - np.where(is_call, np.maximum(prices - k_, 0.0), np.maximum(k_ - prices, 0.0)))
+        pop[sl] = ((value > debit[sl][:, None]) * weight[None, :]).sum(axis=1)
+
+    return _table(1, right, near_e, far_e, strike, strike, np.nan, np.nan, np.nan, mid[idx], natural[idx], pop,
+                  np.fmax(chain.spread_pct[near_e, strike_i, right], chain.spread_pct[far_e, strike_i, right]),
+                  np.fmin(chain.bid_size[near_e, strike_i, right], chain.ask_size[far_e, strike_i, right]))
+
+
+def scan_spreads(chain: OptionChain, max_width: float, min_dte: int = 0, max_dte: int = None,
+                 kinds=KINDS, equal_wings: bool = False) -> dict:
+    """返回列式结果表 {列名: 数组} (列见 COLUMNS), 每行一个候选组合."""
+    expiries = chain.expiry_range(min_dte, max_dte)
+    tables = []
+    if "vertical" in kinds:
+        tables.append(verticals(chain, expiries, max_width))
+    if "calendar" in kinds:
+        tables.append(calendars(chain, expiries))
+    if "iron_condor" in kinds:
+        tables.append(iron_condors(chain, expiries, max_width, equal_wings))
+    return _concat(tables)
+
+
+def top(table: dict, by: str = "credit_width", n: int = 20, min_pop: float = None,
+        max_spread_pct: float = None, min_size: float = None, kind: str = None) -> np.ndarray:
+    """按指标取前 n 行的下标; 过滤条件中缺失的买卖量视为满足."""
+    values = table[by]
+    ok = np.isfinite(values)
+    if kind is not None:
+        ok &= table["kind"] == KINDS.index(kind)
+    if min_pop is not None:
+        ok &= table["pop"] >= min_pop
+    if max_spread_pct is not None:
+        ok &= table["spread_pct"] <= max_spread_pct
+    if min_size is not None:
+        ok &= ~(table["size"] < min_size)
+    rows = np.nonzero(ok)[0]
+    key = -values[rows] if RANK_METRICS[by] else values[rows]
+    if len(rows) > n:
+        part = np.argpartition(key, n)[:n]
+        rows, key = rows[part], key[part]
+    return rows[np.argsort(key, kind="stable")]
+
+
+def to_legs(chain: OptionChain, table: dict, row: int, quantity: int = 1) -> list:
+    """
+    结果表的一行 -> OrderManager.place_option_order 的 legs, 与 IBStrategyBuilder 相同的形式:
+    组合方向以第一腿为准, 收权利金的垂直价差 / 铁鹰卖出的腿在前 (SELL 组合),
+    日历买远月的腿在前 (BUY 组合); 对应的限价见 limit_price().
+    """
+    kind = KINDS[table["kind"][row]]
+    near, far = chain.expiries[table["near"][row]], chain.expiries[table["far"][row]]
+    k = [float(table[c][row]) for c in ("k1", "k2", "k3", "k4")]
+    leg = lambda expiry, strike, right, action: {
+        "underlying": chain.symbol, "lastTradeDate": expiry, "strike": strike, "right": right,
+        "action": action, "quantity": quantity}
+    if kind == "vertical":
+        right = RIGHTS[table["right"][row]]
+        return [leg(near, k[0], right, "SELL"), leg(near, k[1], right, "BUY")]
+    if kind == "calendar":
+        right = RIGHTS[table["right"][row]]
+        return [leg(far, k[0], right, "BUY"), leg(near, k[0], right, "SELL")]
+    return [leg(near, k[1], "P", "SELL"), leg(near, k[0], "P", "BUY"),
+            leg(near, k[2], "C", "SELL"), leg(near, k[3], "C", "BUY")]
+
+
+def limit_price(table: dict, row: int, column: str = "mid") -> float:
+    """to_legs 那一行的组合限价 (按 mid 或 natural): SELL 组合为收到的净价, BUY 日历为支付的净价, 均为正数."""
+    value = float(table[column][row])
+    return -value if KINDS[table["kind"][row]] == "calendar" else value
+
+
+def describe(chain: OptionChain, table: dict, row: int) -> str:
+    kind = KINDS[table["kind"][row]]
+    near, far = chain.expiries[table["near"][row]], chain.expiries[table["far"][row]]
+    if kind == "vertical":
+        return f"{near} {RIGHTS[table['right'][row]]} -{table['k1'][row]:g}/+{table['k2'][row]:g}"
+    if kind == "calendar":
+        return f"{near}/{far} {RIGHTS[table['right'][row]]} {table['k1'][row]:g}"
+    return f"{near} IC {table['k1'][row]:g}/{table['k2'][row]:g}/{table['k3'][row]:g}/{table['k4'][row]:g}"
+
+
+def print_top(chain: OptionChain, table: dict, rows, by: str):
+    print(f"\n======== {chain.symbol} spreads ranked by {by} (spot {chain.spot:.2f}) ========")
+    print(f"{'kind':<12}{'legs':<34}{'mid':>8}{'natural':>9}{'cr/w':>7}{'pop':>7}{'spread%':>9}{'size':>7}")
+    for i in rows:
+        print(f"{KINDS[table['kind'][i]]:<12}{describe(chain, table, i):<34}{table['mid'][i]:>8.2f}"
+              f"{table['natural'][i]:>9.2f}{table['credit_width'][i]:>7.2f}{table['pop'][i]:>7.2f}"
+              f"{table['spread_pct'][i] * 100:>9.1f}{table['size'][i]:>7.0f}")
+    print("=" * 86)
+
+
+# ---- 基准测试 ----
+def synthetic_chain(expiries: int = 12, strikes: int = 200, spot: float = 100.0, step: float = 1.0,
+                    seed: int = 0) -> OptionChain:
+    """带波动率微笑、买卖价差和随机挂单量的合成期权链, 每周一个到期日."""
+    rng = np.random.default_rng(seed)
+    today = datetime.date.today()
+    dates = [(today + datetime.timedelta(days=7 * (i + 1))).strftime("%Y%m%d") for i in range(expiries)]
+    k = spot + step * (np.arange(strikes) - strikes // 2)
+    k = k[k > 0]
+    t = np.array([_years(d, datetime.datetime.now()) for d in dates])[:, None, None]
+    m = np.log(k / spot)[None, :, None]
+    vol = 0.30 - 0.10 * m + 0.40 * m * m
+    price = bs_price(spot, k[None, :, None], t, vol, np.array([False, True])[None, None, :])
+    half = np.clip(0.03 * price, 0.01, 0.15) * rng.uniform(0.5, 1.5, price.shape)
+    listed = price >= 0.02
+    bid = np.where(listed, np.round(price - half, 2), np.nan)
+    ask = np.where(listed, np.round(price + half, 2), np.nan)
+    bid = np.where(bid > 0, bid, np.nan)
+    sizes = rng.integers(1, 200, (2,) + price.shape).astype(float)
+    return OptionChain("SYN", spot, dates, k, bid, ask, sizes[0], sizes[1], iv=np.where(listed, vol, np.nan))
+
+
+def benchmark(expiries: int = 12, strikes: int = 200, max_width: float = 10.0, equal_wings: bool = False):
+    chain = synthetic_chain(expiries, strikes)
+    print(f"Synthetic chain: {len(chain.expiries)} expiries x {len(chain.strikes)} strikes x 2, "
+          f"max width {max_width:g}")
+    every = chain.expiry_range()
+    for name, build in (("vertical", lambda: verticals(chain, every, max_width)),
+                        ("calendar", lambda: calendars(chain, every)),
+                        ("iron_condor", lambda: iron_condors(chain, every, max_width, equal_wings))):
+        t0 = time.perf_counter()
+        table = build()
+        elapsed = time.perf_counter() - t0
+        rows = len(table["mid"])
+        print(f"{name:<12}{rows:>12,} candidates {elapsed * 1e3:>10.1f} ms "
+              f"({rows / max(elapsed, 1e-9) / 1e6:.1f} M/s)")
+    t0 = time.perf_counter()
+    table = scan_spreads(chain, max_width, equal_wings=equal_wings)
+    t1 = time.perf_counter()
+    rows = top(table, "credit_width", 20, min_pop=0.6)
+    t2 = time.perf_counter()
+    print(f"full scan {len(table['mid']):,} candidates in {(t1 - t0) * 1e3:.1f} ms, "
+          f"top 20 in {(t2 - t1) * 1e3:.1f} ms")
+    print_top(chain, table, rows, "credit_width")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="整条期权链的价差扫描")
+    parser.add_argument("--symbol", default="NKE")
+    parser.add_argument("--max-width", type=float, default=5.0, help="垂直价差 / 铁鹰单边的最大宽度")
+    parser.add_argument("--min-dte", type=int, default=0)
+    parser.add_argument("--max-dte", type=int, default=45)
+    parser.add_argument("--strikes", type=int, default=30, help="标的价上下各取几档行权价")
+    parser.add_argument("--kinds", nargs="*", default=list(KINDS), choices=KINDS)
+    parser.add_argument("--equal-wings", action="store_true", help="铁鹰两翼宽度相同")
+    parser.add_argument("--rank-by", default="credit_width", choices=sorted(RANK_METRICS))
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--min-pop", type=float, default=None)
+    parser.add_argument("--max-spread", type=float, default=None, help="最大买卖价差比例, 如 0.1")
+    parser.add_argument("--min-size", type=float, default=None)
+    parser.add_argument("--benchmark", action="store_true", help="用合成期权链测量组合生成与打分的速度")
+    parser.add_argument("--bench-expiries", type=int, default=12)
+    parser.add_argument("--bench-strikes", type=int, default=200)
+    parser.add_argument("--host", default=os.environ.get("IB_TWS_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("IB_TWS_PORT", "7496")))
+    parser.add_argument("--client-id", type=int, default=6)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.bench_expiries, args.bench_strikes, args.max_width, args.equal_wings)
+        return
+
+    from IBPriceOffical import IBOptionDataApp
+
+    app = IBOptionDataApp()
+    app.verbose = False
+    print("尝试连接 TWS/网关...")
+    app.connect(args.host, args.port, clientId=args.client_id)
+    threading.Thread(target=app.run, daemon=True).start()
+    t0 = time.time()
+    while app.next_order_id is None and time.time() - t0 < 5:
+        time.sleep(0.1)
+    if app.next_order_id is None:
+        print("未能连接到 TWS/网关.")
+        sys.exit(1)
+    try:
+        chain = fetch_chain(app, args.symbol, args.min_dte, args.max_dte, args.strikes)
+        t0 = time.perf_counter()
+        table = scan_spreads(chain, args.max_width, kinds=args.kinds, equal_wings=args.equal_wings)
+        rows = top(table, args.rank_by, args.top, args.min_pop, args.max_spread, args.min_size)
+        print(f"Scored {len(table['mid']):,} candidates in {(time.perf_counter() - t0) * 1e3:.1f} ms")
+        print_top(chain, table, rows, args.rank_by)
+    finally:
+        app.disconnect()
+
+
+if __name__ == "__main__":
+    main()
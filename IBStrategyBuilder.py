@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常见期权策略的腿生成器: 跨式、宽跨式、垂直价差、铁鹰、日历、双对角、比例价差.
+行权价和到期日从期权链索引 (IBChainIndex.ChainIndex) 中选取, 生成的 legs 与
+OrderManager.place_option_order 的格式相同, 并已带上 conId, 下单时不再请求合约详情.
+
+到期日参数: "YYYYMMDD", 或整数 n 表示 DTE >= n 的最近到期日.
+行权价参数:
+    82.5        最接近 82.5 的挂牌行权价
+    "atm"       最接近标的价的行权价; "atm+2" / "atm-1" 为平值向上/向下若干档
+    "25d"       delta 为 0.25 的行权价 (按腿的 C/P 方向)
+    "1.5s"      距标的价 1.5 个标准差 (σ√t) 的虚值行权价: put 在下方, call 在上方
+
+同一进程、同一交易日内, 各生成器共用一个索引; 每个到期日的整条链只请求一次.
+
+    builder = StrategyBuilder(app, "NKE")
+    legs = builder.iron_condor(30, short_put="20d", short_call="20d", width=2)
+    manager.place_option_order(legs, order_type="LMT", limit_price=1.20)
+"""
+
+import re
+import sys
+import threading
+import time
+
+from ibapi.contract import Contract
+
+from IBChainIndex import ChainIndex
+from IBPayoff import implied_vol
+from IBSecDefCache import trading_day
+
+########################################################
+# 预览参数 (python IBStrategyBuilder.py)
+preview_symbol = "NKE"
+preview_strategy = "iron_condor"
+preview_args = {"expiry": 30, "short_put": "20d", "short_call": "20d", "width": 2}
+########################################################
+
+# (symbol, 交易日) -> ChainIndex, 同一进程内的生成器共用
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+_ATM = re.compile(r"^atm([+-]\d+)?$")
+
+
+def _flip(legs):
+    return [dict(leg, action="SELL" if leg["action"] == "BUY" else "BUY") for leg in legs]
+
+
+class StrategyBuilder:
+    """
+    app: 已连接的 IBApp (OrderManager.app); symbol: 标的.
+    spot: 标的价, 不给时取一次快照中间价;
+    vol: 按 delta / 标准差选行权价时使用的波动率, 不给时用该到期日平值 call 的快照反推 (每个到期日一次).
+    """
+    def __init__(self, app, symbol: str, spot: float = None, vol: float = None,
+                 exchange: str = "SMART", currency: str = "USD", timeout: float = 5.0):
+        self.app = app
+        self.symbol = symbol
+        self.spot = spot
+        self.vol = vol
+        self.exchange = exchange
+        self.currency = currency
+        self.timeout = timeout
+        self._vols = {}
+        self._index = None
+
+    # ---- 索引 ----
+    def _stock(self) -> Contract:
+        stock = Contract()
+        stock.symbol = self.symbol
+        stock.secType = "STK"
+        stock.exchange = self.exchange
+        stock.currency = self.currency
+        return stock
+
+    @property
+    def index(self) -> ChainIndex:
+        if self._index is None:
+            key = (self.symbol, trading_day())
+            with _indexes_lock:
+                self._index = _indexes.get(key)
+            if self._index is None:
+                stock = self.app.resolve_contract(self._stock(), timeout=self.timeout)
+                if stock is None:
+                    raise ValueError(f"cannot resolve underlying {self.symbol}")
+                index = ChainIndex.from_app(self.app, self.symbol, stock.conId, timeout=self.timeout)
+                if index is None:
+                    raise ValueError(f"no option chain for {self.symbol}")
+                with _indexes_lock:
+                    self._index = _indexes.setdefault(key, index)
+        return self._index
+
+    def _mid(self, contract: Contract):
+        snapshot = self.app.get_market_snapshot(contract, timeout=self.timeout)
+        bid, ask = snapshot.get("bid", 0.0), snapshot.get("ask", 0.0)
+        if bid and ask and bid > 0 and ask > 0:
+            return (bid + ask) / 2.0
+        return snapshot.get("last") or None
+
+    def _spot(self) -> float:
+        if self.spot is None:
+            self.spot = self._mid(self._stock())
+            if self.spot is None:
+                raise ValueError(f"no price for {self.symbol}")
+        return self.spot
+
+    def expiry(self, spec) -> str:
+        """到期日参数 -> YYYYMMDD, 并确保该到期日的整条链 (conId) 已载入."""
+        index = self.index
+        expiry = index.nearest_expiry(spec) if isinstance(spec, int) else str(spec)[:8]
+        if expiry is None or not index.load_contracts(self.app, expiry, self.exchange, self.currency,
+                                                      self.timeout):
+            raise ValueError(f"{self.symbol}: no contracts for expiry {spec}")
+        return expiry
+
+    def _vol(self, expiry: str) -> float:
+        if self.vol is not None:
+            return self.vol
+        if expiry not in self._vols:
+            index = self.index
+            strike = index.nearest_strike(expiry, self._spot())
+            contract = Contract()
+            contract.conId = index.con_id(expiry, strike, "C") or 0
+            contract.exchange = self.exchange
+            mid = self._mid(contract) if contract.conId else None
+            if not mid:
+                raise ValueError(f"{self.symbol} {expiry}: no ATM quote to estimate volatility, pass vol=")
+            self._vols[expiry] = float(implied_vol(mid, self._spot(), strike, index.years(expiry), True))
+        return self._vols[expiry]
+
+    def strike(self, expiry: str, spec, right: str) -> float:
+        """行权价参数 -> 挂牌行权价."""
+        index = self.index
+        right = right.upper()[:1]
+        if isinstance(spec, (int, float)):
+            strike = index.nearest_strike(expiry, float(spec))
+        else:
+            spec = str(spec).strip().lower()
+            atm = _ATM.match(spec)
+            if atm:
+                strike = index.nearest_strike(expiry, self._spot())
+                if atm.group(1):
+                    strike = self.offset(expiry, strike, int(atm.group(1)))
+            elif spec.endswith("d"):
+                delta = float(spec[:-1])
+                delta = delta / 100.0 if delta > 1 else delta
+                strike = index.strike_for_delta(expiry, right, delta, self._spot(), self._vol(expiry))
+            elif spec.endswith("s"):
+                k = abs(float(spec[:-1]))
+                strike = index.strike_for_sigma(expiry, self._spot(), k if right == "C" else -k,
+                                                self._vol(expiry))
+            else:
+                raise ValueError(f"unknown strike spec {spec!r}")
+        if strike is None:
+            raise ValueError(f"{self.symbol} {expiry}: no strike for {spec!r}")
+        return strike
+
+    def offset(self, expiry: str, strike: float, steps: int) -> float:
+        """strike 向上 (steps > 0) 或向下若干档的挂牌行权价."""
+        strikes = self.index.strikes(expiry)
+        i = int(strikes.searchsorted(strike)) + steps
+        if not 0 <= i < len(strikes):
+            raise ValueError(f"{self.symbol} {expiry}: no strike {steps:+d} steps from {strike:g}")
+        return float(strikes[i])
+
+    def _leg(self, expiry: str, strike: float, right: str, action: str, quantity: int) -> dict:
+        leg = self.index.leg(expiry, strike, right, action, quantity)
+        if "conId" not in leg:
+            raise ValueError(f"{self.symbol} {expiry} {strike:g}{right} is not listed")
+        leg["exchange"] = self.exchange
+        leg["currency"] = self.currency
+        return leg
+
+    # ---- 策略 ----
+    # 组合单的方向以第一腿为准 (见 place_option_order), 各生成器把与 action 同向的腿放在最前:
+    # action="SELL" 的组合按 SELL 下单, 限价为收到的净价 (正数), 各腿按这里给出的方向成交.
+    def straddle(self, expiry, strike="atm", action: str = "BUY", quantity: int = 1) -> list:
+        expiry = self.expiry(expiry)
+        k = self.strike(expiry, strike, "C")
+        action = action.upper()
+        return [self._leg(expiry, k, "C", action, quantity), self._leg(expiry, k, "P", action, quantity)]
+
+    def strangle(self, expiry, put="25d", call="25d", action: str = "BUY", quantity: int = 1) -> list:
+        expiry = self.expiry(expiry)
+        action = action.upper()
+        return [self._leg(expiry, self.strike(expiry, put, "P"), "P", action, quantity),
+                self._leg(expiry, self.strike(expiry, call, "C"), "C", action, quantity)]
+
+    def vertical(self, expiry, right: str, buy, sell, quantity: int = 1) -> list:
+        """买 buy、卖 sell 两个行权价的同类期权 (牛市 call 价差: buy="atm", sell="atm+2")."""
+        expiry = self.expiry(expiry)
+        return [self._leg(expiry, self.strike(expiry, buy, right), right, "BUY", quantity),
+                self._leg(expiry, self.strike(expiry, sell, right), right, "SELL", quantity)]
+
+    def iron_condor(self, expiry, short_put="20d", short_call="20d", width: int = 1,
+                    action: str = "SELL", quantity: int = 1) -> list:
+        """卖出 short_put / short_call, 买入再往外 width 档的保护腿; action="BUY" 为反向铁鹰."""
+        expiry = self.expiry(expiry)
+        put = self.strike(expiry, short_put, "P")
+        call = self.strike(expiry, short_call, "C")
+        legs = [self._leg(expiry, put, "P", "SELL", quantity),
+                self._leg(expiry, self.offset(expiry, put, -width), "P", "BUY", quantity),
+                self._leg(expiry, call, "C", "SELL", quantity),
+                self._leg(expiry, self.offset(expiry, call, width), "C", "BUY", quantity)]
+        return legs if action.upper() == "SELL" else _flip(legs)
+
+    def calendar(self, near, far, strike="atm", right: str = "C", action: str = "BUY",
+                 quantity: int = 1) -> list:
+        """买远月、卖近月同一行权价; action="SELL" 为反向日历."""
+        near, far = self.expiry(near), self.expiry(far)
+        k = self.strike(near, strike, right)
+        legs = [self._leg(far, k, right, "BUY", quantity), self._leg(near, k, right, "SELL", quantity)]
+        return legs if action.upper() == "BUY" else _flip(legs)
+
+    def double_diagonal(self, near, far, put="25d", call="25d", width: int = 1, action: str = "BUY",
+                        quantity: int = 1) -> list:
+        """卖近月 put / call, 买远月再往外 width 档的 put / call; action="SELL" 为反向."""
+        near, far = self.expiry(near), self.expiry(far)
+        put_k = self.strike(near, put, "P")
+        call_k = self.strike(near, call, "C")
+        legs = [self._leg(far, self.offset(far, put_k, -width), "P", "BUY", quantity),
+                self._leg(far, self.offset(far, call_k, width), "C", "BUY", quantity),
+                self._leg(near, put_k, "P", "SELL", quantity),
+                self._leg(near, call_k, "C", "SELL", quantity)]
+        return legs if action.upper() == "BUY" else _flip(legs)
+
+    def ratio_spread(self, expiry, right: str, buy, sell, ratio=(1, 2), quantity: int = 1) -> list:
+        """买 ratio[0] 份 buy、卖 ratio[1] 份 sell (例如 1x2 call 比例价差)."""
+        expiry = self.expiry(expiry)
+        return [self._leg(expiry, self.strike(expiry, buy, right), right, "BUY", ratio[0] * quantity),
+                self._leg(expiry, self.strike(expiry, sell, right), right, "SELL", ratio[1] * quantity)]
+
+
+def print_legs(legs):
+    for i, leg in enumerate(legs, start=1):
+        print(f"Leg {i}: {leg['action']:4} {leg['quantity']} {leg['underlying']} {leg['lastTradeDate']} "
+              f"{leg['strike']:g}{leg['right']} (conId {leg.get('conId')})")
+
+
+def main():
+    from IBOptionToolOffical import IBApp, TWS_HOST, TWS_PORT
+
+    app = IBApp()
+    print("Connecting to IB API...")
+    try:
+        app.connect(TWS_HOST, TWS_PORT, clientId=5)
+    except Exception as e:
+        print("Could not connect to IB API:", e)
+        sys.exit(1)
+    threading.Thread(target=app.run, daemon=True).start()
+    for _ in range(30):
+        if app.next_order_id is not None:
+            break
+        time.sleep(0.1)
+
+    builder = StrategyBuilder(app, preview_symbol)
+    t0 = time.perf_counter()
+    legs = getattr(builder, preview_strategy)(**preview_args)
+    print(f"{preview_strategy} on {preview_symbol} (spot {builder._spot():.2f}) "
+          f"built in {(time.perf_counter() - t0) * 1e3:.1f} ms:")
+    print_legs(legs)
+    print("Disconnecting from IB...")
+    app.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+令牌桶限速: 控制每秒发往 TWS 的消息数, 避免触发 IB 的消息频率限制 (默认每秒 50 条).
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    rate: 每秒补充的令牌数; burst: 桶容量 (允许的瞬时突发条数), 默认等于 rate.
+    多线程共享同一个实例即可实现全局限速.
+    """
+    def __init__(self, rate: float, burst: float = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, n: float = 1.0) -> bool:
+        """有足够令牌则取走并返回 True, 否则立即返回 False."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= n:
+                self._tokens -= n
+                return True
+            return False
+
+    def acquire(self, n: float = 1.0) -> float:
+        """阻塞直到取得令牌, 返回等待的秒数 (0 表示未被限速)."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return waited
+                delay = (n - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下单流程时间线记录: 按阶段记录 span, 导出为 Chrome trace-event JSON,
+可直接拖进 Perfetto (ui.perfetto.dev) 或 chrome://tracing 查看.
+下单脚本默认不写文件, 设置环境变量 IB_TRACE_PATH 时在结束时导出到该路径:
+    IB_TRACE_PATH=trace.json python IBOption4Leg.py
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class TraceRecorder:
+    """
+    记录三类事件:
+      - span(): 同一线程内的完整区间 (ph="X"), 用 with 包住一个阶段;
+      - begin()/end(): 跨线程的异步区间 (ph="b"/"e"), 例如 placeOrder 发出到首个回报;
+      - instant(): 瞬时事件 (ph="i"), 例如每一次部分成交.
+    track 是时间线上的一行, 例如 "session" 或 "order 1234".
+    max_events: 最多保留的时间线事件数, 超出后丢弃最早的 (长时间运行时内存有界);
+    track 名称等元数据不受此限制.
+    """
+    def __init__(self, process_name: str = "HedgeTools", max_events: int = 100000):
+        self._t0 = time.monotonic_ns()
+        self._pid = os.getpid()
+        self._meta = [{
+            "ph": "M", "name": "process_name", "pid": self._pid, "tid": 0,
+            "args": {"name": process_name},
+        }]
+        self._events = deque(maxlen=max_events)
+        self.dropped = 0
+        # track 名称 -> tid
+        self._tracks = {}
+        self._track_lock = threading.Lock()
+        # 异步区间 key -> (name, track)
+        self._open = {}
+
+    def _now_us(self) -> float:
+        return (time.monotonic_ns() - self._t0) / 1000.0
+
+    def _tid(self, track: str) -> int:
+        tid = self._tracks.get(track)
+        if tid is not None:
+            return tid
+        with self._track_lock:
+            tid = self._tracks.get(track)
+            if tid is None:
+                tid = len(self._tracks) + 1
+                self._tracks[track] = tid
+                self._meta.append({
+                    "ph": "M", "name": "thread_name", "pid": self._pid, "tid": tid,
+                    "args": {"name": track},
+                })
+                self._meta.append({
+                    "ph": "M", "name": "thread_sort_index", "pid": self._pid, "tid": tid,
+                    "args": {"sort_index": tid},
+                })
+        return tid
+
+    def _append(self, event: dict):
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+        self._events.append(event)
+
+    @property
+    def event_count(self) -> int:
+        return len(self._events)
+
+    @contextmanager
+    def span(self, name: str, track: str = "session", **args):
+        """记录 with 块的耗时."""
+        tid = self._tid(track)
+        ts = self._now_us()
+        try:
+            yield
+        finally:
+            self._append({
+                "ph": "X", "name": name, "cat": "stage", "pid": self._pid, "tid": tid,
+                "ts": ts, "dur": self._now_us() - ts, "args": args,
+            })
+
+    def begin(self, name: str, key, track: str = "session", **args):
+        """开始一个异步区间; 同一 key 若尚未结束则先将其结束."""
+        if key in self._open:
+            self.end(key)
+        self._open[key] = (name, track)
+        self._append({
+            "ph": "b", "name": name, "cat": "async", "id": str(key), "pid": self._pid,
+            "tid": self._tid(track), "ts": self._now_us(), "args": args,
+        })
+
+    def end(self, key, **args) -> bool:
+        """结束 key 对应的异步区间; 没有打开的区间时返回 False."""
+        opened = self._open.pop(key, None)
+        if opened is None:
+            return False
+        name, track = opened
+        self._append({
+            "ph": "e", "name": name, "cat": "async", "id": str(key), "pid": self._pid,
+            "tid": self._tid(track), "ts": self._now_us(), "args": args,
+        })
+        return True
+
+    def instant(self, name: str, track: str = "session", **args):
+        self._append({
+            "ph": "i", "s": "t", "name": name, "cat": "event", "pid": self._pid,
+            "tid": self._tid(track), "ts": self._now_us(), "args": args,
+        })
+
+    def export(self, path: str) -> str:
+        """写出 Chrome trace JSON, 未结束的异步区间在导出时统一收尾."""
+        for key in list(self._open):
+            self.end(key, unfinished=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self._meta + list(self._events), "displayTimeUnit": "ms"},
+                      f, ensure_ascii=False)
+        return path
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按标的维护的隐含波动率曲面: 每个到期日一条 SVI (raw) 曲线
+    w(k) = a + b * (rho * (k - m) + sqrt((k - m)^2 + sigma^2)),  w = iv^2 * t,  k = ln(K / F)
+由整条链向量化反解出的 IV 拟合 (加权 Levenberg-Marquardt, 只用 numpy).
+
+新报价到来时从上一次的参数出发 (warm start), 通常几步就收敛, 不必从头拟合;
+冷启动时从几组初值中取最好的.
+曲面给出没有买卖价的行权价的理论价 (fair_value), get_option_data 用它代替 "无报价".
+
+    surface = VolSurface("UVXY")
+    surface.update(expiry, spot, strikes, rights, bid, ask)
+    surface.fair_value(expiry, [20.0, 21.0], "P", spot)
+"""
+
+import datetime
+import threading
+import time
+
+import numpy as np
+
+from IBPayoff import bs_price, implied_vol
+
+# 冷启动的 (rho, m, sigma) 初值
+_SEEDS = ((-0.3, 0.0, 0.1), (-0.6, 0.05, 0.2), (0.0, -0.05, 0.05))
+
+
+def _years(expiry: str, now: datetime.datetime) -> float:
+    close = datetime.datetime.strptime(expiry[:8], "%Y%m%d").replace(hour=16)
+    return max((close - now).total_seconds(), 43200.0) / (365.0 * 86400.0)
+
+
+def svi_variance(params, k) -> np.ndarray:
+    """SVI 总方差 w(k)."""
+    a, b, rho, m, sigma = params
+    d = np.asarray(k, dtype=float) - m
+    return a + b * (rho * d + np.sqrt(d * d + sigma * sigma))
+
+
+def _jacobian(params, k: np.ndarray) -> np.ndarray:
+    _, b, rho, m, sigma = params
+    d = k - m
+    s = np.sqrt(d * d + sigma * sigma)
+    return np.column_stack((np.ones_like(k), rho * d + s, b * d, -b * (rho + d / s), b * sigma / s))
+
+
+def _project(params) -> np.ndarray:
+    """参数约束: b >= 0, |rho| < 1, sigma > 0, 最小总方差 a + b*sigma*sqrt(1-rho^2) >= 0."""
+    a, b, rho, m, sigma = params
+    b = max(b, 1e-8)
+    rho = min(max(rho, -0.999), 0.999)
+    sigma = max(sigma, 1e-4)
+    a = max(a, 1e-10 - b * sigma * np.sqrt(1.0 - rho * rho))
+    return np.array([a, b, rho, m, sigma])
+
+
+def fit_svi(k, w, weights=None, initial=None, max_iter: int = 100, tol: float = 1e-12):
+    """
+    加权最小二乘拟合 SVI, 返回 (params, 迭代次数, 加权均方根误差).
+    initial 给出时只从它出发 (warm start), 否则依次尝试 _SEEDS 取最好的.
+    """
+    k = np.asarray(k, dtype=float)
+    w = np.asarray(w, dtype=float)
+    weights = np.ones_like(k) if weights is None else np.asarray(weights, dtype=float)
+    weights = weights / weights.sum()
+    if initial is not None:
+        starts = [_project(np.asarray(initial, dtype=float))]
+    else:
+        slope = max((w.max() - w.min()) / max(k.max() - k.min(), 1e-6), 1e-3)
+        starts = [_project((0.5 * w.min(), slope, rho, m, sigma)) for rho, m, sigma in _SEEDS]
+
+    best = None
+    total_iter = 0
+    for params in starts:
+        r = svi_variance(params, k) - w
+        cost = float(np.sum(weights * r * r))
+        lam = 1e-3
+        for _ in range(max_iter):
+            total_iter += 1
+            J = _jacobian(params, k)
+            JW = J * weights[:, None]
+            A = J.T @ JW
+            g = JW.T @ r
+            try:
+                step = np.linalg.solve(A + lam * np.diag(np.diag(A) + 1e-12), -g)
+            except np.linalg.LinAlgError:
+                break
+            trial = _project(params + step)
+            r_trial = svi_variance(trial, k) - w
+            cost_trial = float(np.sum(weights * r_trial * r_trial))
+            if cost_trial < cost:
+                done = cost - cost_trial <= tol * max(cost, 1e-16)
+                params, r, cost = trial, r_trial, cost_trial
+                lam = max(lam / 3.0, 1e-9)
+                if done:
+                    break
+            else:
+                lam *= 4.0
+                if lam > 1e8:
+                    break
+        if best is None or cost < best[1]:
+            best = (params, cost)
+    return best[0], total_iter, float(np.sqrt(best[1]))
+
+
+class SVISlice:
+    """一个到期日的拟合结果. t: 到期时间 (年); forward: 远期价; rmse 为总方差的加权均方根误差."""
+    def __init__(self, expiry: str, params, t: float, forward: float, rmse: float, iterations: int,
+                 points: int):
+        self.expiry = expiry
+        self.params = params
+        self.t = t
+        self.forward = forward
+        self.rmse = rmse
+        self.iterations = iterations
+        self.points = points
+        self.fitted_at = time.time()
+
+    def iv(self, strikes) -> np.ndarray:
+        k = np.log(np.asarray(strikes, dtype=float) / self.forward)
+        return np.sqrt(np.maximum(svi_variance(self.params, k), 0.0) / self.t)
+
+    def __repr__(self):
+        a, b, rho, m, sigma = self.params
+        return (f"SVISlice({self.expiry} a={a:.5f} b={b:.4f} rho={rho:.3f} m={m:.4f} sigma={sigma:.4f} "
+                f"rmse={self.rmse:.2e} iter={self.iterations} n={self.points})")
+
+
+class VolSurface:
+    """
+    symbol: 标的; rate: 无风险利率 (远期价 F = spot * e^(rt)).
+    min_points: 一个到期日至少需要的有效 IV 个数, 不足时保留上一次的拟合.
+    多个线程共享时内部加锁.
+    """
+    def __init__(self, symbol: str, rate: float = 0.0, min_points: int = 5):
+        self.symbol = symbol
+        self.rate = rate
+        self.min_points = min_points
+        self.slices = {}
+        self._lock = threading.Lock()
+
+    def fit_iv(self, expiry: str, spot: float, strikes, iv, t: float, weights=None):
+        """用已算好的 IV 拟合 (或 warm start 更新) 一个到期日, 返回 SVISlice; 点数不足时返回原有的."""
+        expiry = expiry[:8]
+        strikes = np.asarray(strikes, dtype=float)
+        iv = np.asarray(iv, dtype=float)
+        ok = np.isfinite(iv) & (iv > 1e-3) & (iv < 4.9) & (strikes > 0)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+            ok &= np.isfinite(weights) & (weights > 0)
+        previous = self.slices.get(expiry)
+        if ok.sum() < self.min_points:
+            return previous
+        forward = spot * np.exp(self.rate * t)
+        k = np.log(strikes[ok] / forward)
+        params, iterations, rmse = fit_svi(k, iv[ok] ** 2 * t, None if weights is None else weights[ok],
+                                           None if previous is None else previous.params)
+        fitted = SVISlice(expiry, params, t, forward, rmse, iterations, int(ok.sum()))
+        with self._lock:
+            self.slices[expiry] = fitted
+        return fitted
+
+    def update(self, expiry: str, spot: float, strikes, rights, bid, ask, now: datetime.datetime = None):
+        """
+        用一组报价更新一个到期日: 向量化反解中间价的 IV, 每个行权价取虚值一侧 (只有实值报价时也用),
+        按买卖价差加权 (价差越小权重越大).
+        """
+        strikes = np.asarray(strikes, dtype=float)
+        is_call = np.array([str(r).upper().startswith("C") for r in rights])
+        bid = np.asarray(bid, dtype=float)
+        ask = np.asarray(ask, dtype=float)
+        t = _years(expiry, now or datetime.datetime.now())
+        forward = spot * np.exp(self.rate * t)
+        quoted = np.isfinite(bid) & np.isfinite(ask) & (bid > 0) & (ask >= bid)
+        otm = quoted & (is_call == (strikes >= forward))
+        use = otm | (quoted & ~np.isin(strikes, strikes[otm]))
+        if use.sum() < self.min_points:
+            return self.slices.get(expiry[:8])
+        mid = 0.5 * (bid[use] + ask[use])
+        iv = implied_vol(mid, spot, strikes[use], t, is_call[use], self.rate)
+        weights = 1.0 / np.maximum(ask[use] - bid[use], 0.01)
+        return self.fit_iv(expiry, spot, strikes[use], iv, t, weights)
+
+    def update_chain(self, chain, min_dte: int = 0, max_dte: int = None) -> dict:
+        """由 IBSpreadScanner.OptionChain (已向量化算好 IV) 更新各到期日, 返回 {expiry: SVISlice}."""
+        fitted = {}
+        # 每个行权价取虚值一侧: 低于标的价用 put, 其余用 call
+        cols = np.arange(len(chain.strikes))
+        side = (chain.strikes >= chain.spot).astype(int)
+        for e in chain.expiry_range(min_dte, max_dte):
+            iv = chain.iv[e, cols, side]
+            spread = chain.ask[e, cols, side] - chain.bid[e, cols, side]
+            result = self.fit_iv(chain.expiries[e], chain.spot, chain.strikes, iv, chain.years[e],
+                                 1.0 / np.maximum(np.nan_to_num(spread, nan=np.inf), 0.01))
+            if result is not None:
+                fitted[chain.expiries[e]] = result
+        return fitted
+
+    def iv(self, expiry: str, strikes):
+        """曲面上的隐含波动率; 该到期日尚未拟合时返回 None."""
+        fitted = self.slices.get(expiry[:8])
+        return None if fitted is None else fitted.iv(strikes)
+
+    def fair_value(self, expiry: str, strikes, right: str, spot: float, now: datetime.datetime = None):
+        """按曲面 IV 的 Black-Scholes 理论价 (每股); 该到期日尚未拟合时返回 None."""
+        fitted = self.slices.get(expiry[:8])
+        if fitted is None:
+            return None
+        t = _years(expiry, now or datetime.datetime.now())
+        strikes = np.asarray(strikes, dtype=float)
+        return bs_price(spot, strikes, t, fitted.iv(strikes), right.upper().startswith("C"), self.rate)
+
+
+def main():
+    """用合成报价演示冷启动与 warm start 的迭代次数和耗时."""
+    rng = np.random.default_rng(0)
+    spot, expiry = 100.0, (datetime.date.today() + datetime.timedelta(days=30)).strftime("%Y%m%d")
+    strikes = np.arange(70.0, 131.0, 1.0)
+    t = _years(expiry, datetime.datetime.now())
+    true = (0.004, 0.08, -0.5, 0.02, 0.12)
+    surface = VolSurface("SYN")
+    for tick in range(6):
+        params = np.array(true) * (1.0 + 0.02 * tick)
+        iv = np.sqrt(svi_variance(params, np.log(strikes / spot)) / t)
+        rights = np.where(strikes >= spot, "C", "P")
+        price = bs_price(spot, strikes, t, iv, rights == "C")
+        half = np.maximum(0.01, 0.02 * price) * rng.uniform(0.5, 1.5, len(strikes))
+        bid, ask = price - half, price + half
+        bid[rng.choice(len(strikes), 8, replace=False)] = np.nan  # 部分行权价没有报价
+        t0 = time.perf_counter()
+        fitted = surface.update(expiry, spot, strikes, rights, bid, ask)
+        elapsed = (time.perf_counter() - t0) * 1e3
+        missing = strikes[np.isnan(bid)]
+        fair = surface.fair_value(expiry, missing, "C", spot)
+        error = np.max(np.abs(fair - bs_price(spot, missing, t, np.sqrt(
+            svi_variance(params, np.log(missing / spot)) / t), True)))
+        print(f"{'cold' if tick == 0 else 'warm'} fit: {fitted.iterations:>3} iterations {elapsed:6.2f} ms, "
+              f"rmse {fitted.rmse:.2e}, max fair-value error on {len(missing)} unquoted strikes {error:.4f}")
+
+
+if __name__ == "__main__":
+    main()